@@ -0,0 +1,67 @@
+"""Measures the memory used to retain comparisons for the final reports of `stream-report --export-reports`: a list of
+the loaded comparisons (as they were retained before) against a `ComparisonStore` with a small `max_memory`, and the
+time to add them and to export a DiffReport from each.
+
+Usage: python -m benchmarks.bench_comparison_store [--comparisons 5000] [--max-memory 4M]
+"""
+import argparse
+import io
+import time
+import tracemalloc
+from typing import Callable, Iterable, Tuple
+
+from traffic_comparator.comparison_store import ComparisonStore, parse_byte_size
+from traffic_comparator.data import Request, Response
+from traffic_comparator.reports import DiffReport
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparison_lines(comparisons: int):
+    hits = [{"_index": "movies", "_id": str(i), "_source": {"title": f"Movie {i}", "year": 1950 + i}}
+            for i in range(20)]
+    for i in range(comparisons):
+        body = {"took": 5, "hits": {"total": {"value": 20, "relation": "eq"}, "hits": hits}}
+        shadow_body = body if i % 10 else {**body, "timed_out": True}
+        yield ResponseComparison(Response(statuscode=200, latency=10, body=body),
+                                 Response(statuscode=200, latency=12, body=shadow_body),
+                                 Request(http_method="GET", uri="/movies/_search")).to_json()
+
+
+def measure(retain: Callable[[Iterable[str]], Iterable[ResponseComparison]],
+            lines: Iterable[str]) -> Tuple[float, float, float]:
+    """Returns the seconds to retain the comparisons, the memory still allocated once they're retained, in MB, and the
+    seconds to export a DiffReport of them."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    retained = retain(lines)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    DiffReport(retained).export(io.StringIO())
+    return elapsed, current / 1024 / 1024, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comparisons", type=int, default=5000)
+    parser.add_argument("--max-memory", default="4M")
+    args = parser.parse_args()
+    lines = list(make_comparison_lines(args.comparisons))
+
+    def retain_store(lines):
+        # As `StreamingReportGenerator.update` does, the line is loaded (without its bodies) for the running stats.
+        store = ComparisonStore(parse_byte_size(args.max_memory))
+        for line in lines:
+            ResponseComparison.from_json(line, include_bodies=False)
+            store.add_record(line)
+        return store
+
+    for name, retain in [("list (original)", lambda lines: [ResponseComparison.from_json(line) for line in lines]),
+                         (f"store, max {args.max_memory}", retain_store)]:
+        elapsed, memory, export = measure(retain, lines)
+        print(f"{name:>18}: retained in {elapsed:>6.2f} s, {memory:>7.1f} MB in memory, DiffReport in {export:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
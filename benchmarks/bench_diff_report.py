@@ -0,0 +1,62 @@
+"""Measures the time and size of exporting a DiffReport of many mismatches that repeat a few patterns: the original
+approach (an ndiff of every mismatch, with `difflib.Differ`) against the current one (a unified diff of each distinct
+diff signature).
+
+Usage: python -m benchmarks.bench_diff_report [--mismatches 2000] [--patterns 5] [--documents 200]
+"""
+import argparse
+import difflib
+import io
+import time
+
+from traffic_comparator import codec
+from traffic_comparator.data import Request, Response
+from traffic_comparator.reports import DiffReport
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparisons(mismatches: int, patterns: int, documents: int):
+    hits = [{"_id": str(i), "_source": {"title": f"Movie {i}"}} for i in range(documents)]
+    body = {"took": 5, "hits": {"total": documents, "hits": hits}}
+    for i in range(mismatches):
+        shadow_body = {**body, "timed_out": i % patterns}
+        yield ResponseComparison(Response(statuscode=200, body=body), Response(statuscode=200, body=shadow_body),
+                                 Request(http_method="GET", uri=f"/movies-{i}/_search"))
+
+
+def export_every_ndiff(comparisons, output: io.StringIO) -> None:
+    # This is the original export: the summary, then an ndiff of both responses for every mismatch.
+    output.write(str(DiffReport(comparisons)))
+    d = difflib.Differ()
+    for comp in comparisons:
+        if comp.are_identical():
+            continue
+        output.write('=' * 40 + "\n")
+        primary_response_lines = [f"Status code: {comp.primary_response.statuscode}",
+                                  f"Headers: {comp.primary_response.headers}"] + \
+            codec.dumps(comp.primary_response.body, sort_keys=True, indent=2).splitlines()
+        shadow_response_lines = [f"Status code: {comp.shadow_response.statuscode}",
+                                 f"Headers: {comp.shadow_response.headers}"] + \
+            codec.dumps(comp.shadow_response.body, sort_keys=True, indent=2).splitlines()
+        output.write("\n".join(list(d.compare(primary_response_lines, shadow_response_lines))) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mismatches", type=int, default=2000)
+    parser.add_argument("--patterns", type=int, default=5)
+    parser.add_argument("--documents", type=int, default=200)
+    args = parser.parse_args()
+    comparisons = list(make_comparisons(args.mismatches, args.patterns, args.documents))
+
+    for name, export in [("ndiff of every mismatch (original)", export_every_ndiff),
+                         ("unified diff per signature", lambda comps, output: DiffReport(comps).export(output))]:
+        output = io.StringIO()
+        start = time.perf_counter()
+        export(comparisons, output)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>35}: {elapsed:>6.2f} s, {len(output.getvalue()) / 1024:>9.1f} KB exported")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Measures `stream --input-file` throughput (triples/sec) as the number of workers grows, against streaming the same
+file through a single loader (where the triples are parsed in the main process and only compared in the workers).
+
+Usage: python -m benchmarks.bench_file_input [--lines 20000] [--hits 20] [--max-workers N] [--chunk-size 1048576]
+"""
+import argparse
+import gzip
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader, TriplesFileDataLoader
+
+
+def run(data_loader, lines: int, workers: int) -> float:
+    analyzer = StreamingAnalyzer(data_loader, io.StringIO(), workers=workers)
+    start = time.perf_counter()
+    analyzer.start()
+    return lines / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "triples.log")
+        with open(path, 'w') as f:
+            f.writelines(make_triples_lines(args.lines, hits=args.hits))
+        with open(path, 'rb') as f, gzip.open(path + ".gz", 'wb') as compressed:
+            compressed.write(f.read())
+
+        print(f"{'workers':>8} {'streamed lines/s':>17} {'file lines/s':>13} {'gzip file lines/s':>18}")
+        workers = 1
+        while workers <= args.max_workers:
+            with open(path, 'rb') as f:
+                streamed = run(StreamingDataLoader(f), args.lines, workers)
+            from_file = run(TriplesFileDataLoader(path, args.chunk_size), args.lines, workers)
+            from_gzip = run(TriplesFileDataLoader(path + ".gz", args.chunk_size), args.lines, workers)
+            print(f"{workers:>8} {streamed:>17.0f} {from_file:>13.0f} {from_gzip:>18.0f}")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
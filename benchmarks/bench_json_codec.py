@@ -0,0 +1,42 @@
+"""Measures end-to-end lines/sec for each json codec: loading triples and comparing them (`stream`), then loading
+the comparisons back (as `stream-report` and `dump-to-sqlite` do).
+
+Usage: python -m benchmarks.bench_json_codec [--lines 5000] [--hits 20]
+"""
+import argparse
+import io
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator import codec
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    args = parser.parse_args()
+
+    lines = make_triples_lines(args.lines, hits=args.hits)
+    print(f"{'codec':>8} {'stream lines/s':>15} {'load lines/s':>13} {'end-to-end lines/s':>19}")
+    for codec_name in codec.available_codecs():
+        codec.set_codec(codec_name)
+        output = io.StringIO()
+        start = time.perf_counter()
+        StreamingAnalyzer(StreamingDataLoader(iter(lines)), output).start()
+        stream_time = time.perf_counter() - start
+
+        comparison_lines = output.getvalue().splitlines()
+        start = time.perf_counter()
+        for line in comparison_lines:
+            ResponseComparison.from_json(line)
+        load_time = time.perf_counter() - start
+        print(f"{codec_name:>8} {args.lines / stream_time:>15.0f} {args.lines / load_time:>13.0f} "
+              f"{args.lines / (stream_time + load_time):>19.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Measures the time per comparison and the memory of the LatencyRegressionReport's sketches (which don't depend on the
+number of comparisons) against retaining every pair of latencies, and how often an endpoint without a regression is
+flagged as one (the false positive rate of the bootstrap confidence intervals).
+
+Usage: python -m benchmarks.bench_latency_regression [--comparisons 10000 100000] [--endpoints 20] [--trials 50]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.latency_analysis import PairedLatencyBreakdown
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparisons(comparisons: int, endpoints: int, slowdown: float = 1.0, seed: int = 0):
+    rng = random.Random(seed)
+    requests = [Request(http_method="GET", uri=f"/index-{i}/_search") for i in range(endpoints)]
+    for i in range(comparisons):
+        latency = rng.lognormvariate(3, 0.5)
+        yield ResponseComparison(Response(statuscode=200, latency=latency),
+                                 Response(statuscode=200, latency=latency * slowdown * rng.lognormvariate(0, 0.1)),
+                                 requests[i % endpoints])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comparisons", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--endpoints", type=int, default=20)
+    parser.add_argument("--trials", type=int, default=50)
+    args = parser.parse_args()
+
+    for comparisons in args.comparisons:
+        data = list(make_comparisons(comparisons, args.endpoints))
+        tracemalloc.start()
+        start = time.perf_counter()
+        pairs = [(c.primary_response.latency, c.shadow_response.latency) for c in data]
+        elapsed = time.perf_counter() - start
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del pairs
+        print(f"{'retained pairs':>16}: {comparisons:>7} comparisons, {elapsed / comparisons * 1e6:>5.1f} us each, "
+              f"{memory / 1024:>8.0f} KB")
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        breakdown = PairedLatencyBreakdown()
+        for comparison in data:
+            breakdown.add_comparison(comparison)
+        elapsed = time.perf_counter() - start
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{'sketches':>16}: {comparisons:>7} comparisons, {elapsed / comparisons * 1e6:>5.1f} us each, "
+              f"{memory / 1024:>8.0f} KB")
+
+    # Each trial is an endpoint without a regression, so any trial that's flagged is a false positive.
+    flagged = 0
+    for trial in range(args.trials):
+        breakdown = PairedLatencyBreakdown(seed=trial)
+        for comparison in make_comparisons(1000, 1, seed=trial):
+            breakdown.add_comparison(comparison)
+        flagged += any(d.is_regression for d in breakdown.overall.quantile_differences())
+    print(f"{flagged} of {args.trials} endpoints without a regression were flagged")
+
+
+if __name__ == "__main__":
+    main()
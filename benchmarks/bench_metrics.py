@@ -0,0 +1,56 @@
+"""Measures the overhead of recording the metrics served with `--metrics-port`: lines/sec of `run` (comparisons passed
+to the report generator) and of reading comparisons (as `stream-report` does), with the metrics disabled and enabled,
+and the time to expose them for a scrape.
+
+Usage: python -m benchmarks.bench_metrics [--lines 5000] [--hits 20] [--repeat 3]
+"""
+import argparse
+import io
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator import metrics
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.report_generator import StreamingReportGenerator
+from traffic_comparator.wire_format import read_comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    parser.add_argument("--repeat", type=int, default=3, help="The best of this many runs is shown.")
+    args = parser.parse_args()
+    lines = make_triples_lines(args.lines, hits=args.hits)
+    output = io.StringIO()
+    StreamingAnalyzer(StreamingDataLoader(iter(lines)), output).start()
+    comparison_lines = output.getvalue().encode()
+
+    def run():
+        report_generator = StreamingReportGenerator(io.StringIO(), retain_comparisons=False)
+        StreamingAnalyzer(StreamingDataLoader(iter(lines))).run([report_generator])
+
+    def read():
+        for _ in read_comparisons(io.BytesIO(comparison_lines), include_bodies=False):
+            pass
+
+    for name, fn in [("run", run), ("read comparisons", read)]:
+        for enabled in [False, True]:
+            metrics.set_enabled(enabled)
+            elapsed = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                fn()
+                elapsed.append(time.perf_counter() - start)
+            print(f"{name:>16}, metrics {'enabled' if enabled else 'disabled':>8}: "
+                  f"{args.lines / min(elapsed):>8.0f} lines/s")
+
+    start = time.perf_counter()
+    exposition = metrics.expose()
+    elapsed = time.perf_counter() - start
+    print(f"Exposing {len(exposition.splitlines())} lines of metrics takes {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
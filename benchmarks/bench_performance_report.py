@@ -0,0 +1,93 @@
+"""Measures the time to compute the latency stats of a PerformanceReport, with percentiles for each endpoint and status
+class, from many comparisons: the original approach (lists of latencies, a `np.percentile` call per percentile list and
+a dict of lists per group) against the current one (the columns of a `LatencyTable`, and grouped quantiles), and the
+time to add comparisons to each.
+
+Usage: python -m benchmarks.bench_performance_report [--comparisons 10000000] [--endpoints 50] [--added 200000]
+"""
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.latency_analysis import LatencyTable, by_endpoint, by_status_class, mean, quantiles
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_table(comparisons: int, endpoints: int) -> LatencyTable:
+    rng = np.random.default_rng(0)
+    table = LatencyTable()
+    table.endpoints = [f"GET /index-{i}/_search" for i in range(endpoints)]
+    table.extend(primary_latency=rng.lognormal(3, 0.5, comparisons),
+                 shadow_latency=rng.lognormal(3.1, 0.5, comparisons),
+                 primary_status=rng.choice([200, 404], comparisons, p=[0.95, 0.05]),
+                 shadow_status=rng.choice([200, 404, 503], comparisons, p=[0.94, 0.05, 0.01]),
+                 endpoint=rng.integers(0, endpoints, comparisons))
+    return table
+
+
+def original_stats(rows) -> None:
+    # This is the original approach, extended with the same breakdowns: lists of the latencies, grouped in dicts.
+    primary_latencies, shadow_latencies = [], []
+    by_group = defaultdict(lambda: ([], []))
+    for primary, shadow, primary_status, shadow_status, endpoint in rows:
+        primary_latencies.append(primary)
+        shadow_latencies.append(shadow)
+        for group in [endpoint, (primary_status // 100, shadow_status // 100)]:
+            by_group[group][0].append(primary)
+            by_group[group][1].append(shadow)
+    for latencies in [primary_latencies, shadow_latencies]:
+        for percentile in [99, 90, 50]:
+            np.percentile(latencies, percentile)
+        np.average(latencies)
+    for primary, shadow in by_group.values():
+        deltas = [s - p for p, s in zip(primary, shadow)]
+        for latencies in [primary, shadow, deltas]:
+            np.percentile(latencies, [50, 90, 99])
+
+
+def vectorized_stats(table: LatencyTable) -> None:
+    for column in [table.primary_latency, table.shadow_latency]:
+        quantiles(column, [0.99, 0.9, 0.5])
+        mean(column)
+    by_endpoint(table)
+    by_status_class(table)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comparisons", type=int, default=10_000_000)
+    parser.add_argument("--endpoints", type=int, default=50)
+    parser.add_argument("--added", type=int, default=200_000, help="The number of comparisons to time adding")
+    args = parser.parse_args()
+
+    table = make_table(args.comparisons, args.endpoints)
+    rows = zip(table.primary_latency.tolist(), table.shadow_latency.tolist(), table.primary_status.tolist(),
+               table.shadow_status.tolist(), table.endpoint.tolist())
+    for name, compute in [("lists and dicts (original)", lambda: original_stats(rows)),
+                          ("latency table", lambda: vectorized_stats(table))]:
+        start = time.perf_counter()
+        compute()
+        print(f"{name:>26}: stats of {args.comparisons} comparisons in {time.perf_counter() - start:>6.2f} s")
+
+    comparisons = [ResponseComparison(Response(statuscode=200, latency=10 + i % 7),
+                                      Response(statuscode=200, latency=12 + i % 5),
+                                      Request(http_method="GET", uri=f"/movies/_doc/{i % 1000}"))
+                   for i in range(args.added)]
+    primary_latencies, shadow_latencies = [], []
+    start = time.perf_counter()
+    for comparison in comparisons:
+        primary_latencies.append(comparison.primary_response.latency)
+        shadow_latencies.append(comparison.shadow_response.latency)
+    print(f"{'lists (original)':>26}: added {args.added} comparisons in {time.perf_counter() - start:>6.2f} s")
+    table = LatencyTable()
+    start = time.perf_counter()
+    for comparison in comparisons:
+        table.add_comparison(comparison)
+    print(f"{'latency table':>26}: added {args.added} comparisons in {time.perf_counter() - start:>6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Measures end-to-end lines/sec of `run` (comparisons passed to the report generator in memory) against the
+`stream | stream-report` round trip (comparisons serialized, then read back and rebuilt).
+
+Usage: python -m benchmarks.bench_run_pipeline [--lines 5000] [--hits 20]
+"""
+import argparse
+import io
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.report_generator import StreamingReportGenerator
+from traffic_comparator.wire_format import read_comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    args = parser.parse_args()
+    lines = make_triples_lines(args.lines, hits=args.hits)
+
+    start = time.perf_counter()
+    output = io.StringIO()
+    StreamingAnalyzer(StreamingDataLoader(iter(lines)), output).start()
+    report_generator = StreamingReportGenerator(io.StringIO(), retain_comparisons=False)
+    for comparison in read_comparisons(io.BytesIO(output.getvalue().encode('utf-8')), include_bodies=False):
+        report_generator.add(comparison)
+    report_generator.close()
+    piped = args.lines / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    report_generator = StreamingReportGenerator(io.StringIO(), retain_comparisons=False)
+    StreamingAnalyzer(StreamingDataLoader(iter(lines))).run([report_generator])
+    fused = args.lines / (time.perf_counter() - start)
+
+    print(f"{'stream | stream-report':>24}: {piped:>8.0f} lines/s")
+    print(f"{'run':>24}: {fused:>8.0f} lines/s ({fused / piped:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measures the time to compare two `_search` responses with large pages of hits: generic DeepDiff (as every body was
+compared before) against the search-hits comparator. The shadow's hits have the same documents, with some
+equal-score hits swapped, slightly different scores and a few changed sources.
+
+Usage: python -m benchmarks.bench_search_comparator [--hits 1000] [--repeat 5]
+"""
+import argparse
+import copy
+import random
+import time
+
+from deepdiff import DeepDiff
+
+from traffic_comparator.comparators import SearchResponseComparator
+from traffic_comparator.masks import DEFAULT_BODY_MASKS, Mask
+
+
+def make_search_bodies(rng: random.Random, hits: int):
+    primary_hits = [{"_index": "movies", "_id": str(i), "_score": round(10.0 - i // 4 * 0.01, 4),
+                     "_source": {"title": f"Movie {i}", "year": 1950 + i % 70, "tags": ["a", "b", "c"],
+                                 "rating": rng.uniform(0, 5)}}
+                    for i in range(hits)]
+    shadow_hits = copy.deepcopy(primary_hits)
+    for i in range(0, hits - 1, 8):
+        # Hits with the same score, in a different order.
+        shadow_hits[i], shadow_hits[i + 1] = shadow_hits[i + 1], shadow_hits[i]
+    for hit in shadow_hits:
+        hit["_score"] *= 1 + rng.uniform(-1e-6, 1e-6)
+    for hit in rng.sample(shadow_hits, 3):
+        hit["_source"]["year"] += 1
+
+    def body(hits_list):
+        return {"took": rng.randint(1, 50), "timed_out": False,
+                "hits": {"total": {"value": hits, "relation": "eq"}, "max_score": hits_list[0]["_score"],
+                         "hits": hits_list}}
+    return body(primary_hits), body(shadow_hits)
+
+
+def timed(fn, repeat: int) -> float:
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    primary, shadow = make_search_bodies(random.Random(0), args.hits)
+
+    mask = Mask(DEFAULT_BODY_MASKS)
+    deepdiff = timed(lambda: DeepDiff(mask.apply(primary), mask.apply(shadow)), args.repeat)
+    comparator = SearchResponseComparator()
+    search_hits = timed(lambda: comparator.compare(primary, shadow), args.repeat)
+    diff = comparator.compare(primary, shadow)
+    print(f"{'DeepDiff':>22}: {deepdiff * 1000:>8.1f} ms")
+    print(f"{'search-hits comparator':>22}: {search_hits * 1000:>8.1f} ms ({deepdiff / search_hits:.0f}x), "
+          f"differences: {sorted(diff)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Measures `dump-to-sqlite` rows/sec with batched, WAL-mode writes against committing every row, and the db size
+with each body compression (the bodies are deduplicated, so repetitive traffic takes much less space).
+
+Usage: python -m benchmarks.bench_sqlite_writer [--rows 5000] [--batch-size 500]
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+from datetime import timedelta
+from typing import Tuple
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.sqlite import BODY_COMPRESSIONS, SqliteDumper
+
+
+def run(comparison_lines, **dumper_kwargs) -> Tuple[float, int]:
+    """Returns the rows/sec and the size of the db in bytes."""
+    with tempfile.TemporaryDirectory() as directory:
+        db_file = os.path.join(directory, "comparisons.db")
+        dumper = SqliteDumper(db_file, **dumper_kwargs)
+        start = time.perf_counter()
+        for line in comparison_lines:
+            dumper.update(line)
+        dumper.close()
+        return len(comparison_lines) / (time.perf_counter() - start), os.path.getsize(db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    output = io.StringIO()
+    StreamingAnalyzer(StreamingDataLoader(iter(make_triples_lines(args.rows))), output).start()
+    comparison_lines = output.getvalue().splitlines()
+
+    # This is equivalent to the original behavior: a commit (and fsync) for every row, with the default journal.
+    per_row, _ = run(comparison_lines, batch_size=1, journal_mode="DELETE", synchronous="FULL")
+    batched, _ = run(comparison_lines, batch_size=args.batch_size, flush_interval=timedelta(seconds=1))
+    print(f"{'per-row commit':>24}: {per_row:>8.0f} rows/s")
+    print(f"{'batched (' + str(args.batch_size) + ', WAL)':>24}: {batched:>8.0f} rows/s ({batched / per_row:.1f}x)")
+    for compression in BODY_COMPRESSIONS:
+        rate, size = run(comparison_lines, batch_size=args.batch_size, body_compression=compression)
+        print(f"{'bodies: ' + compression:>24}: {rate:>8.0f} rows/s, {size / 1024:>8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
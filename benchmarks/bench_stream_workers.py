@@ -0,0 +1,42 @@
+"""Measures `stream` throughput (triples/sec) as the number of comparison workers grows.
+
+Usage: python -m benchmarks.bench_stream_workers [--lines 5000] [--hits 20] [--max-workers N]
+"""
+import argparse
+import io
+import os
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+
+
+def run(lines, workers: int, ordered: bool) -> float:
+    analyzer = StreamingAnalyzer(StreamingDataLoader(iter(lines)), io.StringIO(), workers=workers, ordered=ordered)
+    start = time.perf_counter()
+    analyzer.start()
+    return len(lines) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    lines = make_triples_lines(args.lines, hits=args.hits)
+    baseline = run(lines, 1, True)
+    print(f"{'workers':>8} {'ordered lines/s':>16} {'unordered lines/s':>18} {'speedup':>8}")
+    print(f"{1:>8} {baseline:>16.0f} {'-':>18} {1.0:>8.2f}")
+    workers = 2
+    while workers <= args.max_workers:
+        ordered = run(lines, workers, True)
+        unordered = run(lines, workers, False)
+        print(f"{workers:>8} {ordered:>16.0f} {unordered:>18.0f} {ordered / baseline:>8.2f}")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
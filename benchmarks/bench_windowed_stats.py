@@ -0,0 +1,42 @@
+"""Measures the cost of the windowed stats of the streaming display: the time to add a comparison (which doesn't depend
+on how many were added before) and to compute the windows for a display, for streams of increasing length.
+
+Usage: python -m benchmarks.bench_windowed_stats [--comparisons 10000 100000 1000000] [--rate 100]
+"""
+import argparse
+import random
+import time
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.streaming_stats import ComparisonStats, WindowedStats, format_windowed_summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--comparisons", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--rate", type=int, default=100, help="The number of comparisons per second of timestamps")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    comparisons = [ResponseComparison(Response(statuscode=200, latency=rng.lognormvariate(3, 0.5)),
+                                      Response(statuscode=200, latency=rng.lognormvariate(3, 0.5)),
+                                      Request(http_method="GET", uri="/movies/_search", timestamp=i))
+                   for i in range(1000)]
+    for count in args.comparisons:
+        cumulative, windowed = ComparisonStats(), WindowedStats()
+        start = time.perf_counter()
+        for i in range(count):
+            comparison = comparisons[i % len(comparisons)]
+            cumulative.update(comparison)
+            windowed.update(comparison, timestamp=i / args.rate)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        format_windowed_summary(cumulative, windowed)
+        display = time.perf_counter() - start
+        print(f"{count:>8} comparisons: {elapsed / count * 1e6:>5.1f} us each (with the cumulative stats), "
+              f"display in {display * 1000:>5.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Measures the size of the comparison stream and how fast a consumer loads it, for each wire format, with full and
+summary comparisons.
+
+Usage: python -m benchmarks.bench_wire_format [--lines 5000] [--hits 20]
+"""
+import argparse
+import io
+import time
+
+from benchmarks.common import make_triples_lines
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.wire_format import WIRE_FORMATS, RecordEncoder, read_comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--hits", type=int, default=20, help="Number of search hits in each response body.")
+    args = parser.parse_args()
+
+    lines = make_triples_lines(args.lines, hits=args.hits)
+    print(f"{'format':>16} {'KiB':>8} {'load comparisons/s':>19}")
+    for wire_format in WIRE_FORMATS:
+        for summary_only in [False, True]:
+            encoder = RecordEncoder(wire_format, summary_only)
+            if encoder.is_binary:
+                output: io.IOBase = io.BytesIO()
+            else:
+                output = io.StringIO()
+            StreamingAnalyzer(StreamingDataLoader(iter(lines)), output, record_encoder=encoder).start()
+            stream = output.getvalue()
+            stream_bytes = stream if type(stream) is bytes else stream.encode('utf-8')
+
+            start = time.perf_counter()
+            count = sum(1 for _ in read_comparisons(io.BytesIO(stream_bytes)))
+            load_time = time.perf_counter() - start
+            name = wire_format + (" (summary)" if summary_only else "")
+            print(f"{name:>16} {len(stream_bytes) / 1024:>8.0f} {count / load_time:>19.0f}")
+
+
+if __name__ == "__main__":
+    main()
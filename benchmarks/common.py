@@ -0,0 +1,55 @@
+import base64
+import json
+import random
+from typing import List
+
+
+def toBase64String(s: str) -> str:
+    return base64.b64encode(s.encode('utf-8')).decode('utf-8')
+
+
+def make_search_body(rng: random.Random, hits: int) -> dict:
+    return {
+        "took": rng.randint(1, 50),
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {
+            "total": {"value": hits, "relation": "eq"},
+            "max_score": 1.0,
+            "hits": [{"_index": "movies", "_id": str(i), "_score": 1.0,
+                      "_source": {"title": f"Movie {i}", "year": 1950 + i % 70, "tags": ["a", "b", "c"]}}
+                     for i in range(hits)]
+        }
+    }
+
+
+def make_triple(rng: random.Random, hits: int = 10, mismatch_rate: float = 0.1) -> dict:
+    """Build a Replayer-style triple for a search request. A fraction of the shadow responses differ from the primary
+    in one field, so that both the matching and the mismatching comparison paths are exercised."""
+    primary_body = make_search_body(rng, hits)
+    shadow_body = json.loads(json.dumps(primary_body))
+    shadow_body["took"] = rng.randint(1, 50)
+    if rng.random() < mismatch_rate:
+        shadow_body["hits"]["max_score"] = 0.5
+    return {
+        "request": {
+            "Request-URI": "/movies/_search", "Method": "GET", "HTTP-Version": "HTTP/1.1",
+            "Host": "localhost:9200", "content-type": "application/json",
+            "body": toBase64String(json.dumps({"query": {"match_all": {}}}))
+        },
+        "primaryResponse": {
+            "HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+            "content-type": "application/json; charset=UTF-8",
+            "response_time_ms": rng.randint(5, 100), "body": toBase64String(json.dumps(primary_body))
+        },
+        "shadowResponse": {
+            "HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+            "content-type": "application/json; charset=UTF-8",
+            "response_time_ms": rng.randint(5, 150), "body": toBase64String(json.dumps(shadow_body))
+        }
+    }
+
+
+def make_triples_lines(count: int, hits: int = 10, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [json.dumps(make_triple(rng, hits)) + "\n" for _ in range(count)]
@@ -1,78 +1,340 @@
+import asyncio
 import logging
 import sys
-from typing import IO, List, Tuple
+from datetime import timedelta
+from typing import IO, Callable, List, Optional, Tuple
 
 import click
 
+from traffic_comparator import codec, comparators, data, masks, metrics, profiling
 from traffic_comparator.analyzer import StreamingAnalyzer
-from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.comparison_store import DEFAULT_MAX_MEMORY, parse_byte_size
+from traffic_comparator.data_loader import StreamingDataLoader, TriplesFileDataLoader
 from traffic_comparator.report_generator import StreamingReportGenerator
-from traffic_comparator.sqlite import SqliteDumper
+from traffic_comparator.server import DEFAULT_PORT, DEFAULT_QUEUE_SIZE, IngestionServer
+from traffic_comparator.server import replay as replay_triples
+from traffic_comparator.sinks import BaseComparisonSink, ComparisonOutputSink
+from traffic_comparator.sqlite import (BODY_COMPRESSIONS, DEFAULT_BATCH_SIZE, DEFAULT_BODY_COMPRESSION,
+                                       DEFAULT_FLUSH_INTERVAL, DEFAULT_JOURNAL_MODE, DEFAULT_SYNCHRONOUS,
+                                       JOURNAL_MODES, SYNCHRONOUS_SETTINGS, SqliteDumper)
+from traffic_comparator.wire_format import DEFAULT_WIRE_FORMAT, WIRE_FORMATS, RecordEncoder, read_comparisons
 
 
 # Click is a python library that streamlines creating command line interfaces
 # in a more composable & readable way than argparse.
 # https://click.palletsprojects.com/en/8.1.x/api/
 # This line sets up a group of cli entrypoints -- currently the commands available
-# are `run` and `available_reports`.
+# are `stream`, `stream-report`, `dump-to-sqlite`, `run`, `serve`, `replay` and `available-reports`.
 @click.group()
 @click.option('-v', '--verbose', count=True)
-def cli(verbose: int):
+@click.option('--json-codec', type=click.Choice(codec.available_codecs()), default=None,
+              help=f"The json library used to parse and serialize data (defaults to {codec.DEFAULT_CODEC}, unless the "
+                   f"{codec.CODEC_ENVIRONMENT_VARIABLE} environment variable is set).")
+@click.option('--bulk-metadata-only', is_flag=True, default=False,
+              help="Only keep the action metadata (op type, index and id) of the operations in bulk request bodies, "
+                   "without parsing their sources. The request bodies are only used in reports and the sqlite dump.")
+@click.option('--score-tolerance', type=click.FloatRange(min=0), default=comparators.DEFAULT_SCORE_TOLERANCE,
+              show_default=True, help="The relative tolerance within which the scores of search hits (and the "
+                                      "floating point values in aggregations) are considered equal.")
+@click.option('--mask-file', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="A YAML or json file with the paths of the body and header fields to mask (i.e. ignore) in the "
+                   "comparisons and reports, in addition to the default ones. Paths can have wildcards, e.g. "
+                   "`hits.hits[*]._score`.")
+@click.option('--metrics-port', type=click.IntRange(min=0, max=65535), default=None,
+              help="Serve metrics (lines ingested, parse failures, comparisons, match counts, processing times and "
+                   "response latencies) in the Prometheus text format on this port, e.g. at "
+                   "`http://127.0.0.1:<port>/metrics`.")
+@click.option('--metrics-host', default=metrics.DEFAULT_METRICS_HOST, show_default=True,
+              help="The address to serve the metrics on, with `--metrics-port`.")
+@click.option('--profile', is_flag=True, default=False,
+              help="Time each stage of the processing of each record (parsing, body decoding, diffing, encoding, "
+                   "output, and each sink) and print a summary of the timings to stderr when the command exits, or "
+                   "when it receives SIGUSR1.")
+@click.option('--profile-output', type=click.Path(dir_okay=False, writable=True), default=None,
+              help="With `--profile`, also run the main process under cProfile and write its stats to this file "
+                   "(which can be read with `python -m pstats`).")
+def cli(verbose: int, json_codec: Optional[str], bulk_metadata_only: bool, score_tolerance: float,
+        mask_file: Optional[str], metrics_port: Optional[int], metrics_host: str, profile: bool,
+        profile_output: Optional[str]):
     if verbose == 1:
         logging.basicConfig(level=logging.INFO)
     if verbose >= 2:
         logging.basicConfig(level=logging.DEBUG)
+    if json_codec:
+        codec.set_codec(json_codec)
+    data.set_bulk_metadata_only(bulk_metadata_only)
+    comparators.set_score_tolerance(score_tolerance)
+    if mask_file:
+        try:
+            masks.set_active_masks(masks.load_mask_file(mask_file))
+        except masks.InvalidMaskFileException as e:
+            raise click.BadParameter(str(e), param_hint="'--mask-file'")
+    if metrics_port is not None:
+        try:
+            metrics.MetricsServer(metrics_host, metrics_port).start()
+        except OSError as e:
+            raise click.BadParameter(f"The metrics server couldn't be started: {e}", param_hint="'--metrics-port'")
+    if profile:
+        profiler = profiling.Profiler(sys.stderr, profile_output)
+        profiler.start()
+        click.get_current_context().call_on_close(profiler.stop)
 
     pass
 
 
+def shared_options(options: List[Callable]) -> Callable:
+    """Apply a list of click options that are shared between commands."""
+    def decorator(f):
+        for option in reversed(options):
+            f = option(f)
+        return f
+    return decorator
+
+
+WORKER_OPTIONS = [
+    click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True,
+                 help="Number of processes used to compare triples. With more than one, comparisons run in a "
+                      "process pool."),
+    click.option('--unordered', is_flag=True, default=False,
+                 help="With multiple workers, output comparisons as soon as they finish instead of in input order."),
+    click.option('--max-in-flight', type=click.IntRange(min=1), default=None,
+                 help="With multiple workers, the maximum number of triples being compared at once "
+                      "(defaults to 4 per worker)."),
+]
+
+INPUT_FILE_OPTION = click.option(
+    '--input-file', type=click.Path(exists=True, dir_okay=False), default=None,
+    help="Read the triples from this file (which can be gzip or zstd-compressed) instead of stdin. With multiple "
+         "workers, the file is split into chunks that are parsed and compared in parallel, and `--max-in-flight` is "
+         "the number of chunks (defaults to 2 per worker).")
+
+RECORD_FORMAT_OPTIONS = [
+    click.option('--format', 'wire_format', type=click.Choice(WIRE_FORMATS), default=DEFAULT_WIRE_FORMAT,
+                 show_default=True, help="The format of the comparisons: json lines, or length-prefixed binary "
+                 "frames (msgpack if it's installed). The consumers detect the format automatically."),
+    click.option('--summary-only', is_flag=True, default=False,
+                 help="Output summary comparisons, without the bodies, headers and diff values, for consumers that "
+                      "only aggregate (e.g. `stream-report` without exported reports)."),
+]
+
+
+def parse_max_memory(ctx, param, value) -> int:
+    try:
+        return parse_byte_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+EXPORT_REPORTS_OPTIONS = [
+    click.option("--export-reports", type=click.Tuple([str, click.File('w')]), multiple=True,
+                 help="A list of reports to export and the file path to export it to. This can be '-' for stdout. "
+                      "Reports that support streaming (DiffReport, PerformanceReport) are written while the "
+                      "comparisons arrive, and their summaries once the input ends."),
+    click.option("--max-memory", default=f"{DEFAULT_MAX_MEMORY // 1024 ** 2}M", show_default=True,
+                 callback=parse_max_memory,
+                 help="The memory used to retain the comparisons for the exported reports that don't support "
+                      "streaming (e.g. 512M or 2G), beyond which the oldest ones are spilled to a temporary file."),
+]
+
+SQLITE_OPTIONS = [
+    click.option('--db', type=click.Path(),
+                 help="Path to the sqlite database to dump data (db file does not have to exist yet)"),
+    click.option('--batch-size', type=click.IntRange(min=1), default=DEFAULT_BATCH_SIZE, show_default=True,
+                 help="The maximum number of rows written in a single transaction."),
+    click.option('--flush-interval', type=click.FloatRange(min=0), default=DEFAULT_FLUSH_INTERVAL.total_seconds(),
+                 show_default=True, help="The maximum number of seconds between writes. Pending rows are also "
+                 "written once they're this old while no more rows arrive."),
+    click.option('--journal-mode', type=click.Choice(JOURNAL_MODES, case_sensitive=False),
+                 default=DEFAULT_JOURNAL_MODE, show_default=True,
+                 help="The sqlite journal mode. WAL allows reading the db while it's being written."),
+    click.option('--synchronous', type=click.Choice(SYNCHRONOUS_SETTINGS, case_sensitive=False),
+                 default=DEFAULT_SYNCHRONOUS, show_default=True, help="The sqlite synchronous setting."),
+    click.option('--body-compression', type=click.Choice(BODY_COMPRESSIONS), default=DEFAULT_BODY_COMPRESSION,
+                 show_default=True, help="The compression of the (deduplicated) bodies. Reading compressed bodies "
+                 "through the comparisons view requires `register_body_functions`."),
+]
+
+
+# The sinks of the `run` and `serve` commands.
+SINK_OPTIONS = [
+    click.option('--report', is_flag=True, default=False,
+                 help="Print the running statistics, as `stream-report` does. This is the default if no other sink is "
+                      "selected."),
+    *EXPORT_REPORTS_OPTIONS,
+    click.option('--output-comparisons', is_flag=True, default=False,
+                 help="Print the comparisons to stdout, as `stream` does. The statistics are then printed to stderr."),
+    *RECORD_FORMAT_OPTIONS,
+    *SQLITE_OPTIONS,
+]
+
+
+def make_data_loader(input_file: Optional[str]) -> StreamingDataLoader:
+    if input_file is not None:
+        return TriplesFileDataLoader(input_file)
+    return StreamingDataLoader(sys.stdin)
+
+
+def make_sqlite_dumper(db, batch_size: int, flush_interval: float, journal_mode: str, synchronous: str,
+                       body_compression: str) -> SqliteDumper:
+    return SqliteDumper(db, batch_size=batch_size, flush_interval=timedelta(seconds=flush_interval),
+                        journal_mode=journal_mode, synchronous=synchronous, body_compression=body_compression)
+
+
+def export_final_reports(report_generator: StreamingReportGenerator, export_reports: List[Tuple[str, IO]],
+                         echo_to_stderr: bool = False) -> None:
+    # The reports were written when the report generator was finalized (or while the comparisons arrived, for the ones
+    # that support streaming).
+    for report, export_file in export_reports:
+        click.echo(f"{report} was exported to {export_file.name}", err=echo_to_stderr)
+
+
+def make_sinks(report: bool, export_reports: List[Tuple[str, IO]], max_memory: int, output_comparisons: bool,
+               wire_format: str, summary_only: bool, db, batch_size: int, flush_interval: float, journal_mode: str,
+               synchronous: str, body_compression: str
+               ) -> Tuple[List[BaseComparisonSink], Optional[StreamingReportGenerator]]:
+    """The sinks selected by the SINK_OPTIONS, and the report generator (if it's one of them)."""
+    sinks: List[BaseComparisonSink] = []
+    if output_comparisons:
+        record_encoder = RecordEncoder(wire_format, summary_only)
+        sinks.append(ComparisonOutputSink(sys.stdout.buffer if record_encoder.is_binary else sys.stdout,
+                                          record_encoder))
+    report_generator = None
+    if report or export_reports or (not output_comparisons and db is None):
+        report_generator = StreamingReportGenerator(sys.stderr if output_comparisons else sys.stdout,
+                                                    retain_comparisons=False, max_memory=max_memory,
+                                                    export_reports=export_reports)
+        sinks.append(report_generator)
+    if db is not None:
+        sinks.append(make_sqlite_dumper(db, batch_size, flush_interval, journal_mode, synchronous, body_compression))
+    return sinks, report_generator
+
+
+@INPUT_FILE_OPTION
+@shared_options(WORKER_OPTIONS)
+@shared_options(RECORD_FORMAT_OPTIONS)
 @cli.command()
-def stream():
+def stream(input_file: Optional[str], workers: int, unordered: bool, max_in_flight: Optional[int], wire_format: str,
+           summary_only: bool):
     """Process streaming input and print comparisons to OUTPUT (defaults to stdout).
     
     Accept streaming input from stdin in the form of Replayer-generated triples, compare them and
-    output (to stdout) json objects with a comparison of the primary and shadow responses."""
+    output (to stdout) json objects with a comparison of the primary and shadow responses. With `--input-file`, the
+    triples are read from a file instead."""
     # These set up the data_loader and analyzer listen on stdin and process (compare) data whenever it arrives.
-    data_loader = StreamingDataLoader(sys.stdin)
-    analyzer = StreamingAnalyzer(data_loader, sys.stdout)
+    data_loader = make_data_loader(input_file)
+    record_encoder = RecordEncoder(wire_format, summary_only)
+    output = sys.stdout.buffer if record_encoder.is_binary else sys.stdout
+    analyzer = StreamingAnalyzer(data_loader, output, workers=workers, ordered=not unordered,
+                                 max_in_flight=max_in_flight, record_encoder=record_encoder)
 
     # This will actually kick-off accepting stdin input and outputing comparison results to stdout.
     analyzer.start()
 
 
-@click.option("--export-reports", type=click.Tuple([str, click.File('w')]), multiple=True,
-              help="A list of reports to export and the file path to export it to. This can be '-' for stdout.")
+@shared_options(EXPORT_REPORTS_OPTIONS)
 @cli.command()
-def stream_report(export_reports: List[Tuple[str, IO]]):
+def stream_report(export_reports: List[Tuple[str, IO]], max_memory: int):
     """Process streaming comparisons and print summarized statistics to OUTPUT (defaults to stdout), and exports
     specified reports to the files provided.
     
     Accept streaming input from stdin in the form of trafficreplayer comparisons, and compile statistics on the
-    correctness and performance. When the streaming input finishes, reports are also exported to the specified files.
+    correctness and performance. The specified reports are exported to their files as the comparisons arrive (or when
+    the streaming input finishes, for reports that don't support streaming).
     """
     # The report generator will accept new lines (via `update`) and periodically update the display with
     # the correctness and performance report stats.
-    report_generator = StreamingReportGenerator(sys.stdout)
-    for line in sys.stdin:
-        report_generator.update(line)
+    report_generator = StreamingReportGenerator(sys.stdout, retain_comparisons=False, max_memory=max_memory,
+                                                export_reports=export_reports)
+    for comparison in read_comparisons(sys.stdin.buffer, include_bodies=report_generator.include_bodies):
+        report_generator.add(comparison)
 
     report_generator.finalize()
+    export_final_reports(report_generator, export_reports)
 
-    for report, export_file in export_reports:
-        report_generator.generate_final_report(report, export_file)
-        click.echo(f"{report} was exported to {export_file.name}")
 
-
-@click.option('--db', type=click.Path(),
-              help="Path to the sqlite database to dump data (db file does not have to exist yet)")
+@shared_options(SQLITE_OPTIONS)
 @cli.command()
-def dump_to_sqlite(db):
-    sqlite_dumper = SqliteDumper(db)
-    for line in sys.stdin:
-        sqlite_dumper.update(line)
+def dump_to_sqlite(db, batch_size: int, flush_interval: float, journal_mode: str, synchronous: str,
+                   body_compression: str):
+    sqlite_dumper = make_sqlite_dumper(db, batch_size, flush_interval, journal_mode, synchronous, body_compression)
+    for comparison in read_comparisons(sys.stdin.buffer):
+        sqlite_dumper.add(comparison)
     sqlite_dumper.close()
 
 
+@INPUT_FILE_OPTION
+@shared_options(WORKER_OPTIONS)
+@shared_options(SINK_OPTIONS)
+@cli.command()
+def run(input_file: Optional[str], workers: int, unordered: bool, max_in_flight: Optional[int], report: bool,
+        export_reports: List[Tuple[str, IO]], max_memory: int, output_comparisons: bool, wire_format: str,
+        summary_only: bool, db, batch_size: int, flush_interval: float, journal_mode: str, synchronous: str,
+        body_compression: str):
+    """Compare streaming input (or `--input-file`) and pass the comparisons directly to any of the sinks: the running
+    statistics and reports (`--report`, `--export-reports`), a sqlite database (`--db`) and stdout
+    (`--output-comparisons`).
+
+    This is equivalent to piping `stream` into `stream-report` and/or `dump-to-sqlite`, but runs in a single process,
+    without serializing and parsing every comparison.
+    """
+    sinks, report_generator = make_sinks(report, export_reports, max_memory, output_comparisons, wire_format,
+                                         summary_only, db, batch_size, flush_interval, journal_mode, synchronous,
+                                         body_compression)
+    analyzer = StreamingAnalyzer(make_data_loader(input_file), workers=workers, ordered=not unordered,
+                                 max_in_flight=max_in_flight)
+    analyzer.run(sinks)
+
+    if report_generator is not None:
+        export_final_reports(report_generator, export_reports, echo_to_stderr=output_comparisons)
+
+
+@shared_options(WORKER_OPTIONS)
+@shared_options(SINK_OPTIONS)
+@click.option('--host', default="127.0.0.1", show_default=True, help="The address to listen on for TCP connections.")
+@click.option('--port', type=click.IntRange(min=0), default=DEFAULT_PORT, show_default=True,
+              help="The port to listen on for TCP connections.")
+@click.option('--unix-socket', type=click.Path(), default=None,
+              help="Listen on this unix socket instead of TCP.")
+@click.option('--queue-size', type=click.IntRange(min=1), default=DEFAULT_QUEUE_SIZE, show_default=True,
+              help="The maximum number of received triples waiting to be compared, after which connections stop being "
+                   "read until there's room.")
+@cli.command()
+def serve(workers: int, unordered: bool, max_in_flight: Optional[int], report: bool,
+          export_reports: List[Tuple[str, IO]], max_memory: int, output_comparisons: bool, wire_format: str,
+          summary_only: bool, db, batch_size: int, flush_interval: float, journal_mode: str, synchronous: str,
+          body_compression: str, host: str, port: int, unix_socket: Optional[str], queue_size: int):
+    """Accept triples from any number of concurrent connections (e.g. from Replayers), compare them and pass the
+    comparisons to the sinks, as `run` does.
+
+    The server runs until it's interrupted (SIGINT or SIGTERM), and then the sinks are closed and the reports are
+    exported.
+    """
+    sinks, report_generator = make_sinks(report, export_reports, max_memory, output_comparisons, wire_format,
+                                         summary_only, db, batch_size, flush_interval, journal_mode, synchronous,
+                                         body_compression)
+    server = IngestionServer(sinks, host=host, port=port, unix_socket=unix_socket, workers=workers,
+                             ordered=not unordered, max_in_flight=max_in_flight, queue_size=queue_size)
+    asyncio.run(server.serve())
+
+    if report_generator is not None:
+        export_final_reports(report_generator, export_reports, echo_to_stderr=output_comparisons)
+
+
+@click.argument('triples_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--host', default="127.0.0.1", show_default=True, help="The address of the server.")
+@click.option('--port', type=click.IntRange(min=0), default=DEFAULT_PORT, show_default=True,
+              help="The port of the server.")
+@click.option('--unix-socket', type=click.Path(), default=None, help="Connect to this unix socket instead of TCP.")
+@click.option('--connections', type=click.IntRange(min=1), default=1, show_default=True,
+              help="The number of concurrent connections to spread the triples over.")
+@cli.command()
+def replay(triples_file: str, host: str, port: int, unix_socket: Optional[str], connections: int):
+    """Send the triples in TRIPLES_FILE to a `serve` command, e.g. to test it."""
+    lines_sent = asyncio.run(replay_triples(triples_file, host=host, port=port, unix_socket=unix_socket,
+                                            connections=connections))
+    click.echo(f"Sent {lines_sent} triples.", err=True)
+
+
 @cli.command()
 def available_reports():
     reports = StreamingReportGenerator.available_reports()
@@ -1,8 +1,5 @@
 #!/bin/bash
 
-while true
-do
-  nc -v -l -p 9220 | tee /dev/stderr | trafficcomparator -vv stream | trafficcomparator dump-to-sqlite --db $1
-  >&2 echo "Command has encountered error. Restarting now ..."
-  sleep 1
-done
+# The server accepts any number of concurrent (and successive) connections from the Replayer, so it doesn't need to be
+# restarted when one of them closes.
+exec trafficcomparator -v serve --host 0.0.0.0 --port 9220 --db $1
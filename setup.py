@@ -9,11 +9,15 @@ setuptools.setup(
     install_requires=[
         "Click",
         "deepdiff",
-        "numpy"
+        "numpy",
+        "orjson"
     ],
     extras_require={
         'dev': ['flake8', 'pytest'],
-        'data': ['jupyter', 'pandas', 'matplotlib']
+        'data': ['jupyter', 'pandas', 'matplotlib'],
+        'zstd': ['zstandard'],
+        'msgpack': ['msgpack'],
+        'yaml': ['pyyaml']
     },
     python_requires=">=3.9",
     entry_points={
@@ -2,8 +2,11 @@ import json
 from io import StringIO
 from unittest.mock import patch
 
+import pytest
+
 from traffic_comparator.analyzer import StreamingAnalyzer
 from traffic_comparator.data import Request, RequestResponsePair, Response
+from traffic_comparator.sinks import BaseComparisonSink, ComparisonOutputSink
 
 REQUEST = Request(
     timestamp=None,
@@ -51,9 +54,9 @@ SHADOW_PAIR = RequestResponsePair(REQUEST, SHADOW_RESPONSE, PRIMARY_PAIR)
 PRIMARY_PAIR.corresponding_pair = SHADOW_PAIR
 
 COMPARISON_DICT = {
-    'primary_response': PRIMARY_RESPONSE.__dict__,
-    'shadow_response': SHADOW_RESPONSE.__dict__,
-    'original_request': REQUEST.__dict__,
+    'primary_response': PRIMARY_RESPONSE.to_dict(),
+    'shadow_response': SHADOW_RESPONSE.to_dict(),
+    'original_request': REQUEST.to_dict(),
     '_status_code_diff': {"values_changed": {"root": {"new_value": 201, "old_value": 200}}},
     '_headers_diff': {},
     '_body_diff': {
@@ -78,3 +81,60 @@ def test_WHEN_streaming_analyzer_given_reqres_pair_THEN_outputs_comparison(MockD
     analyzer.start()
     assert analyzer._comparisons_count == 1
     assert json.loads(output_buffer.getvalue()) == COMPARISON_DICT
+
+
+@patch('traffic_comparator.data_loader.StreamingDataLoader', autospec=True)
+def test_WHEN_streaming_analyzer_has_multiple_workers_THEN_outputs_comparisons_in_order(MockDataLoader):
+    pairs = []
+    for latency in range(20):
+        primary_response = Response(statuscode=200, latency=latency, body={"latency": latency})
+        shadow_response = Response(statuscode=200, latency=latency, body={"latency": latency})
+        pairs.append((RequestResponsePair(REQUEST, primary_response), RequestResponsePair(REQUEST, shadow_response)))
+    MockDataLoader.next_input = lambda: pairs
+
+    output_buffer = StringIO()
+    analyzer = StreamingAnalyzer(MockDataLoader, output_buffer, workers=2, max_in_flight=3)
+    analyzer.start()
+    assert analyzer._comparisons_count == 20
+    latencies = [json.loads(line)["primary_response"]["latency"] for line in output_buffer.getvalue().splitlines()]
+    assert latencies == list(range(20))
+
+
+@patch('traffic_comparator.data_loader.StreamingDataLoader', autospec=True)
+def test_WHEN_streaming_analyzer_is_unordered_THEN_outputs_every_comparison(MockDataLoader):
+    MockDataLoader.next_input = lambda: [(PRIMARY_PAIR, SHADOW_PAIR)] * 10
+
+    output_buffer = StringIO()
+    analyzer = StreamingAnalyzer(MockDataLoader, output_buffer, workers=2, ordered=False)
+    analyzer.start()
+    assert analyzer._comparisons_count == 10
+    for line in output_buffer.getvalue().splitlines():
+        assert json.loads(line) == COMPARISON_DICT
+
+
+class RecordingSink(BaseComparisonSink):
+    def __init__(self) -> None:
+        self.comparisons = []
+        self.closed = False
+
+    def add(self, comparison) -> None:
+        self.comparisons.append(comparison)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@patch('traffic_comparator.data_loader.StreamingDataLoader', autospec=True)
+def test_WHEN_streaming_analyzer_runs_with_sinks_THEN_every_sink_gets_every_comparison(MockDataLoader, workers):
+    MockDataLoader.next_input = lambda: [(PRIMARY_PAIR, SHADOW_PAIR)] * 3
+
+    sinks = [RecordingSink(), RecordingSink()]
+    output_buffer = StringIO()
+    analyzer = StreamingAnalyzer(MockDataLoader, workers=workers)
+    analyzer.run(sinks + [ComparisonOutputSink(output_buffer)])
+    assert analyzer._comparisons_count == 3
+    for sink in sinks:
+        assert sink.closed
+        assert [comparison.to_dict() for comparison in sink.comparisons] == [COMPARISON_DICT] * 3
+    assert [json.loads(line) for line in output_buffer.getvalue().splitlines()] == [COMPARISON_DICT] * 3
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from traffic_comparator import codec
+from traffic_comparator.data import Response
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+@pytest.fixture(params=codec.available_codecs())
+def json_codec(request):
+    original_codec = codec.active_codec_name()
+    codec.set_codec(request.param)
+    yield request.param
+    codec.set_codec(original_codec)
+
+
+def test_WHEN_codec_round_trips_THEN_data_is_unchanged(json_codec):
+    data = {"b": [1, 2.5, None, True], "a": {"nested": "välue"}}
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumps(data).encode('utf-8')) == data
+    assert codec.dumps(data, sort_keys=True).index('"a"') < codec.dumps(data, sort_keys=True).index('"b"')
+    assert json.loads(codec.dumps(data, indent=2)) == data
+
+
+def test_WHEN_invalid_json_loaded_THEN_raises_json_decode_error(json_codec):
+    with pytest.raises(codec.JSONDecodeError):
+        codec.loads('{"hello": ')
+
+
+def test_WHEN_integers_beyond_64_bits_loaded_THEN_they_are_exact(json_codec):
+    document = '{"big": 18446744073709551616, "small": -9223372036854775809, "max": 18446744073709551615, ' \
+               '"fraction": 0.12345678901234567890, "id": "123456789012345678901"}'
+    expected = json.loads(document)
+    assert codec.loads(document) == expected
+    assert codec.loads(document.encode('utf-8')) == expected
+    assert codec.loads(memoryview(document.encode('utf-8'))) == expected
+    assert isinstance(codec.loads(document)["big"], int)
+    assert codec.loads('[1, -2, 9223372036854775807]') == [1, -2, 9223372036854775807]
+
+
+def test_WHEN_comparison_serialized_THEN_same_for_every_codec(json_codec):
+    comparison = ResponseComparison(Response(statuscode=200, headers={"a": "1"}, body={"a": 1, "b": [1, 2]}),
+                                    Response(statuscode=None, headers={"b": "1"}, body={"a": "x", "c": 2}))
+    expected_body_diff = json.loads(comparison.body_diff.to_json())
+    expected_status_code_diff = json.loads(comparison.status_code_diff.to_json())
+
+    jsonified = json.loads(comparison.to_json())
+    assert jsonified["_body_diff"] == expected_body_diff
+    assert jsonified["_status_code_diff"] == expected_status_code_diff
+    assert ResponseComparison.from_json(comparison.to_json()).body_diff == expected_body_diff
+
+
+def test_WHEN_unknown_codec_set_THEN_fails():
+    with pytest.raises(codec.UnknownJsonCodecException):
+        codec.set_codec("not-a-codec")
@@ -0,0 +1,222 @@
+import pytest
+
+from traffic_comparator import comparators
+from traffic_comparator.comparators import (BulkResponseComparator, SearchResponseComparator, find_body_comparator,
+                                            match_bulk_items)
+from traffic_comparator.data import Request, Response
+from traffic_comparator.response_comparison import COMPARISON_TIER_COUNTS, ResponseComparison
+
+
+def bulk_item(op_type, document_id, status=201, result="created", error_type=None, version=1, seq_no=0):
+    details = {"_index": "movies", "_id": document_id, "_version": version, "_seq_no": seq_no,
+               "_primary_term": 1, "_shards": {"total": 2, "successful": 1, "failed": 0}, "status": status}
+    if error_type is not None:
+        details["error"] = {"type": error_type, "reason": f"[{document_id}]: something went wrong"}
+    else:
+        details["result"] = result
+    return {op_type: details}
+
+
+BULK_REQUEST = Request(http_method="POST", uri="/movies/_bulk")
+
+
+def bulk_body(items, took=30):
+    return {"took": took, "errors": any("error" in next(iter(item.values())) for item in items), "items": items}
+
+
+def test_WHEN_bulk_items_differ_only_in_volatile_fields_THEN_bodies_are_identical():
+    primary = bulk_body([bulk_item("index", str(i), version=1, seq_no=i) for i in range(100)])
+    shadow = bulk_body([bulk_item("index", str(i), version=3, seq_no=2 * i) for i in range(100)], took=80)
+    tier_count = COMPARISON_TIER_COUNTS["body_bulk_items"]
+
+    comparison = ResponseComparison(Response(statuscode=200, body=primary), Response(statuscode=200, body=shadow),
+                                    BULK_REQUEST)
+    assert comparison.body_diff == {}
+    assert comparison.are_identical()
+    assert COMPARISON_TIER_COUNTS["body_bulk_items"] == tier_count + 1
+
+
+def test_WHEN_bulk_items_have_different_outcomes_THEN_diff_counts_them_by_outcome():
+    primary_items = [bulk_item("index", str(i)) for i in range(10)]
+    shadow_items = [bulk_item("index", str(i)) for i in range(10)]
+    for i in [2, 5, 7]:
+        shadow_items[i] = bulk_item("index", str(i), status=409, error_type="version_conflict_engine_exception")
+    shadow_items[9] = bulk_item("index", "9", status=200, result="updated")
+
+    comparison = ResponseComparison(Response(statuscode=200, body=bulk_body(primary_items)),
+                                    Response(statuscode=200, body=bulk_body(shadow_items)), BULK_REQUEST)
+    assert not comparison.are_identical()
+    # The rest of the body is compared as usual.
+    assert comparison.body_diff["values_changed"] == {"root['errors']": {"new_value": True, "old_value": False}}
+    items_diff = comparison.body_diff["bulk_items_changed"]["root['items']"]
+    assert items_diff["items"] == 10
+    assert items_diff["differing"] == 4
+    assert items_diff["by_outcome"] == {"created -> version_conflict_engine_exception": 3, "created -> updated": 1}
+    assert [example["primary_position"] for example in items_diff["examples"]] == [2, 5, 7, 9]
+    # The examples only have the fields that identify the items and their outcomes.
+    assert items_diff["examples"][0]["old_value"] == {"op_type": "index", "_index": "movies", "_id": "2",
+                                                      "status": 201, "result": "created", "error_type": None}
+    assert items_diff["examples"][0]["new_value"] == {"op_type": "index", "_index": "movies", "_id": "2",
+                                                      "status": 409, "result": None,
+                                                      "error_type": "version_conflict_engine_exception"}
+    assert comparison.to_dict(summary_only=True)["_body_diff"] == {"bulk_items_changed": ["root['items']"],
+                                                                   "values_changed": ["root['errors']"]}
+
+
+def test_WHEN_bulk_responses_have_the_same_failures_THEN_they_have_the_same_diff_signature():
+    def comparison(seq_no, failed_position):
+        primary_items = [bulk_item("index", f"{seq_no}-{i}", seq_no=seq_no + i) for i in range(5)]
+        shadow_items = [bulk_item("index", f"{seq_no}-{i}", seq_no=2 * seq_no + i) for i in range(5)]
+        shadow_items[failed_position] = bulk_item("index", f"{seq_no}-{failed_position}", status=409,
+                                                  error_type="version_conflict_engine_exception", seq_no=seq_no)
+        return ResponseComparison(Response(statuscode=200, body=bulk_body(primary_items)),
+                                  Response(statuscode=200, body=bulk_body(shadow_items)), BULK_REQUEST)
+
+    # The failures are of different documents, at different positions, with different volatile fields.
+    assert comparison(10, 3).diff_signature() == comparison(20, 1).diff_signature()
+    assert comparison(10, 3).diff_signature() != ResponseComparison(
+        Response(statuscode=200, body=bulk_body([bulk_item("index", "1")])),
+        Response(statuscode=200, body=bulk_body([bulk_item("index", "1", status=200, result="updated")])),
+        BULK_REQUEST).diff_signature()
+
+
+def test_WHEN_bulk_items_are_out_of_place_THEN_they_are_matched_by_id():
+    primary_items = [bulk_item("index", "a"), bulk_item("delete", "b", status=200, result="deleted"),
+                     bulk_item("index", "c")]
+    shadow_items = [primary_items[2], primary_items[0], primary_items[1], bulk_item("index", "d")]
+    assert list(match_bulk_items(primary_items, shadow_items)) == [(0, 1), (1, 2), (2, 0), (None, 3)]
+
+    diff = BulkResponseComparator().compare(bulk_body(primary_items), bulk_body(shadow_items))
+    assert diff["bulk_items_changed"]["root['items']"]["by_outcome"] == {"(missing) -> created": 1}
+
+
+def test_WHEN_bulk_item_ids_are_generated_by_each_cluster_THEN_they_are_matched_by_position():
+    primary_items = [bulk_item("index", "generated-1"), bulk_item("index", "generated-2")]
+    shadow_items = [bulk_item("index", "other-1"), bulk_item("index", "other-2")]
+    assert list(match_bulk_items(primary_items, shadow_items)) == [(0, 0), (1, 1)]
+    assert BulkResponseComparator().compare(bulk_body(primary_items), bulk_body(shadow_items)) == {}
+
+
+def test_WHEN_bodies_are_not_bulk_or_search_responses_THEN_no_comparator_applies():
+    assert isinstance(find_body_comparator(BULK_REQUEST, {"items": []}, {"items": []}), BulkResponseComparator)
+    # Other APIs' responses with an `items` list aren't bulk responses.
+    assert find_body_comparator(None, {"items": []}, {"items": []}) is None
+    assert find_body_comparator(Request(http_method="GET", uri="/_cat/items"), {"items": []}, {"items": []}) is None
+    assert isinstance(find_body_comparator(None, search_body([]), search_body([])), SearchResponseComparator)
+    assert find_body_comparator(None, {"hello": "world"}, {"items": []}) is None
+    assert find_body_comparator(None, "not json", None) is None
+
+
+def search_hit(document_id, score, title=None, shard=0):
+    return {"_index": "movies", "_id": document_id, "_score": score, "_shard": f"[movies][{shard}]",
+            "_source": {"title": title or f"Movie {document_id}"}}
+
+
+def search_body(hits, aggregations=None, took=5):
+    body = {"took": took, "timed_out": False, "hits": {"total": {"value": len(hits), "relation": "eq"},
+                                                       "max_score": max([h["_score"] for h in hits], default=None),
+                                                       "hits": hits}}
+    if aggregations is not None:
+        body["aggregations"] = aggregations
+    return body
+
+
+def genres(buckets):
+    return {"genres": {"doc_count_error_upper_bound": 0, "sum_other_doc_count": 0,
+                       "buckets": [{"key": key, "doc_count": count, "avg_rating": {"value": rating}}
+                                   for key, count, rating in buckets]}}
+
+
+def test_WHEN_search_hits_with_equal_scores_are_reordered_THEN_bodies_are_identical():
+    primary = search_body([search_hit("a", 2.0), search_hit("b", 1.0), search_hit("c", 1.0), search_hit("d", 0.5)],
+                          aggregations=genres([("drama", 3, 4.2), ("comedy", 1, 3.0)]))
+    shadow = search_body([search_hit("a", 2.00001, shard=3), search_hit("c", 1.0), search_hit("b", 1.0),
+                          search_hit("d", 0.5)], aggregations=genres([("comedy", 1, 3.0), ("drama", 3, 4.2000001)]),
+                         took=40)
+    tier_count = COMPARISON_TIER_COUNTS["body_search_hits"]
+
+    comparison = ResponseComparison(Response(statuscode=200, body=primary), Response(statuscode=200, body=shadow))
+    assert comparison.body_diff == {}
+    assert COMPARISON_TIER_COUNTS["body_search_hits"] == tier_count + 1
+
+
+@pytest.mark.parametrize("body", [search_body([search_hit(str(i), 1.0) for i in range(10)]),
+                                  bulk_body([bulk_item("index", str(i)) for i in range(10)])])
+def test_WHEN_bodies_are_identical_THEN_fast_path_is_used_before_the_comparators(body):
+    tier_counts = dict(COMPARISON_TIER_COUNTS)
+    comparison = ResponseComparison(Response(statuscode=200, body=body), Response(statuscode=200, body=dict(body)))
+    assert comparison.body_diff == {}
+    assert COMPARISON_TIER_COUNTS["body_fast"] == tier_counts.get("body_fast", 0) + 1
+    assert COMPARISON_TIER_COUNTS["body_search_hits"] == tier_counts.get("body_search_hits", 0)
+    assert COMPARISON_TIER_COUNTS["body_bulk_items"] == tier_counts.get("body_bulk_items", 0)
+
+
+def test_WHEN_search_hits_differ_THEN_membership_order_sources_and_scores_are_diffed_separately():
+    primary = search_body([search_hit("a", 3.0), search_hit("b", 2.0), search_hit("c", 1.0), search_hit("d", 0.5)])
+    shadow = search_body([search_hit("b", 2.0), search_hit("a", 3.0, title="Changed"), search_hit("c", 1.5),
+                          search_hit("e", 0.5)])
+    diff = SearchResponseComparator().compare(primary, shadow)
+    path = "root['hits']['hits']"
+    assert diff["search_hits_removed"][path] == {"count": 1, "examples": [("movies", "d")]}
+    assert diff["search_hits_added"][path] == {"count": 1, "examples": [("movies", "e")]}
+    assert diff["search_hits_order_changed"][path]["count"] == 2
+    assert diff["search_hit_sources_changed"][path]["examples"] == [
+        {"hit": ("movies", "a"), "old_value": {"title": "Movie a"}, "new_value": {"title": "Changed"}}]
+    assert diff["search_hit_scores_changed"][path]["examples"] == [
+        {"hit": ("movies", "c"), "old_value": 1.0, "new_value": 1.5}]
+    assert "search_hit_fields_changed" not in diff
+
+
+@pytest.mark.parametrize("score_tolerance, differs", [(0.01, False), (0.0001, True)])
+def test_WHEN_score_tolerance_is_set_THEN_scores_within_it_are_equal(score_tolerance, differs):
+    primary = search_body([search_hit("a", 1.0)])
+    shadow = search_body([search_hit("a", 1.001)])
+    comparators.set_score_tolerance(score_tolerance)
+    try:
+        diff = SearchResponseComparator().compare(primary, shadow)
+    finally:
+        comparators.set_score_tolerance(comparators.DEFAULT_SCORE_TOLERANCE)
+    assert ("search_hit_scores_changed" in diff) == differs
+    assert ("values_changed" in diff) == differs  # The max score
+
+
+def test_WHEN_counts_differ_slightly_THEN_they_are_not_within_the_score_tolerance():
+    primary = search_body([search_hit("a", 1.0)], aggregations=genres([("drama", 50000, 4.2)]))
+    shadow = search_body([search_hit("a", 1.0)], aggregations=genres([("drama", 50004, 4.2)]))
+    primary["hits"]["total"]["value"], shadow["hits"]["total"]["value"] = 100000, 100009
+    diff = SearchResponseComparator().compare(primary, shadow)
+    assert diff == {"values_changed": {
+        "root['hits']['total']['value']": {"new_value": 100009, "old_value": 100000},
+        "root['aggregations']['genres']['buckets']['drama']['doc_count']": {"new_value": 50004, "old_value": 50000}}}
+
+
+def test_WHEN_tiny_scores_differ_THEN_they_are_compared_relatively():
+    primary = search_body([search_hit("a", 0.00001)])
+    shadow = search_body([search_hit("a", 0.00009)])
+    diff = SearchResponseComparator().compare(primary, shadow)
+    assert "search_hit_scores_changed" in diff
+    assert diff["values_changed"] == {"root['hits']['max_score']": {"new_value": 0.00009, "old_value": 0.00001}}
+
+
+def test_WHEN_rest_of_body_and_comparator_both_change_values_THEN_both_are_in_the_diff():
+    primary = search_body([search_hit("a", 1.0)], aggregations={"a": {"value": 1}})
+    shadow = search_body([search_hit("a", 1.0)], aggregations={"a": {"value": 2}})
+    shadow["timed_out"] = True
+    comparison = ResponseComparison(Response(statuscode=200, body=primary), Response(statuscode=200, body=shadow))
+    assert comparison.body_diff == {"values_changed": {
+        "root['timed_out']": {"new_value": True, "old_value": False},
+        "root['aggregations']['a']['value']": {"new_value": 2, "old_value": 1}}}
+
+
+def test_WHEN_aggregation_buckets_differ_THEN_they_are_diffed_by_key():
+    primary = search_body([], aggregations=genres([("drama", 3, 4.2), ("comedy", 1, 3.0), ("horror", 2, 2.0)]))
+    shadow = search_body([], aggregations=genres([("comedy", 2, 3.0), ("drama", 3, 4.2), ("western", 1, 1.0)]))
+    diff = SearchResponseComparator().compare(primary, shadow)
+    buckets = "root['aggregations']['genres']['buckets']"
+    horror = {"key": "horror", "doc_count": 2, "avg_rating": {"value": 2.0}}
+    western = {"key": "western", "doc_count": 1, "avg_rating": {"value": 1.0}}
+    assert diff == {
+        "values_changed": {f"{buckets}['comedy']['doc_count']": {"new_value": 2, "old_value": 1}},
+        "dictionary_item_removed": {f"{buckets}['horror']": {"old_value": horror}},
+        "dictionary_item_added": {f"{buckets}['western']": {"new_value": western}},
+    }
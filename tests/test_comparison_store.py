@@ -0,0 +1,80 @@
+import csv
+import os
+from io import StringIO
+
+import pytest
+
+from traffic_comparator.comparison_store import ComparisonStore, parse_byte_size
+from traffic_comparator.data import Request, Response
+from traffic_comparator.report_generator import StreamingReportGenerator
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparison(i: int) -> ResponseComparison:
+    return ResponseComparison(Response(statuscode=200, latency=i + 1, body={"hits": i, "padding": "x" * 100}),
+                              Response(statuscode=200, latency=i + 2, body={"hits": i % 3, "padding": "x" * 100}),
+                              Request(http_method="GET", uri=f"/index-{i}/_search"))
+
+
+@pytest.mark.parametrize("size, expected", [("1048576", 1048576), ("512M", 512 * 1024 ** 2), ("2G", 2 * 1024 ** 3),
+                                            ("64kb", 64 * 1024), ("1MiB", 1024 ** 2)])
+def test_WHEN_byte_size_is_parsed_THEN_units_are_applied(size, expected):
+    assert parse_byte_size(size) == expected
+
+
+def test_WHEN_byte_size_is_invalid_THEN_exception_is_raised():
+    with pytest.raises(ValueError):
+        parse_byte_size("lots")
+
+
+def test_WHEN_comparisons_exceed_max_memory_THEN_oldest_are_spilled_and_all_are_read_in_order():
+    store = ComparisonStore(max_memory=2000)
+    for i in range(50):
+        store.add(make_comparison(i))
+    assert len(store) == 50
+    assert store.spilled > 0
+    assert store.memory <= 2000
+
+    for _ in range(2):
+        comparisons = list(store)
+        assert [c.original_request.uri for c in comparisons] == [f"/index-{i}/_search" for i in range(50)]
+        assert [c.are_identical() for c in comparisons] == [i % 3 == i for i in range(50)]
+        assert comparisons[10].shadow_response.body == {"hits": 1, "padding": "x" * 100}
+
+    spill_file = store._spill_file.name
+    store.close()
+    assert not os.path.exists(spill_file)
+    assert len(store) == 0
+
+
+def test_WHEN_comparisons_fit_in_memory_THEN_nothing_is_spilled():
+    store = ComparisonStore()
+    store.add(make_comparison(0))
+    store.add_record(make_comparison(1).to_json() + "\n")
+    assert store.spilled == 0
+    assert store._spill_file is None
+    assert [c.primary_response.latency for c in store] == [1, 2]
+
+
+def test_WHEN_summaries_are_stored_THEN_they_are_loaded_as_summaries():
+    store = ComparisonStore(max_memory=0)
+    store.add(ResponseComparison.from_json(make_comparison(4).to_json(summary_only=True)))
+    [comparison] = list(store)
+    assert comparison.is_summary
+    assert not comparison.are_identical()
+
+
+def test_WHEN_report_generator_spills_comparisons_THEN_exported_reports_include_all_of_them():
+    report_generator = StreamingReportGenerator(StringIO(), max_memory=1000)
+    for i in range(30):
+        report_generator.add(make_comparison(i))
+    report_generator.update(make_comparison(30).to_json())
+    report_generator.finalize()
+    assert report_generator._data.spilled > 0
+
+    diff_file, performance_file = StringIO(), StringIO()
+    report_generator.generate_final_report("DiffReport", diff_file)
+    report_generator.generate_final_report("PerformanceReport", performance_file)
+    assert "31 response were compared." in diff_file.getvalue()
+    rows = list(csv.reader(StringIO(performance_file.getvalue())))
+    assert [row[0] for row in rows[1:]] == [f"/index-{i}/_search" for i in range(31)]
@@ -1,4 +1,12 @@
-from traffic_comparator.data import Request
+import base64
+import gzip
+from unittest.mock import patch
+
+import pytest
+
+from traffic_comparator import data
+from traffic_comparator.data import (BulkOperation, Request, Response, decodeAndDecompressBody, parseBodyAsBulk,
+                                     parseBulkOperations, uriTemplate)
 
 REQUEST_TIMESTAMP = 1675811048
 REQUEST_URI = "/index1/_doc/1"
@@ -39,3 +47,115 @@ def test_WHEN_requests_identical_except_headers_THEN_are_not_equivalent():
     r2 = Request(timestamp=REQUEST_TIMESTAMP, headers="content-type: text/html", uri=REQUEST_URI, body=REQUEST_BODY)
     assert not r1.equivalent_to(r2)
     assert not r2.equivalent_to(r1)
+
+
+def test_WHEN_request_has_raw_body_THEN_decoded_only_when_accessed():
+    raw_body = base64.b64encode(gzip.compress(b'{"hello": "world"}'))
+    request = Request(uri=REQUEST_URI, headers={"content-encoding": "gzip"}, raw_body=raw_body)
+    assert not request.body_is_decoded
+    assert request.raw_body == raw_body
+
+    with patch("traffic_comparator.data.decodeAndDecompressBody",
+               wraps=decodeAndDecompressBody) as mock_decode:
+        assert request.body == REQUEST_BODY
+        assert request.body == REQUEST_BODY
+        assert mock_decode.call_count == 1
+    assert request.body_is_decoded
+    assert request.raw_body is None
+
+
+def test_WHEN_response_has_raw_body_THEN_status_and_latency_available_without_decoding():
+    response = Response(statuscode=200, latency=12, headers={"Content-Type": "application/json"},
+                        raw_body=base64.b64encode(b'{"hello": "world"}'))
+    assert response.statuscode == 200
+    assert response.latency == 12
+    assert response.headers == {"content-type": "application/json"}
+    assert not response.body_is_decoded
+
+    assert response == Response(statuscode=200, latency=12, headers={"content-type": "application/json"},
+                                body={"hello": "world"})
+    assert response.body_is_decoded
+
+
+def test_WHEN_response_body_is_decoded_explicitly_THEN_it_is_not_decoded_again():
+    response = Response(statuscode=200, raw_body=base64.b64encode(b'{"hello": "world"}'))
+    assert response.decode_body() == {"hello": "world"}
+    assert response.body_is_decoded
+    assert response.raw_body is None
+    assert response.decode_body() == {"hello": "world"}
+
+
+def test_WHEN_request_has_empty_raw_body_THEN_body_is_none():
+    request = Request(uri=REQUEST_URI, raw_body=b"")
+    assert request.body is None
+    assert request.raw_body is None
+
+
+def test_WHEN_uri_template_generated_THEN_index_and_ids_replaced():
+    assert uriTemplate("/") == "/"
+    assert uriTemplate("/index1/_doc/1") == "/{index}/_doc/{id}"
+    assert uriTemplate("/movies,books/_search?q=title:ring") == "/{index}/_search"
+    assert uriTemplate("/_cluster/health") == "/_cluster/health"
+    assert uriTemplate("/_bulk") == "/_bulk"
+    assert uriTemplate("/movies/_update/abc") == "/{index}/_update/{id}"
+    assert uriTemplate(None) is None
+    assert Request(uri="/index1/_doc/2").uri_template == "/{index}/_doc/{id}"
+
+
+BULK_BODY = (b'{"index": {"_index": "movies", "_id": "1"}}\n'
+             b'{"title": "Alien"}\r\n'
+             b'{"delete": {"_index": "movies", "_id": "2"}}\n'
+             b'\n'
+             b'{"update": {"_index": "movies", "_id": "3"}}\n'
+             b'{"doc": {"title": "Aliens"}}\n'
+             b'{"create": {"_index": "shows"}}\n'
+             b'{"title": "Firefly"}')
+
+
+def test_WHEN_bulk_body_parsed_THEN_actions_paired_with_sources():
+    operations = list(parseBulkOperations(BULK_BODY))
+    assert operations == [
+        BulkOperation("index", {"index": {"_index": "movies", "_id": "1"}}, {"title": "Alien"}),
+        BulkOperation("delete", {"delete": {"_index": "movies", "_id": "2"}}),
+        BulkOperation("update", {"update": {"_index": "movies", "_id": "3"}}, {"doc": {"title": "Aliens"}}),
+        BulkOperation("create", {"create": {"_index": "shows"}}, {"title": "Firefly"}),
+    ]
+    assert [(op.index, op.id) for op in operations] == \
+        [("movies", "1"), ("movies", "2"), ("movies", "3"), ("shows", None)]
+    # The same body as a string is parsed the same way.
+    assert list(parseBulkOperations(BULK_BODY.decode('utf-8'))) == operations
+
+
+def test_WHEN_bulk_body_parsed_with_metadata_only_THEN_sources_skipped_without_parsing():
+    # The source lines are skipped, so they don't need to be valid json.
+    body = BULK_BODY.replace(b'{"title": "Alien"}', b'not json')
+    operations = list(parseBulkOperations(body, metadata_only=True))
+    assert [op.op_type for op in operations] == ["index", "delete", "update", "create"]
+    assert all(op.source is None for op in operations)
+    assert parseBodyAsBulk(body, metadata_only=True) == [op.action for op in operations]
+
+
+def test_WHEN_bulk_body_has_invalid_lines_THEN_they_are_skipped():
+    body = b'not json\n{"title": "no action"}\n{"index": {"_index": "movies"}}\n{"title": "Alien"}\n'
+    assert parseBodyAsBulk(body) == [{"index": {"_index": "movies"}}, {"title": "Alien"}]
+
+
+def test_WHEN_source_line_of_bulk_action_is_invalid_THEN_action_is_kept_without_source():
+    body = b'{"index": {"_id": "1"}}\n{bad\n{"index": {"_id": "2"}}\n{"f": 2}\n'
+    assert list(parseBulkOperations(body)) == [BulkOperation("index", {"index": {"_id": "1"}}),
+                                               BulkOperation("index", {"index": {"_id": "2"}}, {"f": 2})]
+
+
+@pytest.mark.parametrize("metadata_only", [False, True])
+def test_WHEN_bulk_request_body_accessed_THEN_parsed_from_bytes(metadata_only):
+    raw_body = base64.b64encode(BULK_BODY)
+    data.set_bulk_metadata_only(metadata_only)
+    try:
+        request = Request(http_method="POST", uri="/_bulk", raw_body=raw_body)
+        with patch("traffic_comparator.data.decodeAndDecompressBody") as decode_as_string:
+            body = request.body
+        decode_as_string.assert_not_called()
+    finally:
+        data.set_bulk_metadata_only(False)
+    assert body == parseBodyAsBulk(BULK_BODY, metadata_only)
+    assert len(body) == (4 if metadata_only else 7)
@@ -0,0 +1,130 @@
+import random
+from io import StringIO
+
+import numpy as np
+import pytest
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.latency_analysis import (GrowableArray, LatencyTable, PairedLatencyBreakdown, by_endpoint,
+                                                 by_status_class, grouped_quantiles, overall)
+from traffic_comparator.report_generator import StreamingReportGenerator
+from traffic_comparator.reports import LatencyRegressionReport, PerformanceReport
+from traffic_comparator.sketches import PoissonWeights
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparison(uri: str, primary_latency, shadow_latency, shadow_status: int = 200,
+                    method: str = "GET") -> ResponseComparison:
+    return ResponseComparison(Response(statuscode=200, latency=primary_latency, body={}),
+                              Response(statuscode=shadow_status, latency=shadow_latency, body={}),
+                              Request(http_method=method, uri=uri))
+
+
+def test_WHEN_values_are_appended_past_capacity_THEN_array_grows_and_keeps_them():
+    array = GrowableArray(np.float64, capacity=2)
+    for i in range(5):
+        array.append(i)
+    array.extend([5, 6, 7])
+    assert len(array) == 8
+    assert array.values.tolist() == list(range(8))
+
+
+def test_WHEN_quantiles_are_grouped_THEN_they_match_numpy_for_each_group():
+    rng = np.random.default_rng(0)
+    values = rng.exponential(50, 1000)
+    values[::7] = np.nan
+    groups = rng.integers(0, 5, 1000)
+    qs = [0, 0.25, 0.5, 0.9, 0.99, 1]
+    counts, means, result = grouped_quantiles(values, groups, 6, qs)
+
+    for group in range(5):
+        group_values = values[(groups == group) & ~np.isnan(values)]
+        assert counts[group] == len(group_values)
+        assert means[group] == pytest.approx(group_values.mean())
+        np.testing.assert_allclose(result[group], np.quantile(group_values, qs))
+    # The last group is empty.
+    assert counts[5] == 0
+    assert np.isnan(result[5]).all()
+
+
+def test_WHEN_latencies_are_broken_down_THEN_groups_have_paired_deltas_and_ratios():
+    table = LatencyTable()
+    for i in range(1, 11):
+        table.add_comparison(make_comparison(f"/movies/_doc/{i}", 10 * i, 20 * i))
+    table.add_comparison(make_comparison("/movies/_search?q=jaws", 100, 50, shadow_status=503))
+    table.add_comparison(make_comparison("/movies/_search", -1, 50, shadow_status=503))
+
+    endpoints = by_endpoint(table)
+    assert [(group.name, group.count) for group in endpoints] == [("GET /{index}/_doc/{id}", 10),
+                                                                  ("GET /{index}/_search", 2)]
+    assert endpoints[0].primary[0] == pytest.approx(55)
+    assert endpoints[0].delta[0] == pytest.approx(55)
+    assert endpoints[0].ratio_geometric_mean == pytest.approx(2)
+    # The non positive latency is excluded, so only one request has both latencies.
+    assert endpoints[1].delta.tolist() == [-50, -50, -50]
+    assert endpoints[1].ratio_geometric_mean == pytest.approx(0.5)
+
+    assert [(group.name, group.count) for group in by_status_class(table)] == [("2xx -> 2xx", 10),
+                                                                               ("2xx -> 5xx", 2)]
+    assert overall(table).count == 12
+
+
+def test_WHEN_performance_report_is_printed_THEN_it_includes_the_breakdowns():
+    report = str(PerformanceReport([make_comparison("/movies/_doc/1", 10, 12),
+                                    make_comparison("/movies/_doc/2", 20, 18, method="PUT")]))
+    assert "50th percentile = 15.0" in report
+    assert "GET /{index}/_doc/{id}" in report
+    assert "PUT /{index}/_doc/{id}" in report
+    assert "2xx -> 2xx" in report
+
+
+def make_comparisons(count: int, slowdown: float, uri: str = "/movies/_search", seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        latency = rng.lognormvariate(3, 0.5)
+        yield make_comparison(uri, latency, latency * slowdown * rng.lognormvariate(0, 0.1))
+
+
+def test_WHEN_shadow_is_slower_for_an_endpoint_THEN_only_it_is_flagged():
+    breakdown = PairedLatencyBreakdown()
+    for comparison in [*make_comparisons(500, 1.3), *make_comparisons(500, 1.0, "/movies/_doc/1", seed=1)]:
+        breakdown.add_comparison(comparison)
+
+    [p50, p99] = breakdown.endpoints["GET /{index}/_search"].quantile_differences()
+    assert p50.is_regression and p99.is_regression
+    assert 0 < p50.low < p50.difference < p50.high
+    assert p50.difference == pytest.approx(p50.shadow - p50.primary)
+    assert breakdown.endpoints["GET /{index}/_search"].ratios.quantile(0.5) == pytest.approx(1.3, rel=0.05)
+    assert not any(d.is_regression for d in breakdown.endpoints["GET /{index}/_doc/{id}"].quantile_differences())
+    assert breakdown.overall.count == 1000
+
+
+def test_WHEN_breakdowns_are_merged_THEN_same_as_a_single_breakdown():
+    comparisons = list(make_comparisons(200, 1.1))
+    single, first, second = PairedLatencyBreakdown(), PairedLatencyBreakdown(), PairedLatencyBreakdown()
+    for comparison in comparisons:
+        single.add_comparison(comparison)
+    # The weights are drawn in the same order, so the merged replicates are the same.
+    first._weights = second._weights = PoissonWeights()
+    for i, comparison in enumerate(comparisons):
+        (first if i % 2 else second).add_comparison(comparison)
+    first.merge(second)
+    assert first.overall.count == single.overall.count
+    assert first.endpoints.keys() == single.endpoints.keys()
+    assert first.overall.quantile_differences() == single.overall.quantile_differences()
+
+
+def test_WHEN_regression_report_is_streamed_THEN_it_matches_the_report_of_all_comparisons():
+    comparisons = [*make_comparisons(100, 1.5), make_comparison("/movies/_search", None, 10)]
+    output = StringIO()
+    report_generator = StreamingReportGenerator(StringIO(), retain_comparisons=False,
+                                                export_reports=[("LatencyRegressionReport", output)])
+    for comparison in comparisons:
+        report_generator.add(comparison)
+    report_generator.finalize()
+
+    exported = output.getvalue()
+    assert exported == str(LatencyRegressionReport(comparisons))
+    assert "1 of 1 endpoints have a significant latency regression:\n    GET /{index}/_search\n" in exported
+    [row] = [line for line in exported.splitlines() if line.startswith("*GET /{index}/_search")]
+    assert row.split()[2] == "100"
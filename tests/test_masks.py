@@ -0,0 +1,126 @@
+import base64
+import copy
+import json
+
+import pytest
+
+from traffic_comparator import masks
+from traffic_comparator.data import Response
+from traffic_comparator.masks import (DEFAULT_BODY_MASKS, InvalidMaskException, InvalidMaskFileException, Mask, Masks,
+                                      load_mask_file, parse_mask)
+from traffic_comparator.reports import DiffReport
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def search_body(scores, took=5):
+    return {"took": took, "hits": {"max_score": max(scores), "hits": [
+        {"_id": str(i), "_score": score, "_source": {"title": f"Movie {i}"}} for i, score in enumerate(scores)]},
+        "aggregations": {"genres": {"meta": {"took": took}, "buckets": []},
+                         "years": {"meta": {"took": took}, "buckets": []}}}
+
+
+@pytest.mark.parametrize("mask, steps", [
+    ("took", [("key", "took")]),
+    ("root['took']", [("key", "took")]),
+    ("hits.hits[*]._score", [("key", "hits"), ("key", "hits"), ("any_index", None), ("key", "_score")]),
+    ("aggregations.*.meta", [("key", "aggregations"), ("any_key", None), ("key", "meta")]),
+    ("items[0]['key.with.dots']", [("key", "items"), ("index", 0), ("key", "key.with.dots")]),
+])
+def test_WHEN_mask_is_parsed_THEN_it_has_the_expected_steps(mask, steps):
+    assert parse_mask(mask) == steps
+
+
+@pytest.mark.parametrize("mask", ["", "hits[", "hits['unterminated"])
+def test_WHEN_mask_is_invalid_THEN_exception_is_raised(mask):
+    with pytest.raises(InvalidMaskException):
+        parse_mask(mask)
+
+
+def test_WHEN_mask_has_wildcards_THEN_every_matching_value_is_removed_without_modifying_the_body():
+    body = search_body([2.0, 1.0, 0.5])
+    original = copy.deepcopy(body)
+    masked = Mask(["took", "hits.hits[*]._score", "aggregations.*.meta", "hits.hits[0]._source"]).apply(body)
+
+    assert body == original
+    assert "took" not in masked
+    assert masked["hits"]["hits"] == [{"_id": "0"}, {"_id": "1", "_source": {"title": "Movie 1"}},
+                                      {"_id": "2", "_source": {"title": "Movie 2"}}]
+    assert masked["aggregations"] == {"genres": {"buckets": []}, "years": {"buckets": []}}
+    # The parts of the body that aren't masked are shared.
+    assert masked["hits"]["hits"][1]["_source"] is body["hits"]["hits"][1]["_source"]
+
+
+def test_WHEN_nothing_is_masked_THEN_value_is_returned_as_is():
+    body = search_body([1.0])
+    assert Mask(["missing", "hits.missing[*].x"]).apply(body) is body
+    assert Mask(["took"]).apply("not json") == "not json"
+    assert Mask(["took"]).apply(None) is None
+
+
+def test_WHEN_scores_are_masked_THEN_responses_with_different_scores_are_identical():
+    primary = Response(statuscode=200, body=search_body([2.0, 1.0]))
+    shadow = Response(statuscode=200, body=search_body([3.0, 1.5], took=40))
+    assert not ResponseComparison(primary, shadow).are_identical()
+
+    masks.set_active_masks(Masks(body=DEFAULT_BODY_MASKS + ["hits.max_score", "hits.hits[*]._score",
+                                                            "aggregations.*.meta"]))
+    try:
+        assert ResponseComparison(Response(statuscode=200, body=search_body([2.0, 1.0])),
+                                  Response(statuscode=200, body=search_body([3.0, 1.5], took=40))).are_identical()
+    finally:
+        masks.set_active_masks(Masks())
+
+
+def test_WHEN_diff_report_is_exported_THEN_masked_fields_are_hidden_but_responses_are_unchanged(tmp_path):
+    primary = Response(statuscode=200, headers={"date": "today", "x": "1"}, body={"took": 5, "hits": 1})
+    shadow = Response(statuscode=200, headers={"date": "tomorrow", "x": "1"}, body={"took": 9, "hits": 2})
+    report = DiffReport([ResponseComparison(primary, shadow)])
+    path = tmp_path / "diffs.log"
+    for _ in range(2):
+        with open(path, "w") as f:
+            report.export(f)
+    exported = path.read_text()
+    assert '"took"' not in exported
+    assert "today" not in exported
+    assert primary.body == {"took": 5, "hits": 1}
+    assert primary.headers == {"date": "today", "x": "1"}
+
+
+@pytest.mark.parametrize("extension", ["json", "yaml"])
+def test_WHEN_mask_file_is_loaded_THEN_its_masks_are_added_to_the_defaults(tmp_path, extension):
+    path = tmp_path / f"masks.{extension}"
+    if extension == "json":
+        path.write_text(json.dumps({"body": ["hits.hits[*]._score"], "headers": ["x-request-id"]}))
+    else:
+        pytest.importorskip("yaml")
+        path.write_text("body:\n  - hits.hits[*]._score\nheaders:\n  - x-request-id\n")
+    loaded = load_mask_file(path)
+    assert loaded.body.paths == DEFAULT_BODY_MASKS + ["hits.hits[*]._score"]
+    assert "x-request-id" in loaded.headers.paths and "date" in loaded.headers.paths
+
+
+def test_WHEN_mask_file_replaces_defaults_THEN_only_its_masks_are_used(tmp_path):
+    path = tmp_path / "masks.json"
+    path.write_text(json.dumps({"replace_defaults": True, "body": ["took"]}))
+    loaded = load_mask_file(path)
+    assert loaded.body.paths == ["took"]
+    assert not loaded.headers
+
+
+def test_WHEN_header_masks_have_uppercase_letters_THEN_they_match_the_lowercased_headers(tmp_path):
+    path = tmp_path / "masks.json"
+    path.write_text(json.dumps({"headers": ["X-Request-Id"]}))
+    masks = load_mask_file(path)
+    response = Response(statuscode=200, headers={"X-Request-Id": "1", "X-Other": "2"},
+                        raw_body=base64.b64encode(b"{}"))
+    assert masks.headers.apply(response.headers) == {"x-other": "2"}
+
+
+@pytest.mark.parametrize("contents", ['["took"]', '{"body": ["hits["]}', '{"bodies": ["took"]}', '{"body": [1]}',
+                                      'not json', '{"body": "hits"}',
+                                      '{"replace_defaults": true, "headers": "x-request-id"}'])
+def test_WHEN_mask_file_is_invalid_THEN_exception_is_raised(tmp_path, contents):
+    path = tmp_path / "masks.json"
+    path.write_text(contents)
+    with pytest.raises(InvalidMaskFileException):
+        load_mask_file(path)
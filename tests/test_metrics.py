@@ -0,0 +1,132 @@
+import base64
+import io
+import json
+import urllib.request
+
+import pytest
+
+from traffic_comparator import metrics
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data import Request, Response
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.sinks import BaseComparisonSink
+from traffic_comparator.wire_format import read_comparisons
+
+
+def toBase64String(s: str):
+    return base64.b64encode(s.encode('utf-8')).decode('utf-8')
+
+
+def make_log_entry(uri: str, shadow_status: str = "200") -> str:
+    return json.dumps({
+        "request": {"Request-URI": uri, "Method": "GET", "HTTP-Version": "HTTP/1.1", "body": ""},
+        "primaryResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+                            "response_time_ms": 14, "body": toBase64String('{"tagline": "You Know, for Search"}')},
+        "shadowResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": shadow_status, "Reason-Phrase": "OK",
+                           "response_time_ms": 190, "body": toBase64String('{"tagline": "You Know, for Search"}')}
+    })
+
+
+class NullSink(BaseComparisonSink):
+    def add(self, comparison) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.set_enabled(True)
+    yield
+    metrics.set_enabled(False)
+    metrics.reset()
+
+
+def metric_values(exposition: str) -> dict:
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in exposition.splitlines() if not line.startswith("#")}
+
+
+def test_WHEN_histogram_is_exposed_THEN_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "A test histogram.", [1, 5], ["stage"])
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value, "parse")
+    other = metrics.Histogram("test_seconds", "A test histogram.", [1, 5], ["stage"])
+    other.observe(2, "parse")
+    histogram.merge(other.values)
+
+    assert list(histogram.expose()) == [
+        "# HELP traffic_comparator_test_seconds A test histogram.",
+        "# TYPE traffic_comparator_test_seconds histogram",
+        'traffic_comparator_test_seconds_bucket{stage="parse",le="1.0"} 2',
+        'traffic_comparator_test_seconds_bucket{stage="parse",le="5.0"} 4',
+        'traffic_comparator_test_seconds_bucket{stage="parse",le="+Inf"} 5',
+        'traffic_comparator_test_seconds_sum{stage="parse"} 16.5',
+        'traffic_comparator_test_seconds_count{stage="parse"} 5']
+
+
+def test_WHEN_metrics_are_disabled_THEN_nothing_is_recorded():
+    metrics.reset()
+    metrics.count_line("triples")
+    metrics.observe_comparison(ResponseComparison(Response(statuscode=200), Response(statuscode=200)))
+    assert all(not metric.values for metric in metrics.METRICS)
+    assert metrics.take_snapshot() is None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_WHEN_triples_are_compared_THEN_metrics_are_recorded(enabled_metrics, workers):
+    lines = [make_log_entry(f"/movies/_doc/{i}", "200" if i % 4 else "503") + "\n" for i in range(8)] + ["{bad\n"]
+    StreamingAnalyzer(StreamingDataLoader(io.StringIO("".join(lines))), workers=workers).run([NullSink()])
+    values = metric_values(metrics.expose())
+
+    assert values['traffic_comparator_lines_ingested_total{input="triples"}'] == 9
+    assert values['traffic_comparator_parse_failures_total{input="triples"}'] == 1
+    assert values['traffic_comparator_comparisons_total'] == 8
+    assert values['traffic_comparator_status_matches_total'] == 6
+    assert values['traffic_comparator_identical_comparisons_total'] == 6
+    assert values['traffic_comparator_stage_duration_seconds_count{stage="compare"}'] == 8
+    assert values['traffic_comparator_stage_duration_seconds_count{stage="sink:NullSink"}'] == 8
+    labels = 'cluster="shadow",method="GET",uri_template="/{index}/_doc/{id}"'
+    assert values[f'traffic_comparator_response_latency_milliseconds_bucket{{{labels},le="100.0"}}'] == 0
+    assert values[f'traffic_comparator_response_latency_milliseconds_bucket{{{labels},le="250.0"}}'] == 8
+
+
+def test_WHEN_comparisons_are_read_THEN_lines_and_failures_are_counted(enabled_metrics):
+    comparison = ResponseComparison(Response(statuscode=200, latency=5), Response(statuscode=200, latency=6),
+                                    Request(http_method="GET", uri="/_search"))
+    stream = io.BytesIO(f"{comparison.to_json()}\nnot json\n{comparison.to_json()}\n".encode())
+    assert len(list(read_comparisons(stream))) == 2
+    values = metric_values(metrics.expose())
+    assert values['traffic_comparator_lines_ingested_total{input="comparisons"}'] == 3
+    assert values['traffic_comparator_parse_failures_total{input="comparisons"}'] == 1
+    assert values['traffic_comparator_comparisons_total'] == 2
+    assert values['traffic_comparator_stage_duration_seconds_count{stage="load"}'] == 2
+
+
+def test_WHEN_metrics_server_is_scraped_THEN_metrics_are_served(enabled_metrics):
+    server = metrics.MetricsServer(port=0)
+    server.start()
+    try:
+        metrics.count_parse_failure("triples")
+        host, port = server.address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            values = metric_values(response.read().decode())
+    finally:
+        server.stop()
+    assert values['traffic_comparator_parse_failures_total{input="triples"}'] == 1
+    assert values['traffic_comparator_comparisons_per_second'] == 0
+
+
+def test_WHEN_throughput_is_sampled_THEN_rate_is_over_the_samples(enabled_metrics):
+    times = iter([0, 1, 2])
+    sampler = metrics.ThroughputSampler(window=60, clock=lambda: next(times))
+    sampler.sample()
+    metrics.COMPARISONS.inc(True, True, amount=100)
+    sampler.sample()
+    metrics.COMPARISONS.inc(False, True, amount=50)
+    sampler.sample()
+    assert sampler.rate() == 75
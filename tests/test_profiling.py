@@ -0,0 +1,61 @@
+import io
+import os
+import pstats
+import signal
+
+import pytest
+
+from traffic_comparator import metrics
+from traffic_comparator.analyzer import compare
+from traffic_comparator.data import Request, Response
+from traffic_comparator.profiling import Profiler, format_stage_summary
+
+
+@pytest.fixture
+def profiled():
+    metrics.reset()
+    yield
+    metrics.set_enabled(False)
+    metrics.reset()
+
+
+def test_WHEN_histogram_quantile_is_estimated_THEN_it_is_interpolated_within_the_bucket():
+    histogram = metrics.Histogram("test_seconds", "A test histogram.", [1, 5, 10], ["stage"])
+    for value in [0.5, 2, 3, 4, 20]:
+        histogram.observe(value, "parse")
+    assert histogram.quantile(0.2, "parse") == 1
+    assert histogram.quantile(0.5, "parse") == pytest.approx(1 + 4 * 1.5 / 3)
+    assert histogram.quantile(0.99, "parse") == 10
+    assert histogram.quantile(0.5, "compare") == 0
+
+
+def test_WHEN_profiling_THEN_each_stage_is_timed_and_summarized(profiled, tmp_path):
+    output = io.StringIO()
+    profile_output = tmp_path / "profile.out"
+    profiler = Profiler(output, str(profile_output))
+    profiler.start()
+    for _ in range(3):
+        compare(Response(statuscode=200, body={"a": 1}), Response(statuscode=200, body={"a": 2}),
+                Request(http_method="GET", uri="/_search"))
+    profiler.stop()
+
+    summary = output.getvalue()
+    stage_lines = {line.split()[0]: line.split() for line in summary.splitlines()[2:]}
+    assert set(stage_lines) == {"compare", "decode"}
+    assert stage_lines["compare"][1] == "3"
+    assert "compare" in str(pstats.Stats(str(profile_output)).stats)
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="SIGUSR1 isn't available on this platform")
+def test_WHEN_profiler_receives_sigusr1_THEN_summary_is_printed(profiled):
+    output = io.StringIO()
+    profiler = Profiler(output)
+    profiler.start()
+    try:
+        metrics.observe_stage("parse", 0.001)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        assert output.getvalue() == f"Stage timings:\n{format_stage_summary()}"
+        assert "parse" in output.getvalue()
+    finally:
+        profiler.stop()
+    assert signal.getsignal(signal.SIGUSR1) == signal.SIG_DFL
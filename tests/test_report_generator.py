@@ -0,0 +1,136 @@
+from io import StringIO
+
+from traffic_comparator import reports
+from traffic_comparator.data import Request, Response
+from traffic_comparator.report_generator import StreamingReportGenerator
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.streaming_stats import WindowedStats
+
+
+def make_comparison_line(primary_status: int, shadow_status: int, primary_latency: int, shadow_latency: int) -> str:
+    return ResponseComparison(Response(statuscode=primary_status, latency=primary_latency, body={"a": 1}),
+                              Response(statuscode=shadow_status, latency=shadow_latency, body={"a": 1})).to_json()
+
+
+def test_WHEN_comparisons_streamed_THEN_running_stats_are_updated():
+    output = StringIO()
+    report_generator = StreamingReportGenerator(output, retain_comparisons=False)
+    for latency in range(1, 11):
+        report_generator.update(make_comparison_line(200, 200, latency, latency * 2))
+    report_generator.update(make_comparison_line(200, 404, 5, 5))
+    report_generator.update("not a comparison")
+    report_generator.finalize()
+
+    stats = report_generator._stats
+    assert stats.total_comparisons == 11
+    assert stats.number_identical == 10
+    assert stats.statuses_identical == 10
+    assert stats.primary_latencies.count == 11
+    assert stats.shadow_latencies.max == 20
+    assert len(report_generator._data) == 0
+    assert "11 response were compared." in output.getvalue()
+    assert "10 were identical, for a match rate of 90.91%" in output.getvalue()
+
+
+def test_WHEN_comparisons_retained_THEN_final_report_includes_them():
+    report_generator = StreamingReportGenerator(StringIO())
+    report_generator.update(make_comparison_line(200, 404, 5, 5))
+
+    export_file = StringIO()
+    report_generator.generate_final_report("DiffReport", export_file)
+    assert len(report_generator._data) == 1
+    assert "1 response were compared." in export_file.getvalue()
+
+
+def test_WHEN_reports_support_streaming_THEN_they_are_written_as_comparisons_arrive():
+    diff_file, performance_file = StringIO(), StringIO()
+    report_generator = StreamingReportGenerator(StringIO(), retain_comparisons=False,
+                                                export_reports=[("DiffReport", diff_file),
+                                                                ("PerformanceReport", performance_file)])
+    report_generator.update(make_comparison_line(200, 404, 5, 7))
+    report_generator.update(make_comparison_line(200, 200, 6, 8))
+
+    # The diff and rows are written before the input ends, and nothing is retained for them.
+    assert "Status code: 200" in diff_file.getvalue()
+    assert "response were compared" not in diff_file.getvalue()
+    assert len(performance_file.getvalue().splitlines()) == 3
+    assert len(report_generator._data) == 0
+
+    report_generator.finalize()
+    report_generator.finalize()
+    assert diff_file.getvalue().count("2 response were compared.") == 1
+    # The summary is a trailer.
+    assert diff_file.getvalue().index("Status code: 200") < diff_file.getvalue().index("2 response were compared.")
+
+
+def test_WHEN_performance_report_is_streamed_THEN_no_latencies_are_kept():
+    performance_file = StringIO()
+    report = reports.PerformanceReport()
+    report.start_export(performance_file)
+    for latency in range(1, 4):
+        report.export_comparison(ResponseComparison.from_json(make_comparison_line(200, 200, latency, latency)))
+    report.finish_export()
+    assert len(performance_file.getvalue().splitlines()) == 4
+    assert not hasattr(report, "_table")
+
+
+def test_WHEN_report_does_not_support_streaming_THEN_it_retains_comparisons_and_is_exported_at_the_end(monkeypatch):
+    class BufferedDiffReport(reports.DiffReport):
+        supports_streaming = False
+        start_export = reports.BaseReport.start_export
+        export_comparison = reports.BaseReport.export_comparison
+        finish_export = reports.BaseReport.finish_export
+    monkeypatch.setattr(reports, "BufferedDiffReport", BufferedDiffReport, raising=False)
+    diff_file = StringIO()
+    report_generator = StreamingReportGenerator(StringIO(), retain_comparisons=False,
+                                                export_reports=[("BufferedDiffReport", diff_file)])
+    report_generator.update(make_comparison_line(200, 404, 5, 7))
+    assert diff_file.getvalue() == ""
+    assert len(report_generator._data) == 0
+
+    report_generator.finalize()
+    assert diff_file.getvalue().lstrip().startswith("1 response were compared.")
+    assert "Status code: 200" in diff_file.getvalue()
+
+
+def make_timestamped_comparison(timestamp: int, shadow_status: int = 200, shadow_latency: int = 10):
+    return ResponseComparison(Response(statuscode=200, latency=10, body={"a": 1}),
+                              Response(statuscode=shadow_status, latency=shadow_latency, body={"a": 1}),
+                              Request(http_method="GET", uri="/_search", timestamp=timestamp))
+
+
+def test_WHEN_comparisons_have_timestamps_THEN_windows_only_include_recent_ones():
+    windowed = WindowedStats(windows=[60, 300], interval=10)
+    start = 1_700_000_000
+    # One comparison every 10 seconds for 10 minutes, and the last minute is all errors.
+    for i in range(60):
+        windowed.update(make_timestamped_comparison(start + 10 * i, 503 if i >= 54 else 200))
+    # A comparison that's older than the longest window is dropped.
+    windowed.update(make_timestamped_comparison(start))
+
+    last_minute, last_5_minutes = windowed.window(60), windowed.window(300)
+    assert last_minute.total_comparisons == 6
+    assert last_minute.statuses_identical == 0
+    assert last_5_minutes.total_comparisons == 30
+    assert last_5_minutes.statuses_identical == 24
+
+
+def test_WHEN_slots_are_reused_THEN_their_old_stats_are_reset():
+    windowed = WindowedStats(windows=[30], interval=10)
+    for timestamp in [0, 5, 10, 20, 30, 40]:
+        windowed.update(make_timestamped_comparison(timestamp))
+    # The window is the intervals starting at 20, 30 and 40.
+    assert windowed.window(30).total_comparisons == 3
+    # An out of order comparison within the window is still counted.
+    windowed.update(make_timestamped_comparison(25))
+    assert windowed.window(30).total_comparisons == 4
+
+
+def test_WHEN_stats_are_displayed_THEN_windows_are_shown_next_to_totals():
+    output = StringIO()
+    report_generator = StreamingReportGenerator(output, retain_comparisons=False)
+    for i in range(5):
+        report_generator.add(make_timestamped_comparison(1_700_000_000 + i, shadow_latency=20))
+    report_generator.finalize()
+    assert "last 1m     last 5m    last 15m       total" in output.getvalue()
+    assert "shadow p50 latency         20.0        20.0        20.0        20.0" in output.getvalue()
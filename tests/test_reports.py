@@ -0,0 +1,46 @@
+from io import StringIO
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.reports import SAMPLE_REQUESTS_PER_DIFF, DiffReport
+from traffic_comparator.response_comparison import ResponseComparison
+
+
+def make_comparison(uri: str, shadow_hits: int, documents: int = 5) -> ResponseComparison:
+    def body(hits):
+        return {"hits": hits, "documents": [{"id": i, "title": f"Document {i}"} for i in range(documents)]}
+    return ResponseComparison(Response(statuscode=200, body=body(1)), Response(statuscode=200, body=body(shadow_hits)),
+                              Request(http_method="GET", uri=uri))
+
+
+def test_WHEN_comparisons_differ_in_the_same_way_THEN_signatures_are_equal():
+    comparison = make_comparison("/a/_search", 2)
+    assert comparison.diff_signature() == make_comparison("/b/_search", 2).diff_signature()
+    assert comparison.diff_signature() != make_comparison("/a/_search", 3).diff_signature()
+    # A comparison that was serialized and loaded has the same signature.
+    assert ResponseComparison.from_json(comparison.to_json()).diff_signature() == comparison.diff_signature()
+
+
+def test_WHEN_mismatches_repeat_THEN_each_diff_is_shown_once_with_its_count():
+    comparisons = [make_comparison(f"/index-{i}/_search", 2) for i in range(50)] + \
+        [make_comparison("/other/_search", 3), make_comparison("/same/_search", 1)]
+    output = StringIO()
+    DiffReport(comparisons).export(output)
+    exported = output.getvalue()
+
+    assert "52 response were compared." in exported
+    assert "2 distinct diffs:" in exported
+    assert exported.count("Diff ") == 2
+    assert "first seen in GET /index-0/_search" in exported
+    assert "first seen in GET /other/_search" in exported
+    signature = comparisons[0].diff_signature()
+    samples = ", ".join(f"GET /index-{i}/_search" for i in range(SAMPLE_REQUESTS_PER_DIFF))
+    assert f"{signature}: 50 responses, e.g. {samples}\n" in exported
+
+
+def test_WHEN_bodies_are_large_THEN_only_the_changed_region_is_shown():
+    output = StringIO()
+    DiffReport([make_comparison("/a/_search", 2, documents=1000)]).export(output)
+    diff_lines = output.getvalue().split("first seen in GET /a/_search:\n")[1].splitlines()
+    assert "-  \"hits\": 1" in diff_lines
+    assert "+  \"hits\": 2" in diff_lines
+    assert len(diff_lines) < 20
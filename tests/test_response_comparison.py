@@ -5,7 +5,7 @@ import pytest
 
 from traffic_comparator.data import Response
 from traffic_comparator.response_comparison import (
-    InvalidJsonForLoadingComparisonException,
+    COMPARISON_TIER_COUNTS, InvalidJsonForLoadingComparisonException,
     MissingFieldForLoadingComparisonJsonException, ResponseComparison)
 
 RESPONSE_BODY_1 = {"hello": "world"}
@@ -201,3 +201,45 @@ def test_WHEN_responses_differ_on_header_case_THEN_comparison_suceeeds():
     # Leaving this assert in here as a reminder of this change.
     # TODO: Preserve original casing for header names, while not flagging this as a comparison issue.
     assert 'Content-Type' not in os_response.headers.keys()
+
+
+def test_WHEN_responses_identical_after_masking_THEN_deepdiff_is_skipped():
+    COMPARISON_TIER_COUNTS.clear()
+    response1 = Response(statuscode=200, headers={"content-length": 521}, body=MASKING_RESPONSE_BODY_1)
+    response2 = Response(statuscode=200, headers={"content-length": 572},
+                         body={**MASKING_RESPONSE_BODY_1, "took": 15, "_shards": {"total": 2}})
+    response_comparison = ResponseComparison(response1, response2)
+    assert response_comparison.are_identical()
+    assert COMPARISON_TIER_COUNTS == {"status_code_fast": 1, "headers_fast": 1, "body_fast": 1}
+
+    # The canonical form of the body is computed once per response and reused.
+    assert response1._canonical_body is not None
+    canonical_body = response1._canonical_body
+    ResponseComparison(response1, response2)
+    assert response1._canonical_body is canonical_body
+
+
+def test_WHEN_bodies_differ_THEN_falls_back_to_deepdiff():
+    COMPARISON_TIER_COUNTS.clear()
+    response1 = Response(statuscode=200, headers=RESPONSE_HEADERS, body={"count": 1})
+    response2 = Response(statuscode=200, headers=RESPONSE_HEADERS, body={"count": 1.0})
+    response_comparison = ResponseComparison(response1, response2)
+    assert not response_comparison.are_identical()
+    assert "type_changes" in response_comparison.body_diff
+    assert COMPARISON_TIER_COUNTS["body_deepdiff"] == 1
+
+
+def test_WHEN_status_code_not_an_int_THEN_falls_back_to_deepdiff():
+    COMPARISON_TIER_COUNTS.clear()
+    response_comparison = ResponseComparison(Response(statuscode=200), Response(statuscode=None))
+    assert not response_comparison.are_identical()
+    assert "type_changes" in response_comparison.status_code_diff
+    assert COMPARISON_TIER_COUNTS["status_code_deepdiff"] == 1
+
+
+def test_WHEN_response_comparison_built_from_json_without_bodies_THEN_bodies_are_none():
+    response_comparison = ResponseComparison.from_json(FULL_RESPONSE_COMPARISON_JSON, include_bodies=False)
+    assert response_comparison.primary_response.body is None
+    assert response_comparison.shadow_response.body is None
+    assert response_comparison.primary_response.statuscode == 200
+    assert not response_comparison.are_identical()
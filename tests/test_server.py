@@ -0,0 +1,87 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from traffic_comparator.server import IngestionServer, replay
+from traffic_comparator.sinks import BaseComparisonSink
+
+
+def toBase64String(s: str):
+    return base64.b64encode(s.encode('utf-8')).decode('utf-8')
+
+
+def make_log_entry(uri: str) -> str:
+    return json.dumps({
+        "request": {"Request-URI": uri, "Method": "GET", "HTTP-Version": "HTTP/1.1", "body": ""},
+        "primaryResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+                            "response_time_ms": 14, "body": toBase64String('{"tagline": "You Know, for Search"}')},
+        "shadowResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+                           "response_time_ms": 19, "body": toBase64String('{"tagline": "You Know, for Search"}')}
+    })
+
+
+class RecordingSink(BaseComparisonSink):
+    def __init__(self) -> None:
+        self.comparisons = []
+        self.closed = False
+
+    def add(self, comparison) -> None:
+        self.comparisons.append(comparison)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+async def serve_and_replay(server: IngestionServer, triples_file, lines: int, **replay_kwargs) -> int:
+    ready = asyncio.Event()
+    serving = asyncio.create_task(server.serve(ready, handle_signals=False))
+    await ready.wait()
+    if server._unix_socket is None:
+        replay_kwargs["port"] = server.address[1]
+    lines_sent = await replay(triples_file, **replay_kwargs)
+    while server.lines_received < lines:
+        await asyncio.sleep(0.01)
+    server.stop()
+    await serving
+    return lines_sent
+
+
+@pytest.mark.parametrize("use_unix_socket", [False, True])
+def test_WHEN_server_receives_triples_on_concurrent_connections_THEN_every_sink_gets_every_comparison(
+        tmp_path, use_unix_socket):
+    uris = [f"/index-{i}/_search" for i in range(20)]
+    triples_file = tmp_path / "triples.log"
+    # A blank line and a line that isn't json are skipped.
+    triples_file.write_text("\n".join([make_log_entry(uri) for uri in uris] + ["", "not a triple"]) + "\n")
+    sinks = [RecordingSink(), RecordingSink()]
+    unix_socket = tmp_path / "server.sock" if use_unix_socket else None
+    server = IngestionServer(sinks, port=0, unix_socket=unix_socket)
+
+    lines_sent = asyncio.run(serve_and_replay(server, triples_file, lines=21, unix_socket=unix_socket,
+                                              connections=3))
+
+    assert lines_sent == 22
+    assert server.connections_accepted == 3
+    assert server.lines_received == 21
+    for sink in sinks:
+        assert sink.closed
+        # The connections are interleaved, so the comparisons can be in any order.
+        assert sorted(comparison.original_request.uri for comparison in sink.comparisons) == sorted(uris)
+
+
+def test_WHEN_server_is_stopped_without_any_connections_THEN_sinks_are_closed():
+    sink = RecordingSink()
+    server = IngestionServer([sink], port=0)
+
+    async def scenario():
+        ready = asyncio.Event()
+        serving = asyncio.create_task(server.serve(ready, handle_signals=False))
+        await ready.wait()
+        server.stop()
+        await serving
+
+    asyncio.run(scenario())
+    assert sink.closed
+    assert sink.comparisons == []
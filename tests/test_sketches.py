@@ -0,0 +1,91 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from traffic_comparator.sketches import BootstrapHistogram, LatencyHistogram, PoissonWeights
+
+
+def test_WHEN_values_added_THEN_quantiles_within_relative_accuracy():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(3, 1) for _ in range(10000)]
+    histogram = LatencyHistogram(relative_accuracy=0.01)
+    histogram.update(values)
+
+    assert histogram.count == len(values)
+    assert histogram.mean == pytest.approx(np.mean(values))
+    for q in [0.5, 0.9, 0.99]:
+        expected = np.quantile(values, q, method="lower")
+        assert histogram.quantile(q) == pytest.approx(expected, rel=0.02)
+
+
+def test_WHEN_histograms_merged_THEN_same_as_single_histogram():
+    values = list(range(1, 1001))
+    merged = LatencyHistogram()
+    merged.update(values[:300])
+    other = LatencyHistogram()
+    other.update(values[300:])
+    merged.merge(other)
+
+    single = LatencyHistogram()
+    single.update(values)
+    assert merged.count == single.count
+    assert merged.quantiles([0.5, 0.99]) == single.quantiles([0.5, 0.99])
+    assert (merged.min, merged.max) == (1, 1000)
+
+
+def test_WHEN_quantiles_computed_together_THEN_match_individual_quantiles():
+    histogram = LatencyHistogram()
+    histogram.update([14, 199, 23, 51, 59, 0, -3])
+    qs = [0.99, 0.1, 0.5, 0.0, 1.0]
+    assert histogram.quantiles(qs) == [histogram.quantile(q) for q in qs]
+    assert histogram.quantile(0) == -3
+    assert histogram.quantile(1) == 199
+
+
+def test_WHEN_histogram_empty_THEN_quantiles_are_nan():
+    histogram = LatencyHistogram()
+    assert math.isnan(histogram.quantile(0.5))
+    assert all(math.isnan(v) for v in histogram.quantiles([0.5, 0.9]))
+    assert math.isnan(histogram.mean)
+
+
+def test_WHEN_histograms_have_different_accuracy_THEN_merge_fails():
+    with pytest.raises(ValueError):
+        LatencyHistogram(0.01).merge(LatencyHistogram(0.05))
+
+
+def test_WHEN_weights_are_one_THEN_every_replicate_matches_the_histogram():
+    histogram = BootstrapHistogram(replicates=3)
+    for value in range(1, 101):
+        histogram.add(value, np.ones(3, dtype=np.int64))
+    replicates = histogram.replicate_quantiles([0.5, 0.99])
+    assert replicates.shape == (2, 3)
+    for i, expected in enumerate(histogram.quantiles([0.5, 0.99])):
+        assert replicates[i].tolist() == [expected] * 3
+
+
+def test_WHEN_bootstrap_histograms_merged_THEN_same_as_single_histogram():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(3, 1) for _ in range(1000)]
+    weights = PoissonWeights(replicates=20, block_size=64)
+    single, first, second = BootstrapHistogram(20), BootstrapHistogram(20), BootstrapHistogram(20)
+    for i, value in enumerate(values):
+        value_weights = weights.next()
+        single.add(value, value_weights)
+        (first if i < 300 else second).add(value, value_weights)
+    first.merge(second)
+    np.testing.assert_array_equal(first.replicate_quantiles([0.5, 0.9]), single.replicate_quantiles([0.5, 0.9]))
+    assert first.quantiles([0.5]) == single.quantiles([0.5])
+
+
+def test_WHEN_bootstrap_replicates_are_resampled_THEN_they_vary_around_the_quantile():
+    rng = random.Random(0)
+    weights = PoissonWeights(replicates=200)
+    histogram = BootstrapHistogram(200)
+    for _ in range(2000):
+        histogram.add(rng.lognormvariate(3, 0.5), weights.next())
+    medians = histogram.replicate_quantiles([0.5])[0]
+    assert medians.std() > 0
+    assert np.median(medians) == pytest.approx(histogram.quantiles([0.5])[0], rel=0.03)
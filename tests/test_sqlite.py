@@ -1,5 +1,20 @@
-from traffic_comparator.sqlite import (COLUMN_DATATYPES, COLUMN_JSONS, COLUMNS,
-                                       get_took_value, json_load_function)
+import sqlite3
+import time
+from datetime import timedelta
+
+from traffic_comparator.data import Request, Response
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.sqlite import (BODY_COLUMNS, COLUMN_DATATYPES,
+                                       COLUMN_JSONS, COLUMN_SQL_TYPES, COLUMNS,
+                                       INDEXED_COLUMNS, SCHEMA_VERSION,
+                                       BodyResolver, SqliteDumper,
+                                       get_comparisons_table_names,
+                                       get_schema_version, get_took_value,
+                                       json_load_function,
+                                       latency_histogram_rollup_query,
+                                       match_rate_by_endpoint_query,
+                                       match_rate_by_endpoint_rollup_query,
+                                       register_body_functions)
 
 
 def test_column_list_sanity_checks():
@@ -8,6 +23,9 @@ def test_column_list_sanity_checks():
     # COLUMN_DATATYPES contains the same items as COLUMNS
     assert sorted(list(COLUMN_DATATYPES.keys())) == sorted(COLUMNS)
 
+    # COLUMN_SQL_TYPES contains the same items as COLUMNS
+    assert sorted(list(COLUMN_SQL_TYPES.keys())) == sorted(COLUMNS)
+
     # COLUMN_JSONS is a subset of COLUMNS
     for entry in COLUMN_JSONS:
         assert entry in COLUMNS
@@ -34,3 +52,172 @@ def test_get_took_value_happy_path():
 def test_get_took_value_no_took_field():
     body = {"result": "xyz", "more_body_contents": "abc", "different_int": 49}
     assert get_took_value(body) is None
+
+
+def make_comparison_line(latency: int) -> str:
+    return ResponseComparison(Response(statuscode=200, latency=latency, body={"hello": "world"}),
+                              Response(statuscode=200, latency=latency, body={"hello": "earth"}),
+                              Request(http_method="GET", uri="/index1/_doc/1")).to_json()
+
+
+def test_WHEN_rows_dumped_THEN_written_in_batches(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, batch_size=3, flush_interval=timedelta(hours=1))
+    reader = sqlite3.connect(db_file)
+
+    for latency in range(5):
+        dumper.update(make_comparison_line(latency))
+    # Only the first full batch has been written so far.
+    assert reader.execute(f"SELECT COUNT(*) FROM {dumper.table.name}").fetchone() == (3,)
+
+    dumper.close()
+    rows = reader.execute(f"SELECT request_uri, source_response_latency, responses_are_identical "
+                          f"FROM {dumper.table.name}").fetchall()
+    assert rows == [("/index1/_doc/1", latency, 0) for latency in range(5)]
+    assert reader.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    reader.close()
+
+
+def test_WHEN_flush_interval_elapsed_THEN_partial_batch_written(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, batch_size=100, flush_interval=timedelta(seconds=0))
+    dumper.update(make_comparison_line(1))
+    assert dumper.rows_written == 1
+    dumper.update("not a comparison")
+    dumper.close()
+    assert dumper.rows_written == 1
+
+
+def test_WHEN_input_is_idle_THEN_pending_batch_is_written_after_flush_interval(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, batch_size=100, flush_interval=timedelta(seconds=0.05))
+    reader = sqlite3.connect(db_file)
+    dumper.update(make_comparison_line(1))
+    dumper.update(make_comparison_line(2))
+    # No more rows arrive, so only the flusher thread can write the batch.
+    deadline = time.monotonic() + 5
+    while dumper.rows_written < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reader.execute(f"SELECT COUNT(*) FROM {dumper.table.name}").fetchone() == (2,)
+    dumper.close()
+    reader.close()
+
+
+def test_WHEN_second_dumper_opened_THEN_writes_to_new_table(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    first_dumper = SqliteDumper(db_file)
+    first_dumper.close()
+    second_dumper = SqliteDumper(db_file)
+    second_dumper.close()
+    assert (first_dumper.table.name, second_dumper.table.name) == ("comparisons_001", "comparisons_002")
+
+
+def test_WHEN_dumping_to_db_with_untyped_tables_THEN_tables_migrated(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    con = sqlite3.connect(db_file)
+    legacy_columns = [c for c in COLUMNS if c != "request_uri_template"]
+    con.execute(f"CREATE TABLE comparisons_001({','.join(legacy_columns)})")
+    con.execute("INSERT INTO comparisons_001(request_uri, request_method, source_response_status, "
+                "source_response_latency, responses_are_identical) VALUES ('/index1/_doc/1', 'GET', '200', '15', '1')")
+    con.commit()
+
+    dumper = SqliteDumper(db_file)
+    dumper.update(make_comparison_line(20))
+    dumper.close()
+
+    cur = con.cursor()
+    assert get_schema_version(cur) == SCHEMA_VERSION
+    assert get_comparisons_table_names(cur) == ["comparisons_001", "comparisons_002"]
+    migrated_rows = cur.execute("SELECT request_uri_template, source_response_status, source_response_latency, "
+                                "responses_are_identical FROM comparisons_001").fetchall()
+    assert migrated_rows == [("/{index}/_doc/{id}", 200, 15, 1)]
+    table_info = cur.execute("PRAGMA table_info(comparisons_001)").fetchall()
+    column_types = {name: column_type for _, name, column_type, *_ in table_info}
+    assert column_types == COLUMN_SQL_TYPES
+    assert cur.execute(match_rate_by_endpoint_query("comparisons_002")).fetchall() == \
+        [("/{index}/_doc/{id}", "GET", 1, 0.0, 1.0)]
+    index_names = [name for name, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                 "AND tbl_name LIKE 'comparison%'")]
+    assert len(index_names) == 2 * len(INDEXED_COLUMNS)
+    # The rollups of the migrated table are backfilled.
+    assert cur.execute(match_rate_by_endpoint_rollup_query("comparisons_001")).fetchall() == \
+        [("/{index}/_doc/{id}", "GET", 1, 1.0, 0.0)]
+    con.close()
+
+
+def test_WHEN_rows_dumped_THEN_rollups_match_comparisons_table(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, batch_size=4, flush_interval=timedelta(hours=1))
+    for latency in [0, 1, 3, 3, 50, 1000, 1000]:
+        dumper.update(make_comparison_line(latency))
+    dumper.update(ResponseComparison(Response(statuscode=404, latency=5), Response(statuscode=200, latency=5),
+                                     Request(http_method="PUT", uri="/index2/_doc/9")).to_json())
+    dumper.close()
+
+    con = sqlite3.connect(db_file)
+    table_name = dumper.table.name
+    assert sorted(con.execute(match_rate_by_endpoint_rollup_query(table_name)).fetchall()) == \
+        sorted(con.execute(match_rate_by_endpoint_query(table_name)).fetchall())
+    # The rows without a timestamp are rolled up into minute 0, as when they're backfilled.
+    assert con.execute(f"SELECT minute, SUM(comparisons), SUM(source_latency_count), SUM(source_latency_sum) "
+                       f"FROM {dumper.rollup_tables.rollup_name} GROUP BY minute").fetchall() == [(0, 8, 7, 2062)]
+    histogram = con.execute(latency_histogram_rollup_query(table_name)).fetchall()
+    source_histogram = [(upper_bound, count) for template, method, cluster, upper_bound, count in histogram
+                        if (template, method, cluster) == ("/{index}/_doc/{id}", "GET", "source")]
+    assert [count for _, count in source_histogram] == [1, 2, 1, 2]
+    for (upper_bound, _), latency in zip(source_histogram, [1, 3, 50, 1000]):
+        assert latency <= upper_bound < latency * 1.25
+    con.close()
+
+
+def test_WHEN_repeated_bodies_dumped_THEN_stored_once(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, batch_size=2)
+    for latency in range(5):
+        dumper.update(make_comparison_line(latency))
+    dumper.close()
+
+    con = sqlite3.connect(db_file)
+    # The request body (empty) and the two response bodies.
+    assert con.execute("SELECT COUNT(*) FROM bodies").fetchone() == (3,)
+    # The view has the original columns, and doesn't need any functions to be registered for uncompressed bodies.
+    rows = con.execute(f"SELECT request_body, source_response_body, target_response_body "
+                       f"FROM {dumper.table.name}").fetchall()
+    assert rows == [("", '{"hello":"world"}', '{"hello":"earth"}')] * 5
+    view_columns = [name for _, name, *_ in con.execute(f"PRAGMA table_info({dumper.table.name})")]
+    assert view_columns == COLUMNS
+    con.close()
+
+
+def test_WHEN_bodies_compressed_THEN_resolved_through_view_and_resolver(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    dumper = SqliteDumper(db_file, body_compression="zlib")
+    for latency in range(3):
+        dumper.update(make_comparison_line(latency))
+    dumper.close()
+
+    con = sqlite3.connect(db_file)
+    assert type(con.execute("SELECT body FROM bodies_zlib LIMIT 1").fetchone()[0]) is bytes
+    register_body_functions(con)
+    assert con.execute(f"SELECT DISTINCT source_response_body FROM {dumper.table.name}").fetchall() == \
+        [('{"hello":"world"}',)]
+
+    resolver = BodyResolver(con, dumper.table.name)
+    rows = con.execute(resolver.query).fetchall()
+    source_body_index = COLUMNS.index("source_response_body")
+    first_body = resolver.load_body(rows[0][source_body_index])
+    assert first_body == {"hello": "world"}
+    # The rows share the parsed body.
+    assert all(resolver.load_body(row[source_body_index]) is first_body for row in rows)
+    con.close()
+
+
+def test_WHEN_resolving_bodies_of_inline_table_THEN_bodies_parsed(tmp_path):
+    db_file = tmp_path / "comparisons.db"
+    con = sqlite3.connect(db_file)
+    con.execute(f"CREATE TABLE comparisons_001({','.join(COLUMNS)})")
+    con.execute("INSERT INTO comparisons_001(request_body, source_response_body) VALUES ('', '{\"took\": 3}')")
+    resolver = BodyResolver(con, "comparisons_001")
+    row = dict(zip(COLUMNS, con.execute(resolver.query).fetchone()))
+    assert [resolver.load_body(row[c]) for c in BODY_COLUMNS] == ["", {"took": 3}, None]
+    con.close()
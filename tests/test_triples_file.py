@@ -0,0 +1,89 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import TriplesFileDataLoader
+from traffic_comparator.triples_file import (FileRange, chunk_lines, detect_compression, file_chunks,
+                                             open_triples_file, split_ranges)
+
+
+def toBase64String(s: str):
+    return base64.b64encode(s.encode('utf-8')).decode('utf-8')
+
+
+def make_log_entry(uri: str) -> str:
+    return json.dumps({
+        "request": {"Request-URI": uri, "Method": "GET", "HTTP-Version": "HTTP/1.1", "body": ""},
+        "primaryResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+                            "response_time_ms": 14, "body": toBase64String('{"hits": 1}')},
+        "shadowResponse": {"HTTP-Version": "HTTP/1.1", "Status-Code": "200", "Reason-Phrase": "OK",
+                           "response_time_ms": 19, "body": toBase64String('{"hits": 2}')}
+    })
+
+
+URIS = [f"/index-{i}/_search" for i in range(25)]
+# The last line doesn't end with a line break.
+TRIPLES = ("\n".join(make_log_entry(uri) for uri in URIS)).encode('utf-8')
+
+
+@pytest.fixture
+def triples_file(tmp_path):
+    path = tmp_path / "triples.log"
+    path.write_bytes(TRIPLES)
+    return path
+
+
+@pytest.fixture
+def gzipped_triples_file(tmp_path):
+    path = tmp_path / "triples.log.gz"
+    path.write_bytes(gzip.compress(TRIPLES))
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 1000, len(TRIPLES), 10 * len(TRIPLES)])
+def test_WHEN_file_is_split_into_ranges_THEN_ranges_are_contiguous_and_end_at_line_breaks(triples_file, chunk_size):
+    ranges = list(split_ranges(triples_file, chunk_size))
+    assert ranges[0].start == 0
+    assert ranges[-1].end == len(TRIPLES)
+    for previous, following in zip(ranges, ranges[1:]):
+        assert previous.end == following.start
+        assert TRIPLES[previous.end - 1:previous.end] == b"\n"
+    lines = [line for file_range in ranges for line in chunk_lines(file_range)]
+    assert b"".join(lines) == TRIPLES
+    assert len(lines) == len(URIS)
+
+
+def test_WHEN_file_is_empty_THEN_it_has_no_ranges(tmp_path):
+    path = tmp_path / "empty.log"
+    path.write_bytes(b"")
+    assert list(split_ranges(path)) == []
+
+
+def test_WHEN_file_is_gzipped_THEN_it_is_decompressed_into_chunks_of_lines(triples_file, gzipped_triples_file):
+    assert detect_compression(triples_file) is None
+    assert detect_compression(gzipped_triples_file) == "gzip"
+    with open_triples_file(gzipped_triples_file) as stream:
+        assert stream.read() == TRIPLES
+
+    chunks = list(file_chunks(gzipped_triples_file, chunk_size=1000))
+    assert len(chunks) > 1
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    assert b"".join(chunks) == TRIPLES
+    assert all(isinstance(chunk, FileRange) for chunk in file_chunks(triples_file, chunk_size=1000))
+
+
+@pytest.mark.parametrize("compressed", [False, True])
+@pytest.mark.parametrize("workers, ordered", [(1, True), (2, True), (3, False)])
+def test_WHEN_analyzer_reads_triples_file_in_chunks_THEN_every_triple_is_compared(triples_file, gzipped_triples_file,
+                                                                                  compressed, workers, ordered):
+    data_loader = TriplesFileDataLoader(gzipped_triples_file if compressed else triples_file, chunk_size=500)
+    analyzer = StreamingAnalyzer(data_loader, workers=workers, ordered=ordered)
+    comparisons = list(analyzer.comparisons())
+    uris = [comparison.original_request.uri for comparison in comparisons]
+    if ordered:
+        assert uris == URIS
+    assert sorted(uris) == sorted(URIS)
+    assert not any(comparison.are_identical() for comparison in comparisons)
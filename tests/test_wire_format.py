@@ -0,0 +1,79 @@
+from io import BytesIO
+
+import pytest
+
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data import Request, RequestResponsePair, Response
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.wire_format import (JSON_PAYLOAD, MAGIC, RecordEncoder, UnknownWireFormatException,
+                                            UnsupportedBinaryStreamException, read_comparisons)
+
+REQUEST = Request(http_method="GET", uri="/movies/_search", body={"query": {"match_all": {}}})
+COMPARISONS = [
+    ResponseComparison(Response(statuscode=200, latency=10, headers={"a": "b"}, body={"hits": [1, 2]}),
+                       Response(statuscode=200, latency=12, headers={"a": "b"}, body={"hits": [1, 2]}), REQUEST),
+    ResponseComparison(Response(statuscode=200, latency=10, body={"hits": [1, 2], "new": True}),
+                       Response(statuscode=500, latency=3, body={"hits": [1, 3]}), REQUEST),
+]
+
+
+def encode(encoder: RecordEncoder) -> bytes:
+    records = [encoder.encode(comparison) for comparison in COMPARISONS]
+    if encoder.is_binary:
+        return encoder.header() + b"".join(records)  # type: ignore
+    return "".join(record + "\n" for record in records).encode('utf-8')  # type: ignore
+
+
+@pytest.mark.parametrize("wire_format", ["json", "binary"])
+def test_WHEN_comparisons_encoded_THEN_read_back_in_any_format(wire_format):
+    comparisons = list(read_comparisons(BytesIO(encode(RecordEncoder(wire_format)))))
+    assert [c.to_dict() for c in comparisons] == [c.to_dict() for c in COMPARISONS]
+    assert [c.are_identical() for c in comparisons] == [True, False]
+
+
+@pytest.mark.parametrize("wire_format", ["json", "binary"])
+def test_WHEN_summaries_encoded_THEN_read_back_without_bodies(wire_format):
+    comparisons = list(read_comparisons(BytesIO(encode(RecordEncoder(wire_format, summary_only=True)))))
+    assert [c.is_summary for c in comparisons] == [True, True]
+    assert [c.are_identical() for c in comparisons] == [True, False]
+    different = comparisons[1]
+    assert (different.primary_response.latency, different.shadow_response.statuscode) == (10, 500)
+    assert different.primary_response.body is None and different.primary_response.headers is None
+    assert different.original_request.uri == "/movies/_search" and different.original_request.body is None
+    assert different.body_diff == {"dictionary_item_removed": ["root['new']"],
+                                   "values_changed": ["root['hits'][1]"]}
+    assert different.status_code_diff == {"values_changed": ["root"]}
+
+
+def test_WHEN_json_lines_are_invalid_or_short_THEN_skipped_or_read():
+    stream = BytesIO(b"{}\n" + COMPARISONS[0].to_json().encode('utf-8') + b"\n\nnot json\n")
+    assert [c.are_identical() for c in read_comparisons(stream)] == [True]
+    assert list(read_comparisons(BytesIO(b""))) == []
+
+
+def test_WHEN_binary_stream_is_truncated_THEN_raises():
+    encoded = encode(RecordEncoder("binary"))
+    with pytest.raises(UnsupportedBinaryStreamException):
+        list(read_comparisons(BytesIO(encoded[:-3])))
+    with pytest.raises(UnsupportedBinaryStreamException):
+        list(read_comparisons(BytesIO(MAGIC + b"\x09" + JSON_PAYLOAD)))
+
+
+def test_WHEN_unknown_format_THEN_raises():
+    with pytest.raises(UnknownWireFormatException):
+        RecordEncoder("xml")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_WHEN_streaming_analyzer_outputs_binary_THEN_readable(workers):
+    class DataLoader:
+        def next_input(self):
+            for comparison in COMPARISONS:
+                yield (RequestResponsePair(REQUEST, comparison.primary_response),
+                       RequestResponsePair(REQUEST, comparison.shadow_response))
+
+    output = BytesIO()
+    StreamingAnalyzer(DataLoader(), output, workers=workers,
+                      record_encoder=RecordEncoder("binary", summary_only=True)).start()
+    output.seek(0)
+    assert [c.are_identical() for c in read_comparisons(output)] == [True, False]
@@ -1,26 +1,218 @@
 import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import IO, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from typing import IO
-from traffic_comparator.data_loader import StreamingDataLoader
-from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator import codec, comparators, data, masks, metrics
+from traffic_comparator.data import Request, Response
+from traffic_comparator.data_loader import StreamingDataLoader, TriplesFileDataLoader
+from traffic_comparator.log_file_loader import LogFileFormat, getLogFileLoader
+from traffic_comparator.response_comparison import COMPARISON_TIER_COUNTS, ResponseComparison
+from traffic_comparator.sinks import BaseComparisonSink, ComparisonOutputSink
+from traffic_comparator.triples_file import FileRange, chunk_lines
+from traffic_comparator.wire_format import RecordEncoder
 
 logger = logging.getLogger(__name__)
 
+# When running with multiple workers, this is the default number of in-flight comparisons per worker. It needs to be
+# large enough to keep every worker busy, but bounded so that a fast producer doesn't accumulate an unbounded backlog
+# of parsed triples (or finished-but-not-yet-written results) in memory.
+DEFAULT_IN_FLIGHT_PER_WORKER = 4
+# When comparing a triples file, the workers are given chunks of the file instead of single triples, and this is the
+# default number of in-flight chunks per worker (the results of a whole chunk are held until it's written).
+DEFAULT_CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+
+def _initialize_worker(codec_name: str, bulk_metadata_only: bool, score_tolerance: float,
+                       active_masks: masks.Masks, metrics_enabled: bool) -> None:
+    # Workers use the same json codec, bulk parsing, score tolerance, masks and metrics as the main process, which may
+    # not be the default ones.
+    codec.set_codec(codec_name)
+    data.set_bulk_metadata_only(bulk_metadata_only)
+    comparators.set_score_tolerance(score_tolerance)
+    masks.set_active_masks(active_masks)
+    metrics.set_enabled(metrics_enabled)
+    # Forked workers inherit the main process' counts and metrics, which would otherwise be counted twice.
+    COMPARISON_TIER_COUNTS.clear()
+    metrics.reset()
+
+
+def compare(primary_response: Response, shadow_response: Response,
+            original_request: Optional[Request]) -> ResponseComparison:
+    """Generate the comparison for a single triple, and record it in the metrics."""
+    start = time.perf_counter()
+    # The comparison decodes both bodies anyway, so they're decoded first for decoding to be timed as its own stage.
+    primary_response.decode_body()
+    shadow_response.decode_body()
+    decoded = time.perf_counter()
+    metrics.observe_stage("decode", decoded - start)
+    comparison = ResponseComparison(primary_response, shadow_response, original_request)
+    metrics.observe_stage("compare", time.perf_counter() - decoded)
+    metrics.observe_comparison(comparison)
+    return comparison
+
+
+def compare_and_encode(record_encoder: RecordEncoder, primary_response: Response, shadow_response: Response,
+                       original_request: Optional[Request]) -> Union[str, bytes]:
+    """Generate the comparison for a single triple and encode it as a record of the encoder's wire format. This is a
+    module level function so that it can be pickled and run in a worker process."""
+    comparison = compare(primary_response, shadow_response, original_request)
+    start = time.perf_counter()
+    record = record_encoder.encode(comparison)
+    metrics.observe_stage("encode", time.perf_counter() - start)
+    return record
+
+
+def compare_to_dict(primary_response: Response, shadow_response: Response,
+                    original_request: Optional[Request]) -> dict:
+    """Generate the comparison for a single triple as a dict (see `ResponseComparison.to_dict`). This is how worker
+    processes hand comparisons back to be passed to the sinks, since DeepDiff objects can't be pickled."""
+    return compare(primary_response, shadow_response, original_request).to_dict()
+
+
+def compare_chunk(fn: Callable[..., Any], leading_args: Tuple, chunk: Union[FileRange, bytes]) -> List[Any]:
+    """Load the triples in a chunk of a triples file (see `triples_file.file_chunks`) and apply `fn` to (the leading
+    args and) each of them. The chunk is read (or memory-mapped) by the worker process that runs this."""
+    loader = getLogFileLoader(LogFileFormat.REPLAYER_TRIPLES)
+    return [fn(*leading_args, primary.response, shadow.response, primary.request)
+            for primary, shadow in loader.load(chunk_lines(chunk))]
+
+
+def _run_in_worker(fn: Callable[..., Any], *args) -> Tuple[Any, Dict[str, int], Optional[Dict[str, dict]]]:
+    """Run `fn` in a worker process, and also hand back the comparison tiers that were used and the metrics that were
+    recorded so that they can be counted in the main process."""
+    result = fn(*args)
+    tier_counts = dict(COMPARISON_TIER_COUNTS)
+    COMPARISON_TIER_COUNTS.clear()
+    return result, tier_counts, metrics.take_snapshot()
+
+
+def parallel_map(fn: Callable[..., Any], args_iterable: Iterable[Tuple], executor: ProcessPoolExecutor,
+                 max_in_flight: int, ordered: bool = True) -> Iterator[Any]:
+    """Apply `fn` to each tuple of arguments in `args_iterable` in the executor and yield the results.
+
+    At most `max_in_flight` tasks are submitted at any time -- the input iterable isn't advanced again until a result
+    has been yielded, which keeps memory flat regardless of how fast the input arrives. If `ordered` is True, results
+    are yielded in input order (a slow task holds back the ones behind it); otherwise, they're yielded as soon as they
+    are completed.
+    """
+    if ordered:
+        pending: Deque[Future] = deque()
+        for args in args_iterable:
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fn, *args))
+        while pending:
+            yield pending.popleft().result()
+    else:
+        in_flight: Set[Future] = set()
+        for args in args_iterable:
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(executor.submit(fn, *args))
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
 
 class StreamingAnalyzer:
-    def __init__(self, dataLoader: StreamingDataLoader, output: IO) -> None:
+    """Compares the triples from the data loader. `start` writes the comparisons to the output, encoded by the record
+    encoder (json lines by default; for a binary wire format, the output must be a binary stream), and `run` passes
+    them to a set of sinks in memory.
+
+    With multiple workers, the triples are parsed in the main process and compared in the workers, unless they're
+    loaded from a file (by a TriplesFileDataLoader): the file is then split into chunks that are both parsed and
+    compared in the workers, and `max_in_flight` is the number of chunks."""
+    def __init__(self, dataLoader: StreamingDataLoader, output: Optional[IO] = None, workers: int = 1,
+                 ordered: bool = True, max_in_flight: Optional[int] = None,
+                 record_encoder: Optional[RecordEncoder] = None) -> None:
         self._data_loader = dataLoader
         self._comparisons_count = 0
         self._output = output
+        self._workers = workers
+        self._ordered = ordered
+        if max_in_flight is None:
+            max_in_flight = workers * (DEFAULT_CHUNKS_IN_FLIGHT_PER_WORKER if self._reads_chunks()
+                                       else DEFAULT_IN_FLIGHT_PER_WORKER)
+        self._max_in_flight = max_in_flight
+        self._record_encoder = record_encoder or RecordEncoder()
 
-    def start(self):
-        data_loader_generator = self._data_loader.next_input()
-        for primary, shadow in data_loader_generator:
-            comparison = ResponseComparison(primary.response, shadow.response, primary.request)
+    def _reads_chunks(self) -> bool:
+        return isinstance(self._data_loader, TriplesFileDataLoader)
+
+    def _triples(self) -> Iterator[Tuple[Response, Response, Request]]:
+        for primary, shadow in self._data_loader.next_input():
+            yield primary.response, shadow.response, primary.request
+
+    def _compare_triples(self, fn: Callable[..., Any], *leading_args) -> Iterator[Any]:
+        """Apply `fn` to (the leading args and) each triple, in the worker processes if there are multiple workers."""
+        if self._workers <= 1:
+            for triple in self._triples():
+                yield fn(*leading_args, *triple)
+            return
 
+        logger.info(f"Comparing with {self._workers} worker processes "
+                    f"({'ordered' if self._ordered else 'unordered'} output, max {self._max_in_flight} "
+                    f"{'chunks' if self._reads_chunks() else 'triples'} in flight).")
+        with ProcessPoolExecutor(max_workers=self._workers, initializer=_initialize_worker,
+                                 initargs=(codec.active_codec_name(), data.bulk_metadata_only(),
+                                           comparators.score_tolerance(), masks.active_masks(),
+                                           metrics.enabled())) as executor:
+            if self._reads_chunks():
+                assert isinstance(self._data_loader, TriplesFileDataLoader)
+                tasks = ((compare_chunk, fn, leading_args, chunk) for chunk in self._data_loader.chunks())
+            else:
+                tasks = ((fn, *leading_args, *triple) for triple in self._triples())
+            for result, tier_counts, worker_metrics in parallel_map(_run_in_worker, tasks, executor,
+                                                                    self._max_in_flight, ordered=self._ordered):
+                COMPARISON_TIER_COUNTS.update(tier_counts)
+                metrics.merge_snapshot(worker_metrics)
+                if self._reads_chunks():
+                    yield from result
+                else:
+                    yield result
+
+    def comparisons(self) -> Iterator[ResponseComparison]:
+        if self._workers <= 1:
+            for triple in self._triples():
+                yield compare(*triple)
+            return
+        for comparison_dict in self._compare_triples(compare_to_dict):
+            yield ResponseComparison.from_dict(comparison_dict)
+
+    def start(self):
+        assert self._output is not None, "The analyzer needs an output to write the comparisons to."
+        # The comparisons are encoded where they're generated (i.e. in the worker processes, if there are any).
+        output_sink = ComparisonOutputSink(self._output, self._record_encoder)
+        for record in self._compare_triples(compare_and_encode, self._record_encoder):
             # Is this step actually necessary? Do we care about keeping these locally?
             self._comparisons_count += 1
+            start = time.perf_counter()
+            output_sink.write_record(record)
+            metrics.observe_stage("output", time.perf_counter() - start)
+        output_sink.close()
+
+        self._log_totals()
+
+    def run(self, sinks: List[BaseComparisonSink]) -> None:
+        """Pass every comparison to each of the sinks, and then close them."""
+        # Each sink's processing time is recorded as its own stage.
+        sink_stages = [f"sink:{type(sink).__name__}" for sink in sinks]
+        for comparison in self.comparisons():
+            self._comparisons_count += 1
+            for sink, stage in zip(sinks, sink_stages):
+                start = time.perf_counter()
+                sink.add(comparison)
+                metrics.observe_stage(stage, time.perf_counter() - start)
+        for sink in sinks:
+            sink.close()
 
-            print(comparison.to_json(), flush=True, file=self._output)
+        self._log_totals()
 
+    def _log_totals(self) -> None:
         logger.info(f"All inputs processed. Generated {self._comparisons_count} comparisons.")
+        logger.info(f"Comparison tiers used: {dict(COMPARISON_TIER_COUNTS)}")
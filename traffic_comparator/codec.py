@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Type, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover -- orjson is a dependency, but it's not available on every platform.
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# This is the JSON codec used on every hot path: loading triples, parsing bodies, (de)serializing comparisons and
+# writing reports and the sqlite dump. orjson is used when it's installed, since it's several times faster than the
+# stdlib `json` module, which is kept as a fallback (and can be selected explicitly). Callers should use the module
+# level `loads` and `dumps` functions (as `codec.loads`, not imported directly) so they always use the active codec.
+
+# orjson's decode error is a subclass of this, so this can be caught regardless of the codec.
+JSONDecodeError = json.JSONDecodeError
+
+CODEC_ENVIRONMENT_VARIABLE = "TRAFFIC_COMPARATOR_JSON_CODEC"
+
+
+class UnknownJsonCodecException(Exception):
+    def __init__(self, codec_name) -> None:
+        super().__init__(f"The json codec '{codec_name}' is unknown or unavailable. "
+                         f"Available codecs are: {available_codecs()}")
+
+
+class BaseJsonCodec(ABC):
+    name: str
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        pass
+
+    @abstractmethod
+    def dumps(self, obj: Any, sort_keys: bool = False, indent: Optional[int] = None,
+              default: Optional[Callable[[Any], Any]] = None) -> str:
+        """Serialize `obj` to a json string. `indent` is either None (compact) or 2 -- the only indentation supported
+        by every codec. `default` is called on objects that can't otherwise be serialized."""
+        pass
+
+
+class StdlibJsonCodec(BaseJsonCodec):
+    name = "stdlib"
+
+    def loads(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(self, obj: Any, sort_keys: bool = False, indent: Optional[int] = None,
+              default: Optional[Callable[[Any], Any]] = None) -> str:
+        return json.dumps(obj, sort_keys=sort_keys, indent=indent, default=default)
+
+
+# orjson parses integers beyond the 64-bit range (below -2**63 or above 2**64 - 1) as floats, losing their precision,
+# where the stdlib parses them as ints. Those integers have at least 19 digits if they're negative and 20 otherwise, so
+# the documents with such a run of digits (which is rare, and also matches long fractions and digits in strings) are
+# parsed by the stdlib instead.
+_BIG_INTEGER_PATTERN = re.compile(r"-\d{19}|\d{20}")
+_BIG_INTEGER_BYTES_PATTERN = re.compile(rb"-\d{19}|\d{20}")
+
+
+class OrjsonCodec(BaseJsonCodec):
+    name = "orjson"
+
+    def loads(self, data: Union[str, bytes, bytearray, memoryview]) -> Any:
+        pattern = _BIG_INTEGER_PATTERN if isinstance(data, str) else _BIG_INTEGER_BYTES_PATTERN
+        if pattern.search(data):
+            return json.loads(data.tobytes() if isinstance(data, memoryview) else data)
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any, sort_keys: bool = False, indent: Optional[int] = None,
+              default: Optional[Callable[[Any], Any]] = None) -> str:
+        option = 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent is not None:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+
+_CODECS: Dict[str, Type[BaseJsonCodec]] = {StdlibJsonCodec.name: StdlibJsonCodec}
+if orjson is not None:
+    _CODECS[OrjsonCodec.name] = OrjsonCodec
+
+DEFAULT_CODEC = OrjsonCodec.name if orjson is not None else StdlibJsonCodec.name
+
+
+def available_codecs():
+    return list(_CODECS.keys())
+
+
+def get_codec(codec_name: str) -> BaseJsonCodec:
+    try:
+        return _CODECS[codec_name]()
+    except KeyError:
+        raise UnknownJsonCodecException(codec_name)
+
+
+_active_codec: BaseJsonCodec = get_codec(os.environ.get(CODEC_ENVIRONMENT_VARIABLE, DEFAULT_CODEC))
+
+
+def set_codec(codec_name: str) -> None:
+    global _active_codec
+    _active_codec = get_codec(codec_name)
+    logger.info(f"Using the {codec_name} json codec.")
+
+
+def active_codec_name() -> str:
+    return _active_codec.name
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    return _active_codec.loads(data)
+
+
+def active_loads() -> Callable[[Union[str, bytes, bytearray, memoryview]], Any]:
+    """The `loads` function of the active codec, for loops that parse many small documents and look it up once. It
+    must not be held on to, since the active codec can change."""
+    return _active_codec.loads
+
+
+def dumps(obj: Any, sort_keys: bool = False, indent: Optional[int] = None,
+          default: Optional[Callable[[Any], Any]] = None) -> str:
+    return _active_codec.dumps(obj, sort_keys=sort_keys, indent=indent, default=default)
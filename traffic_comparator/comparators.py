@@ -0,0 +1,309 @@
+import logging
+import math
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from traffic_comparator.data import Request
+
+logger = logging.getLogger(__name__)
+
+# Some responses have a structure that DeepDiff compares poorly (e.g. long lists of items that each contain volatile
+# fields). A body comparator handles a specific kind of response body: it compares some of the top-level keys of the
+# bodies itself (`handled_keys`), and the rest of the bodies are compared as usual (see `response_comparison`). Its
+# diff has the same shape as a DeepDiff result as a dict ({change type: {path: details}}), so it's displayed, stored
+# and summarized like any other diff.
+
+
+class BaseBodyComparator(ABC):
+    # This identifies the comparator in the comparison tier counts.
+    name: str
+    # The top-level keys of the bodies that are compared by this comparator.
+    handled_keys: FrozenSet[str]
+
+    @abstractmethod
+    def applies_to(self, request: Optional[Request], primary_body: Any, shadow_body: Any) -> bool:
+        pass
+
+    @abstractmethod
+    def compare(self, primary_body: dict, shadow_body: dict) -> dict:
+        """The diff of the handled keys of the bodies, or {} if there aren't any differences."""
+        pass
+
+
+# The number of differing items (e.g. bulk items or search hits) included in a diff, on top of the counts.
+DIFF_EXAMPLES = 5
+_MISSING = "(missing)"
+
+
+def _bulk_item(item: Any) -> Tuple[Optional[str], dict]:
+    """The op type and the details of an item of a bulk response (e.g. `{"index": {"_id": "1", "status": 201}}`)."""
+    if isinstance(item, dict) and len(item) == 1:
+        op_type, details = next(iter(item.items()))
+        if isinstance(details, dict):
+            return op_type, details
+    return None, {}
+
+
+def _bulk_item_key(item: Any) -> Tuple[Optional[str], Any, Any]:
+    op_type, details = _bulk_item(item)
+    return op_type, details.get("_index"), details.get("_id")
+
+
+def _bulk_item_outcome(item: Any) -> Tuple[Optional[str], Any, Any, Any]:
+    """The fields of an item that are compared: the op type, status, result and error type. The rest of an item
+    (`_version`, `_seq_no`, `_primary_term`, `_shards`, the error reason, ...) differs between clusters even when the
+    operation had the same outcome."""
+    op_type, details = _bulk_item(item)
+    error = details.get("error")
+    error_type = error.get("type") if isinstance(error, dict) else error
+    return op_type, details.get("status"), details.get("result"), error_type
+
+
+def _bulk_item_summary(item: Any) -> Optional[dict]:
+    """The fields of an item that identify it and its outcome, for the examples of a diff. The volatile fields (see
+    `_bulk_item_outcome`) are left out, since they differ on every cluster."""
+    if item is None:
+        return None
+    op_type, details = _bulk_item(item)
+    _, status, result, error_type = _bulk_item_outcome(item)
+    return {"op_type": op_type, "_index": details.get("_index"), "_id": details.get("_id"), "status": status,
+            "result": result, "error_type": error_type}
+
+
+def _bulk_outcome_label(item: Any) -> str:
+    if item is None:
+        return _MISSING
+    _, status, result, error_type = _bulk_item_outcome(item)
+    return str(error_type or result or status)
+
+
+def match_bulk_items(primary_items: List[Any], shadow_items: List[Any]) -> Iterator[Tuple[Optional[int],
+                                                                                          Optional[int]]]:
+    """Pair the items of two bulk responses, as (primary position, shadow position), with None for an item that has no
+    counterpart. Items are in the order of the request's operations, so they're paired by position, unless the items
+    at the same position are for different documents: then the shadow item for the same document (op type, index and
+    id) is looked up in an index of them, which is only built if it's needed. If there isn't one (e.g. the ids were
+    generated by each cluster), the item at the same position is used if it isn't already paired."""
+    positions_by_key: Optional[Dict[Tuple, int]] = None
+    paired = set()
+    for position, item in enumerate(primary_items):
+        match = None
+        if position < len(shadow_items) and _bulk_item_key(shadow_items[position]) == _bulk_item_key(item):
+            match = position
+        else:
+            if positions_by_key is None:
+                positions_by_key = {}
+                for shadow_position, shadow_item in enumerate(shadow_items):
+                    positions_by_key.setdefault(_bulk_item_key(shadow_item), shadow_position)
+            candidate = positions_by_key.get(_bulk_item_key(item))
+            if candidate is not None and candidate not in paired:
+                match = candidate
+            elif position < len(shadow_items) and position not in paired:
+                match = position
+        if match is not None:
+            paired.add(match)
+        yield position, match
+    for shadow_position in range(len(shadow_items)):
+        if shadow_position not in paired:
+            yield None, shadow_position
+
+
+class BulkResponseComparator(BaseBodyComparator):
+    """Compares the `items` of `_bulk` responses one by one (in linear time), by their op type, status, result and
+    error type. The diff is a summary: the number of items that differ, counted by their outcomes on each cluster
+    (e.g. `"created -> version_conflict_engine_exception"`), and the first few of them."""
+    name = "bulk_items"
+    handled_keys = frozenset(["items"])
+
+    def applies_to(self, request: Optional[Request], primary_body: Any, shadow_body: Any) -> bool:
+        # Other APIs' responses can have an `items` list too, so this only applies to `_bulk` requests (which are
+        # identified the same way when their bodies are parsed, see `data.Request`).
+        if request is None or request.uri is None or "_bulk" not in request.uri:
+            return False
+        return all(isinstance(body, dict) and isinstance(body.get("items"), list)
+                   for body in (primary_body, shadow_body))
+
+    def compare(self, primary_body: dict, shadow_body: dict) -> dict:
+        primary_items, shadow_items = primary_body["items"], shadow_body["items"]
+        outcomes: Counter = Counter()
+        examples = []
+        for primary_position, shadow_position in match_bulk_items(primary_items, shadow_items):
+            primary_item = primary_items[primary_position] if primary_position is not None else None
+            shadow_item = shadow_items[shadow_position] if shadow_position is not None else None
+            if primary_item is not None and shadow_item is not None and \
+                    _bulk_item_outcome(primary_item) == _bulk_item_outcome(shadow_item):
+                continue
+            outcomes[f"{_bulk_outcome_label(primary_item)} -> {_bulk_outcome_label(shadow_item)}"] += 1
+            if len(examples) < DIFF_EXAMPLES:
+                examples.append({"primary_position": primary_position, "shadow_position": shadow_position,
+                                 "old_value": _bulk_item_summary(primary_item),
+                                 "new_value": _bulk_item_summary(shadow_item)})
+        if not outcomes:
+            return {}
+        return {"bulk_items_changed": {"root['items']": {
+            "items": max(len(primary_items), len(shadow_items)),
+            "differing": sum(outcomes.values()),
+            "by_outcome": dict(outcomes.most_common()),
+            "examples": examples,
+        }}}
+
+
+# Scores (and other floating point values in search responses) are equal if they're within this relative tolerance of
+# each other, since they can differ slightly between versions (e.g. with changes to the scoring implementation).
+# Integers (e.g. the hits total and the buckets' doc counts) are counts, which are only equal if they're the same.
+DEFAULT_SCORE_TOLERANCE = 1e-4
+_score_tolerance = DEFAULT_SCORE_TOLERANCE
+
+
+def set_score_tolerance(score_tolerance: float) -> None:
+    global _score_tolerance
+    _score_tolerance = score_tolerance
+
+
+def score_tolerance() -> float:
+    return _score_tolerance
+
+
+# The fields of a search hit that aren't compared: the shard, node and sequence numbers of a document differ between
+# clusters. The score and source are compared separately, and the index and id identify the hit.
+SEARCH_HIT_FIELDS_TO_IGNORE = frozenset(["_shard", "_node", "_seq_no", "_primary_term", "_version", "_explanation",
+                                         "_score", "_source", "_index", "_id"])
+
+
+def _is_number(value: Any) -> bool:
+    return type(value) in (int, float)
+
+
+def _numbers_match(primary: Any, shadow: Any, tolerance: float) -> bool:
+    if type(primary) is float or type(shadow) is float:
+        return math.isclose(primary, shadow, rel_tol=tolerance)
+    return primary == shadow
+
+
+def _add_change(diff: dict, change_type: str, path: str, details: Any) -> None:
+    diff.setdefault(change_type, {})[path] = details
+
+
+def _bucket_key(bucket: Any, position: int) -> Any:
+    if isinstance(bucket, dict):
+        key = bucket.get("key_as_string", bucket.get("key", position))
+        # Composite and multi-terms keys are dicts and lists.
+        return key if isinstance(key, (str, int, float, bool)) else repr(key)
+    return position
+
+
+class SearchResponseComparator(BaseBodyComparator):
+    """Compares `_search` responses by their hits, which are indexed by `_index` and `_id`: which hits are missing or
+    added, whether they're in a different order (documents with the same score can be in either order), and whether
+    their `_source`, other fields or scores differ (within the score tolerance). The diff of each of these is the
+    number of hits that differ, and the first few of them. The aggregations are compared bucket by bucket, with the
+    buckets matched by their keys rather than their positions, and the hits' metadata (e.g. the total) and the
+    aggregations' values as usual, except that floating point numbers are compared within the score tolerance."""
+    name = "search_hits"
+    handled_keys = frozenset(["hits", "aggregations"])
+
+    def applies_to(self, request: Optional[Request], primary_body: Any, shadow_body: Any) -> bool:
+        return all(isinstance(body, dict) and isinstance(body.get("hits"), dict) and
+                   isinstance(body["hits"].get("hits"), list) for body in (primary_body, shadow_body))
+
+    def compare(self, primary_body: dict, shadow_body: dict) -> dict:
+        diff: dict = {}
+        tolerance = _score_tolerance
+        primary_hits, shadow_hits = primary_body["hits"], shadow_body["hits"]
+        self._compare_values({k: v for k, v in primary_hits.items() if k != "hits"},
+                             {k: v for k, v in shadow_hits.items() if k != "hits"}, "root['hits']", diff, tolerance)
+        self._compare_hits(primary_hits["hits"], shadow_hits["hits"], diff, tolerance)
+        if "aggregations" in primary_body or "aggregations" in shadow_body:
+            self._compare_values(primary_body.get("aggregations"), shadow_body.get("aggregations"),
+                                 "root['aggregations']", diff, tolerance)
+        return diff
+
+    @staticmethod
+    def _scores_match(primary_score: Any, shadow_score: Any, tolerance: float) -> bool:
+        if _is_number(primary_score) and _is_number(shadow_score):
+            return _numbers_match(primary_score, shadow_score, tolerance)
+        return primary_score == shadow_score
+
+    def _compare_hits(self, primary_hits: List[Any], shadow_hits: List[Any], diff: dict, tolerance: float) -> None:
+        path = "root['hits']['hits']"
+
+        def index(hits: List[Any]) -> Dict[Any, dict]:
+            # Hits without an id (which shouldn't happen) are identified by their position.
+            return {(hit.get("_index"), hit["_id"]) if "_id" in hit else ("position", position): hit
+                    for position, hit in enumerate(hits) if isinstance(hit, dict)}
+
+        primary_by_key, shadow_by_key = index(primary_hits), index(shadow_hits)
+        removed = [key for key in primary_by_key if key not in shadow_by_key]
+        added = [key for key in shadow_by_key if key not in primary_by_key]
+        for change_type, keys in [("search_hits_removed", removed), ("search_hits_added", added)]:
+            if keys:
+                _add_change(diff, change_type, path, {"count": len(keys), "examples": keys[:DIFF_EXAMPLES]})
+
+        # Documents in a different order only matter if they don't have the same score (ties can be in any order).
+        primary_order = [key for key in primary_by_key if key in shadow_by_key]
+        shadow_order = [key for key in shadow_by_key if key in primary_by_key]
+        moved = [{"position": position, "old_value": primary_key, "new_value": shadow_key}
+                 for position, (primary_key, shadow_key) in enumerate(zip(primary_order, shadow_order))
+                 if primary_key != shadow_key and not self._scores_match(
+                     primary_by_key[primary_key].get("_score"), primary_by_key[shadow_key].get("_score"), tolerance)]
+        if moved:
+            _add_change(diff, "search_hits_order_changed", path, {"count": len(moved),
+                                                                  "examples": moved[:DIFF_EXAMPLES]})
+
+        sources_changed, fields_changed, scores_changed = [], [], []
+        for key in primary_order:
+            primary_hit, shadow_hit = primary_by_key[key], shadow_by_key[key]
+            if primary_hit.get("_source") != shadow_hit.get("_source"):
+                sources_changed.append({"hit": key, "old_value": primary_hit.get("_source"),
+                                        "new_value": shadow_hit.get("_source")})
+            primary_fields = {k: v for k, v in primary_hit.items() if k not in SEARCH_HIT_FIELDS_TO_IGNORE}
+            shadow_fields = {k: v for k, v in shadow_hit.items() if k not in SEARCH_HIT_FIELDS_TO_IGNORE}
+            if primary_fields != shadow_fields:
+                fields_changed.append({"hit": key, "old_value": primary_fields, "new_value": shadow_fields})
+            if not self._scores_match(primary_hit.get("_score"), shadow_hit.get("_score"), tolerance):
+                scores_changed.append({"hit": key, "old_value": primary_hit.get("_score"),
+                                       "new_value": shadow_hit.get("_score")})
+        for change_type, changes in [("search_hit_sources_changed", sources_changed),
+                                     ("search_hit_fields_changed", fields_changed),
+                                     ("search_hit_scores_changed", scores_changed)]:
+            if changes:
+                _add_change(diff, change_type, path, {"count": len(changes), "examples": changes[:DIFF_EXAMPLES]})
+
+    def _compare_values(self, primary: Any, shadow: Any, path: str, diff: dict, tolerance: float) -> None:
+        """Compare two values (e.g. aggregations), recursively, in the format of a DeepDiff result. Floats are compared
+        within the tolerance (and integers, which are counts, exactly), and lists of buckets by the buckets' keys."""
+        if isinstance(primary, dict) and isinstance(shadow, dict):
+            for key, primary_value in primary.items():
+                if key not in shadow:
+                    _add_change(diff, "dictionary_item_removed", f"{path}['{key}']", {"old_value": primary_value})
+                elif key == "buckets" and isinstance(primary_value, list) and isinstance(shadow[key], list):
+                    self._compare_values({_bucket_key(b, i): b for i, b in enumerate(primary_value)},
+                                         {_bucket_key(b, i): b for i, b in enumerate(shadow[key])},
+                                         f"{path}['buckets']", diff, tolerance)
+                else:
+                    self._compare_values(primary_value, shadow[key], f"{path}['{key}']", diff, tolerance)
+            for key, shadow_value in shadow.items():
+                if key not in primary:
+                    _add_change(diff, "dictionary_item_added", f"{path}['{key}']", {"new_value": shadow_value})
+        elif _is_number(primary) and _is_number(shadow):
+            if not _numbers_match(primary, shadow, tolerance):
+                _add_change(diff, "values_changed", path, {"new_value": shadow, "old_value": primary})
+        elif type(primary) is not type(shadow):
+            _add_change(diff, "type_changes", path, {"old_type": type(primary).__name__, "new_type":
+                                                     type(shadow).__name__, "old_value": primary,
+                                                     "new_value": shadow})
+        elif primary != shadow:
+            _add_change(diff, "values_changed", path, {"new_value": shadow, "old_value": primary})
+
+
+# The body comparators, in order of precedence. The first one that applies to a pair of responses is used.
+BODY_COMPARATORS: List[BaseBodyComparator] = [BulkResponseComparator(), SearchResponseComparator()]
+
+
+def find_body_comparator(request: Optional[Request], primary_body: Any,
+                         shadow_body: Any) -> Optional[BaseBodyComparator]:
+    for comparator in BODY_COMPARATORS:
+        if comparator.applies_to(request, primary_body, shadow_body):
+            return comparator
+    return None
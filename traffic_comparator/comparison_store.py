@@ -0,0 +1,96 @@
+import logging
+import re
+import sys
+import tempfile
+from collections import deque
+from typing import IO, Deque, Iterator, Optional, Union
+
+from traffic_comparator.response_comparison import ResponseComparison
+
+logger = logging.getLogger(__name__)
+
+# The comparisons retained for the final reports (e.g. by `stream-report --export-reports`) are kept in a store whose
+# memory is bounded, however long the run is. The most recent comparisons are kept in memory as json records (which
+# are much smaller than the loaded comparisons), and once they take more than `max_memory` bytes, the oldest ones are
+# spilled to a temporary append-only file. The reports read the comparisons back one at a time, in the order they were
+# added, so only the comparison that's being exported is ever loaded.
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+
+_BYTE_SIZE = re.compile(r"\s*(\d+)\s*([KMG]?)i?B?\s*", re.IGNORECASE)
+_BYTE_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_byte_size(size: str) -> int:
+    """The number of bytes in a size such as "512M", "2GB" or "1048576"."""
+    match = _BYTE_SIZE.fullmatch(size)
+    if match is None:
+        raise ValueError(f"'{size}' isn't a size, such as 512M or 2G.")
+    return int(match.group(1)) * _BYTE_SIZE_UNITS[match.group(2).upper()]
+
+
+class ComparisonStore:
+    """The comparisons retained for the final reports, in a bounded amount of memory (see above). It can be iterated
+    over any number of times, but comparisons shouldn't be added while it's being iterated over."""
+    def __init__(self, max_memory: int = DEFAULT_MAX_MEMORY) -> None:
+        self.max_memory = max_memory
+        self._records: Deque[bytes] = deque()
+        self._memory = 0
+        self._spill_file: Optional[IO[bytes]] = None
+        self._spilled = 0
+
+    def __len__(self) -> int:
+        return self._spilled + len(self._records)
+
+    @property
+    def memory(self) -> int:
+        """The number of bytes of the records held in memory."""
+        return self._memory
+
+    @property
+    def spilled(self) -> int:
+        """The number of comparisons that were spilled to disk."""
+        return self._spilled
+
+    def add(self, comparison: ResponseComparison) -> None:
+        # Summaries (which don't have bodies or diff values) are stored as summaries, so they're loaded back as such.
+        self.add_record(comparison.to_json(summary_only=comparison.is_summary))
+
+    def add_record(self, record: Union[str, bytes]) -> None:
+        """Add a comparison that's already been encoded as json (e.g. the line it was read from)."""
+        if isinstance(record, str):
+            record = record.encode('utf-8')
+        record = record.rstrip(b"\r\n")
+        self._records.append(record)
+        self._memory += sys.getsizeof(record)
+        while self._memory > self.max_memory and self._records:
+            self._spill(self._records.popleft())
+
+    def _spill(self, record: bytes) -> None:
+        if self._spill_file is None:
+            self._spill_file = tempfile.NamedTemporaryFile(prefix="traffic-comparator-", suffix=".jsonl")
+            logger.info(f"The retained comparisons take more than {self.max_memory} bytes, so the oldest ones are "
+                        f"spilled to {self._spill_file.name}.")
+        self._spill_file.write(record)
+        self._spill_file.write(b"\n")
+        self._memory -= sys.getsizeof(record)
+        self._spilled += 1
+
+    def __iter__(self) -> Iterator[ResponseComparison]:
+        spilled, records = self._spilled, list(self._records)
+        if self._spill_file is not None:
+            self._spill_file.flush()
+            # The spill file is read through its own handle, so reading it doesn't move the position it's written at.
+            with open(self._spill_file.name, 'rb') as spilled_records:
+                for _, record in zip(range(spilled), spilled_records):
+                    yield ResponseComparison.from_json(record)
+        for record in records:
+            yield ResponseComparison.from_json(record)
+
+    def close(self) -> None:
+        """Remove the spill file. The store is empty afterwards."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._records.clear()
+        self._memory = 0
+        self._spilled = 0
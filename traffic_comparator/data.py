@@ -2,48 +2,193 @@ from __future__ import annotations
 
 import base64
 import gzip
-import json
 import logging
 from collections import namedtuple
-from dataclasses import dataclass
-from typing import List, Optional, Union
+from dataclasses import dataclass, field, fields
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+from traffic_comparator import codec
 
 logger = logging.getLogger(__name__)
 
 
-def decodeAndDecompressBody(raw_body: bytes, is_gzipped: bool, charset: str = 'utf-8') -> str:
+def decodeAndDecompressBodyBytes(raw_body: bytes, is_gzipped: bool) -> bytes:
     b64decoded = base64.b64decode(raw_body)
     if is_gzipped:
         try:
-            return gzip.decompress(b64decoded).decode(charset)
+            return gzip.decompress(b64decoded)
         except gzip.BadGzipFile as e:
             logger.error(f"Encountered error unpacking gzipped message: {e}")
             logger.debug(f"Original message: {b64decoded}")
-            return ""
-    return b64decoded.decode(charset)
+            return b""
+    return b64decoded
+
+
+def decodeAndDecompressBody(raw_body: bytes, is_gzipped: bool, charset: str = 'utf-8') -> str:
+    return decodeAndDecompressBodyBytes(raw_body, is_gzipped).decode(charset)
 
 
 def parseBodyAsJson(body: str) -> Union[dict, str]:
     try:
-        return json.loads(body)
-    except json.JSONDecodeError as e:
+        return codec.loads(body)
+    except codec.JSONDecodeError as e:
         logger.info("Message body could not be loaded as json, returning as string instead. "
                     f"Details: {e}")
         return body
 
 
-def parseBodyAsBulk(body: str) -> List[dict]:
-    bulk_lines = body.splitlines()
+# The operations of a bulk request that aren't followed by a source line.
+BULK_OPERATIONS_WITHOUT_SOURCE = frozenset(["delete"])
+BULK_OPERATION_TYPES = frozenset(["index", "create", "update"]) | BULK_OPERATIONS_WITHOUT_SOURCE
+
+# If this is set, the bodies of bulk requests only keep the action metadata of each operation (the op type, index and
+# id), and the source lines are skipped without being parsed. This is enough when the request bodies are only needed
+# for reporting, and it saves most of the time and memory spent on large bulk requests.
+_bulk_metadata_only = False
+
+
+def set_bulk_metadata_only(metadata_only: bool) -> None:
+    global _bulk_metadata_only
+    _bulk_metadata_only = metadata_only
+
+
+def bulk_metadata_only() -> bool:
+    return _bulk_metadata_only
+
+
+class BulkOperation(NamedTuple):
+    """A single operation of a bulk request: its action line (e.g. `{"index": {"_index": "movies", "_id": "1"}}`) and
+    its source line, if it has one (deletes don't, and it's omitted if only the metadata is kept)."""
+    op_type: str
+    action: dict
+    source: Optional[dict] = None
+
+    @property
+    def index(self) -> Optional[str]:
+        return self.metadata.get("_index")
+
+    @property
+    def id(self) -> Optional[str]:
+        return self.metadata.get("_id")
+
+    @property
+    def metadata(self) -> dict:
+        metadata = self.action[self.op_type]
+        return metadata if isinstance(metadata, dict) else {}
+
+
+def parseBulkOperations(body: Union[bytes, str], metadata_only: bool = False) -> Iterator[BulkOperation]:
+    """Parse the NDJSON body of a bulk request into its operations, one at a time. Each line is parsed straight from
+    (a view of) the body, so no copies of the lines are made, and with `metadata_only` the source lines aren't parsed at
+    all. Lines that can't be parsed, and source lines without an action, are logged and skipped."""
+    data = body.encode('utf-8') if isinstance(body, str) else body
+    # This runs for every line of every bulk request, so the lookups are done once.
+    loads = codec.active_loads()
+    find = data.find
+    size = len(data)
+    position = 0
+    # The action that's waiting for its source line, if any.
+    action = None
+    op_type = None
+    with memoryview(data) as view:
+        while position < size:
+            end = find(b"\n", position)
+            if end == -1:
+                end = size
+            start, position = position, end + 1
+            if end == start:
+                continue
+            if action is not None and metadata_only:
+                # This is the source line of the pending action, which is skipped without being parsed.
+                yield BulkOperation(op_type, action)  # type: ignore
+                action = None
+                continue
+            try:
+                item = loads(view[start:end])  # A trailing "\r" is whitespace to the json parser.
+            except codec.JSONDecodeError as e:
+                if data[start:end].strip():
+                    logger.error(f"A line of a bulk request could not be loaded as json. Details: {e}")
+                    if action is not None:
+                        # This was the source line of the pending action, which is kept without it (otherwise the
+                        # next action line would be taken as its source).
+                        yield BulkOperation(op_type, action)  # type: ignore
+                        action = None
+                continue
+            if action is not None:
+                yield BulkOperation(op_type, action, item)  # type: ignore
+                action = None
+                continue
+            op_type = next(iter(item), None) if type(item) is dict and len(item) == 1 else None
+            if op_type not in BULK_OPERATION_TYPES:
+                logger.error(f"A line of a bulk request isn't an action, and doesn't follow one. Skipping it: {item}")
+            elif op_type in BULK_OPERATIONS_WITHOUT_SOURCE:
+                yield BulkOperation(op_type, item)  # type: ignore
+            else:
+                action = item
+    if action is not None:
+        logger.error(f"The last action of a bulk request doesn't have a source line: {action}")
+        yield BulkOperation(op_type, action)  # type: ignore
+
+
+def parseBodyAsBulk(body: Union[bytes, str], metadata_only: bool = False) -> List[dict]:
+    """The lines of a bulk request body (the action and source of each operation, in order, or only the actions with
+    `metadata_only`), parsed with `parseBulkOperations`."""
     bulk_jsons = []
-    for line in bulk_lines:
-        try:
-            bulk_jsons.append(json.loads(line))
-        except json.JSONDecodeError as e:
-            logger.error("A line of a bulk request could not be loaded as json. "
-                         f"Details: {e}")
+    for operation in parseBulkOperations(body, metadata_only):
+        bulk_jsons.append(operation.action)
+        if operation.source is not None:
+            bulk_jsons.append(operation.source)
     return bulk_jsons
 
 
+# The path segment after one of these endpoints is a document id.
+DOCUMENT_ID_ENDPOINTS = frozenset(["_doc", "_create", "_update", "_source", "_explain", "_termvectors"])
+
+
+def uriTemplate(uri: Optional[str]) -> Optional[str]:
+    """Normalize a request URI to a template that groups together requests to the same endpoint, by dropping the
+    query string and replacing index names and document ids with placeholders. Any segment that starts with an
+    underscore is an endpoint and is kept as is. For example, `/movies/_doc/123?refresh=true` becomes
+    `/{index}/_doc/{id}` and `/_cluster/health` is unchanged."""
+    if uri is None:
+        return None
+    segments = uri.split("?", 1)[0].split("/")
+    for i, segment in enumerate(segments):
+        if i == 1 and segment and not segment.startswith("_"):
+            segments[i] = "{index}"
+        elif i > 1 and segments[i - 1] in DOCUMENT_ID_ENDPOINTS and segment:
+            segments[i] = "{id}"
+    return "/".join(segments)
+
+
+class LazyBody:
+    """The `body` of a Request or Response, which is only decoded (base64-decoded, decompressed and parsed) from the
+    raw body the first time it's accessed. Many consumers never look at some bodies (e.g. request bodies are never
+    compared, and the reports only need status codes and latencies), so this avoids paying for decoding them, which
+    can be expensive for large (e.g. `_bulk`) bodies.
+
+    This is a non-data descriptor: once the body has been decoded (or if it was provided directly) it's stored in the
+    instance's `__dict__`, which takes precedence over the descriptor, so later accesses are plain attribute lookups.
+    """
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            # This is the default value of the dataclass field.
+            return None
+        body = instance._decode_body()
+        instance.__dict__["body"] = body
+        # The raw body is no longer needed once it's been decoded.
+        instance.raw_body = None
+        return body
+
+
+def _has_raw_body(raw_body: Optional[bytes]) -> bool:
+    return raw_body is not None and len(raw_body) > 0
+
+
+def _is_gzipped(headers: Union[dict, str, None]) -> bool:
+    return type(headers) is dict and "content-encoding" in headers and headers["content-encoding"] == "gzip"
+
+
 @dataclass
 class Request:
     """
@@ -55,32 +200,46 @@ class Request:
     http_method: Optional[str] = None  # could be an enum
     uri: Optional[str] = None
     headers: Union[dict, str, None] = None
-    raw_body: Optional[bytes] = None
-    body: Union[dict, str, List[dict], None] = None
+    # The raw body is only kept until the body is decoded, so it isn't part of the comparisons or repr.
+    raw_body: Optional[bytes] = field(default=None, compare=False, repr=False)
+    body: Union[dict, str, List[dict], None] = LazyBody()  # type: ignore
 
     def __post_init__(self):
         """This method is called after the initialization, and is used to
-        decode and decompress the raw body, as applicable."""
+        prepare the raw body to be decoded and decompressed (as applicable) when it's first accessed."""
         if self.body and not self.raw_body:
             # This is the case where it was already intantiated and is being recreated
             # for the report generator.
             return
 
-        has_body = self.raw_body is not None and len(self.raw_body) > 0
-        is_gzipped = type(self.headers) is dict and \
-            "content-encoding" in self.headers and \
-            self.headers["content-encoding"] == "gzip"
-        is_bulk = self.uri is not None and "_bulk" in self.uri
-
-        if not has_body:
+        if not _has_raw_body(self.raw_body):
             self.body = None
             self.raw_body = None
             return
-        # This assert matches the criteria of has_body. It's necessary for the type checking to trust the next line.
+        # Remove the body set by the initializer, so that accessing it goes through the LazyBody.
+        del self.__dict__["body"]
+
+    def _decode_body(self) -> Union[dict, str, List[dict], None]:
+        # This matches the criteria of __post_init__. It's necessary for the type checking to trust the next line.
         assert self.raw_body is not None
-        decoded_body = decodeAndDecompressBody(self.raw_body, is_gzipped)
-        self.body = parseBodyAsBulk(decoded_body) if is_bulk else parseBodyAsJson(decoded_body)
-        self.raw_body = None
+        is_bulk = self.uri is not None and "_bulk" in self.uri
+        if is_bulk:
+            # The bulk body is parsed straight from the decoded bytes, without decoding it into a string first.
+            return parseBodyAsBulk(decodeAndDecompressBodyBytes(self.raw_body, _is_gzipped(self.headers)),
+                                   metadata_only=_bulk_metadata_only)
+        return parseBodyAsJson(decodeAndDecompressBody(self.raw_body, _is_gzipped(self.headers)))
+
+    @property
+    def body_is_decoded(self) -> bool:
+        return "body" in self.__dict__
+
+    @property
+    def uri_template(self) -> Optional[str]:
+        return uriTemplate(self.uri)
+
+    def to_dict(self) -> dict:
+        """The json-serializable fields of the request. The raw body is omitted, since it's decoded into the body."""
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != "raw_body"}
 
     def equivalent_to(self, other: Request):
         return (self.http_method, self.uri, self.headers, self.body) == \
@@ -92,37 +251,50 @@ class Response:
     timestamp: Optional[int] = None  # int in epoch seconds format
     statuscode: Optional[int] = None
     headers: Union[dict, None] = None
-    body: Union[dict, str, None] = None
+    body: Union[dict, str, None] = LazyBody()  # type: ignore
     latency: Optional[int] = None  # Latency in ms
-    raw_body: Optional[bytes] = None
-    body: Union[dict, str, None] = None
+    # The raw body is only kept until the body is decoded, so it isn't part of the comparisons or repr.
+    raw_body: Optional[bytes] = field(default=None, compare=False, repr=False)
+    # The canonical (masked and serialized) form of the body, cached by the ResponseComparison when it's first needed.
+    _canonical_body: Optional[str] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         """This method is called after the initialization, and is used to
-        decode and decompress the raw body, as applicable."""
+        prepare the raw body to be decoded and decompressed (as applicable) when it's first accessed."""
         if self.body and not self.raw_body:
             # This is the case where it was already intantiated and is being recreated
             # for the report generator. The body is already prepared.
             return
 
-        has_body = self.raw_body is not None and len(self.raw_body) > 0
-        is_gzipped = type(self.headers) is dict and \
-            "content-encoding" in self.headers and \
-            self.headers["content-encoding"] == "gzip"
-
-        if not has_body:
+        if not _has_raw_body(self.raw_body):
             self.body = None
             self.raw_body = None
             return
-        # This assert matches the criteria of has_body. It's necessary for the type checking to trust the next line.
-        assert self.raw_body is not None
-        decoded_body = decodeAndDecompressBody(self.raw_body, is_gzipped)
-        self.body = parseBodyAsJson(decoded_body)  # Responses are never bulk calls
-        self.raw_body = None
+        # Remove the body set by the initializer, so that accessing it goes through the LazyBody.
+        del self.__dict__["body"]
 
         # Process the headers to make all keys lower case, allowing for more consistent comparisons.
         self.headers = {k.lower(): v for k, v in self.headers.items()} if self.headers else None
 
+    def _decode_body(self) -> Union[dict, str, None]:
+        # This matches the criteria of __post_init__. It's necessary for the type checking to trust the next line.
+        assert self.raw_body is not None
+        decoded_body = decodeAndDecompressBody(self.raw_body, _is_gzipped(self.headers))
+        return parseBodyAsJson(decoded_body)  # Responses are never bulk calls
+
+    @property
+    def body_is_decoded(self) -> bool:
+        return "body" in self.__dict__
+
+    def decode_body(self) -> Union[dict, str, None]:
+        """Decode the body now if it hasn't been already, instead of when it's first accessed, and return it."""
+        return self.body
+
+    def to_dict(self) -> dict:
+        """The json-serializable fields of the response. The raw body is omitted, since it's decoded into the body,
+        as are any cached values."""
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != "raw_body" and f.init}
+
 
 @dataclass
 class RequestResponsePair:
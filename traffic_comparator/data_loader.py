@@ -1,8 +1,10 @@
 import logging
-from typing import Generator, IO
+from pathlib import Path
+from typing import Generator, IO, Iterator, Union
 
 from traffic_comparator.data import MatchedRequestResponsePair
 from traffic_comparator.log_file_loader import LogFileFormat, getLogFileLoader
+from traffic_comparator.triples_file import DEFAULT_CHUNK_SIZE, FileRange, file_chunks, open_triples_file
 
 logger = logging.getLogger(__name__)
 
@@ -17,3 +19,20 @@ class StreamingDataLoader:
         loader = self.log_loader.load(self._input)
         for line in loader:
             yield line
+
+
+class TriplesFileDataLoader(StreamingDataLoader):
+    """Loads the triples from a (possibly gzip or zstd-compressed) file on disk. Besides reading it from start to end,
+    the file can be split into chunks (see `triples_file.file_chunks`) that are loaded independently, e.g. by worker
+    processes."""
+    def __init__(self, path: Union[str, Path], chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        super().__init__(None)  # type: ignore
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def next_input(self) -> Generator[MatchedRequestResponsePair, None, None]:
+        with open_triples_file(self.path) as input:
+            yield from self.log_loader.load(input)
+
+    def chunks(self) -> Iterator[Union[FileRange, bytes]]:
+        return file_chunks(self.path, self.chunk_size)
@@ -0,0 +1,390 @@
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from traffic_comparator.data import uriTemplate
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.sketches import DEFAULT_REPLICATES, BootstrapHistogram, LatencyHistogram, PoissonWeights
+
+# The PerformanceReport collects the latencies, status codes and endpoints of the comparisons into the columns of a
+# LatencyTable (growable numpy arrays), and computes all of its statistics from them with vectorized operations:
+# the quantiles of each column in a single `np.quantile` call, and the breakdowns (by endpoint and by status class)
+# by ordering the rows by group once and taking the quantiles of each group's slice of every column.
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+INITIAL_CAPACITY = 1024
+APPEND_CHUNK_SIZE = 4096
+
+# Endpoints are the method and the uri template of the requests (see `uriTemplate`), so that e.g. all of the
+# `GET /movies/_doc/<id>` requests are grouped together. The endpoint of each (method, uri) pair is cached, since
+# templating every uri would be comparatively slow.
+ENDPOINT_CACHE_SIZE = 100_000
+UNKNOWN_ENDPOINT = "(unknown request)"
+
+
+@lru_cache(maxsize=ENDPOINT_CACHE_SIZE)
+def endpoint_name(method: Optional[str], uri: Optional[str]) -> str:
+    return f"{method} {uriTemplate(uri)}" if uri is not None else UNKNOWN_ENDPOINT
+
+
+def comparison_endpoint(comparison: ResponseComparison) -> str:
+    request = comparison.original_request
+    return endpoint_name(request.http_method, request.uri) if request else UNKNOWN_ENDPOINT
+
+
+# Status codes are grouped by their class (2xx, 4xx, etc.), and 0 is used for a missing status code.
+MISSING_STATUS = 0
+
+
+class GrowableArray:
+    """A 1-d numpy array that values are appended to. Its capacity doubles whenever it's full, so appending is
+    amortized O(1) and the values are always contiguous (`values` is a view of them, not a copy)."""
+    def __init__(self, dtype, capacity: int = INITIAL_CAPACITY) -> None:
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int) -> None:
+        if size > len(self._data):
+            data = np.empty(max(size, 2 * len(self._data)), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+
+    def append(self, value) -> None:
+        self._reserve(self._size + 1)
+        self._data[self._size] = value
+        self._size += 1
+
+    def extend(self, values: Union[Sequence, np.ndarray]) -> None:
+        values = np.asarray(values, dtype=self._data.dtype)
+        self._reserve(self._size + len(values))
+        self._data[self._size:self._size + len(values)] = values
+        self._size += len(values)
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+
+
+class LatencyTable:
+    """The latencies (NaN if they're missing or not positive, which excludes them from the stats), status codes and
+    endpoints of comparisons, in columns.
+
+    Setting single items of numpy arrays is much slower than appending to a list, so added rows are buffered in a
+    list and copied into the columns in chunks."""
+    COLUMNS = [("primary_latency", np.float64), ("shadow_latency", np.float64), ("primary_status", np.int16),
+               ("shadow_status", np.int16), ("endpoint", np.int32)]
+
+    def __init__(self) -> None:
+        self._columns = {name: GrowableArray(dtype) for name, dtype in self.COLUMNS}
+        self._pending: List[tuple] = []
+        # The names of the endpoints, by their code in the endpoint column.
+        self.endpoints: List[str] = []
+        self._endpoint_codes: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._columns["endpoint"]) + len(self._pending)
+
+    def _flush(self) -> None:
+        if self._pending:
+            for (name, _), values in zip(self.COLUMNS, zip(*self._pending)):
+                self._columns[name].extend(values)
+            self._pending = []
+
+    def column(self, name: str) -> np.ndarray:
+        self._flush()
+        return self._columns[name].values
+
+    primary_latency = property(lambda self: self.column("primary_latency"))
+    shadow_latency = property(lambda self: self.column("shadow_latency"))
+    primary_status = property(lambda self: self.column("primary_status"))
+    shadow_status = property(lambda self: self.column("shadow_status"))
+    endpoint = property(lambda self: self.column("endpoint"))
+
+    def endpoint_code(self, method: Optional[str], uri: Optional[str]) -> int:
+        name = endpoint_name(method, uri)
+        code = self._endpoint_codes.get(name)
+        if code is None:
+            code = self._endpoint_codes[name] = len(self.endpoints)
+            self.endpoints.append(name)
+        return code
+
+    def add(self, primary_latency: Optional[float], shadow_latency: Optional[float], primary_status: Optional[int],
+            shadow_status: Optional[int], method: Optional[str] = None, uri: Optional[str] = None) -> None:
+        self._pending.append((primary_latency if primary_latency and primary_latency > 0 else np.nan,
+                              shadow_latency if shadow_latency and shadow_latency > 0 else np.nan,
+                              primary_status or MISSING_STATUS, shadow_status or MISSING_STATUS,
+                              self.endpoint_code(method, uri)))
+        if len(self._pending) >= APPEND_CHUNK_SIZE:
+            self._flush()
+
+    def add_comparison(self, comparison: ResponseComparison) -> None:
+        request = comparison.original_request
+        self.add(comparison.primary_response.latency, comparison.shadow_response.latency,
+                 comparison.primary_response.statuscode, comparison.shadow_response.statuscode,
+                 request.http_method if request else None, request.uri if request else None)
+
+    def extend(self, **columns: Union[Sequence, np.ndarray]) -> None:
+        """Adds the rows of the columns (by name, with the endpoint codes of `endpoints`) at once."""
+        self._flush()
+        for name, _ in self.COLUMNS:
+            self._columns[name].extend(columns[name])
+
+
+def quantiles(values: np.ndarray, qs: Sequence[float] = DEFAULT_QUANTILES) -> np.ndarray:
+    """All of the quantiles of the values that aren't NaN, in one call (NaN if there are none)."""
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return np.full(len(qs), np.nan)
+    return np.quantile(values, qs)
+
+
+def mean(values: np.ndarray) -> float:
+    """The mean of the values that aren't NaN (NaN if there are none)."""
+    valid = values[~np.isnan(values)]
+    return float(valid.mean()) if len(valid) else np.nan
+
+
+def group_order(groups: np.ndarray, number_of_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The order that sorts the rows by group, and the bounds of each group's rows in that order. The sort is stable,
+    so numpy uses a radix sort when the groups fit in 16 bits."""
+    small = number_of_groups <= np.iinfo(np.int16).max
+    order = np.argsort(groups.astype(np.int16) if small else groups, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(groups, minlength=number_of_groups))])
+    return order, bounds
+
+
+def grouped_quantiles(values: np.ndarray, groups: np.ndarray, number_of_groups: int,
+                      qs: Sequence[float] = DEFAULT_QUANTILES, order: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                      ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The count, mean and quantiles (a row per group) of the values that aren't NaN in each group. The groups are
+    integers in [0, number_of_groups), and the `group_order` of them can be passed to share it between columns.
+
+    The values are put in group order once, and the quantiles of each group's slice are a single `np.quantile` call,
+    which partitions the values (rather than sorting them)."""
+    order, bounds = order if order is not None else group_order(groups, number_of_groups)
+    sorted_values = values[order]
+    counts = np.zeros(number_of_groups, dtype=np.int64)
+    means = np.full(number_of_groups, np.nan)
+    result = np.full((number_of_groups, len(qs)), np.nan)
+    for group in np.flatnonzero(bounds[1:] > bounds[:-1]):
+        group_values = sorted_values[bounds[group]:bounds[group + 1]]
+        group_values = group_values[~np.isnan(group_values)]
+        counts[group] = len(group_values)
+        if len(group_values):
+            means[group] = group_values.mean()
+            result[group] = np.quantile(group_values, qs)
+    return counts, means, result
+
+
+class GroupLatencies(NamedTuple):
+    """The latency stats of a group of comparisons. The deltas (shadow - primary) and ratios (shadow / primary) are
+    paired, i.e. computed for each request that has both latencies."""
+    name: str
+    count: int
+    primary: np.ndarray  # The quantiles
+    shadow: np.ndarray
+    delta: np.ndarray
+    ratio: np.ndarray
+    ratio_geometric_mean: float
+
+
+def group_latencies(table: LatencyTable, groups: np.ndarray, names: Sequence[str],
+                    qs: Sequence[float] = DEFAULT_QUANTILES) -> List[GroupLatencies]:
+    """The latency stats of each group that has any comparisons, from the most to the least common."""
+    primary, shadow = table.primary_latency, table.shadow_latency
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios = shadow / primary
+        log_ratios = np.log(ratios)
+    order = group_order(groups, len(names))
+    counts = np.diff(order[1])
+    _, _, primary_quantiles = grouped_quantiles(primary, groups, len(names), qs, order)
+    _, _, shadow_quantiles = grouped_quantiles(shadow, groups, len(names), qs, order)
+    _, _, delta_quantiles = grouped_quantiles(shadow - primary, groups, len(names), qs, order)
+    _, log_ratio_means, ratio_quantiles = grouped_quantiles(log_ratios, groups, len(names), qs, order)
+    ratio_quantiles = np.exp(ratio_quantiles)
+    return [GroupLatencies(names[g], int(counts[g]), primary_quantiles[g], shadow_quantiles[g], delta_quantiles[g],
+                           ratio_quantiles[g], float(np.exp(log_ratio_means[g])))
+            for g in np.argsort(-counts, kind="stable") if counts[g] > 0]
+
+
+def by_endpoint(table: LatencyTable, qs: Sequence[float] = DEFAULT_QUANTILES) -> List[GroupLatencies]:
+    return group_latencies(table, table.endpoint, table.endpoints, qs)
+
+
+def by_status_class(table: LatencyTable, qs: Sequence[float] = DEFAULT_QUANTILES) -> List[GroupLatencies]:
+    """Grouped by the pair of status classes (e.g. `2xx -> 5xx` for a primary 200 and a shadow 503)."""
+    primary_class = np.clip(table.primary_status // 100, 0, 9).astype(np.int64)
+    shadow_class = np.clip(table.shadow_status // 100, 0, 9).astype(np.int64)
+
+    def class_name(status_class: int) -> str:
+        return f"{status_class}xx" if status_class else "none"
+    names = [f"{class_name(p)} -> {class_name(s)}" for p in range(10) for s in range(10)]
+    return group_latencies(table, primary_class * 10 + shadow_class, names, qs)
+
+
+def overall(table: LatencyTable, qs: Sequence[float] = DEFAULT_QUANTILES) -> GroupLatencies:
+    return group_latencies(table, np.zeros(len(table), dtype=np.int64), ["all"], qs)[0] if len(table) else \
+        GroupLatencies("all", 0, *[np.full(len(qs), np.nan)] * 4, np.nan)
+
+
+def format_breakdown(title: str, rows: List[GroupLatencies], qs: Sequence[float] = DEFAULT_QUANTILES,
+                     max_rows: int = 50) -> str:
+    """A table of the latency quantiles of each group (in ms), and of the paired deltas and ratios."""
+    labels = [f"p{q * 100:g}" for q in qs]
+    width = max([len(title)] + [len(row.name) for row in rows[:max_rows]])
+    header = f"{title:<{width}} {'count':>9} " + \
+        " ".join(f"{'primary ' + label:>12}" for label in labels) + " " + \
+        " ".join(f"{'shadow ' + label:>12}" for label in labels) + " " + \
+        " ".join(f"{'delta ' + label:>12}" for label in labels) + f" {'ratio (geo)':>12}"
+    lines = [header]
+    for row in rows[:max_rows]:
+        lines.append(f"{row.name:<{width}} {row.count:>9} " +
+                     " ".join(f"{value:>12.1f}" for value in [*row.primary, *row.shadow, *row.delta]) +
+                     f" {row.ratio_geometric_mean:>12.2f}")
+    if len(rows) > max_rows:
+        lines.append(f"... and {len(rows) - max_rows} more")
+    return "\n".join(lines) + "\n"
+
+
+# The paired stats of a LatencyRegressionReport. Each request's primary and shadow latencies are resampled together
+# (with the same bootstrap weights), so the confidence intervals of the differences between their quantiles account
+# for the pairing, and only the sketches are kept, so they work on unbounded streams.
+REGRESSION_QUANTILES = (0.5, 0.99)
+DEFAULT_CONFIDENCE = 0.95
+# A difference is only flagged as a regression if the whole confidence interval is above zero, there are enough pairs
+# for the bootstrap to be meaningful, and it's larger than the error of the sketches' quantiles (1% of each).
+MIN_REGRESSION_PAIRS = 30
+MIN_RELATIVE_REGRESSION = 0.02
+
+
+class QuantileDifference(NamedTuple):
+    """The difference between the shadow and primary quantiles (shadow - primary), and its confidence interval."""
+    quantile: float
+    primary: float
+    shadow: float
+    difference: float
+    low: float
+    high: float
+    is_regression: bool
+
+
+class PairedLatencyStats:
+    """Mergeable sketches of the pairs of latencies (primary and shadow) of requests: bootstrap histograms of each
+    cluster's latencies, and histograms of the paired deltas (shadow - primary) and ratios (shadow / primary). Pairs
+    without a positive latency for both clusters are skipped."""
+    def __init__(self, replicates: int = DEFAULT_REPLICATES) -> None:
+        self.primary = BootstrapHistogram(replicates)
+        self.shadow = BootstrapHistogram(replicates)
+        self.deltas = LatencyHistogram()
+        self.ratios = LatencyHistogram()
+
+    @property
+    def count(self) -> int:
+        return self.deltas.count
+
+    def add(self, primary_latency: Optional[float], shadow_latency: Optional[float], weights: np.ndarray) -> None:
+        if not (primary_latency and primary_latency > 0 and shadow_latency and shadow_latency > 0):
+            return
+        self.primary.add(primary_latency, weights)
+        self.shadow.add(shadow_latency, weights)
+        self.deltas.add(shadow_latency - primary_latency)
+        self.ratios.add(shadow_latency / primary_latency)
+
+    def merge(self, other: "PairedLatencyStats") -> None:
+        self.primary.merge(other.primary)
+        self.shadow.merge(other.shadow)
+        self.deltas.merge(other.deltas)
+        self.ratios.merge(other.ratios)
+
+    def quantile_differences(self, qs: Sequence[float] = REGRESSION_QUANTILES,
+                             confidence: float = DEFAULT_CONFIDENCE) -> List[QuantileDifference]:
+        """The difference of each quantile, with a percentile bootstrap confidence interval."""
+        primary, shadow = self.primary.quantiles(qs), self.shadow.quantiles(qs)
+        replicate_differences = self.shadow.replicate_quantiles(qs) - self.primary.replicate_quantiles(qs)
+        differences = []
+        for i, q in enumerate(qs):
+            if np.isnan(replicate_differences[i]).all():
+                low = high = np.nan
+            else:
+                low, high = np.nanquantile(replicate_differences[i], [(1 - confidence) / 2, (1 + confidence) / 2])
+            difference = shadow[i] - primary[i]
+            is_regression = bool(self.count >= MIN_REGRESSION_PAIRS and low > 0 and
+                                 difference > MIN_RELATIVE_REGRESSION * primary[i])
+            differences.append(QuantileDifference(q, primary[i], shadow[i], difference, low, high, is_regression))
+        return differences
+
+
+class PairedLatencyBreakdown:
+    """The PairedLatencyStats of each endpoint. The stats of all comparisons are merged from them when they're needed,
+    rather than updated for every comparison, which is equivalent since each comparison has a single set of weights."""
+    def __init__(self, replicates: int = DEFAULT_REPLICATES, seed: Optional[int] = 0) -> None:
+        self._replicates = replicates
+        self._weights = PoissonWeights(replicates, seed)
+        self.endpoints: Dict[str, PairedLatencyStats] = {}
+
+    def add_comparison(self, comparison: ResponseComparison) -> None:
+        primary_latency, shadow_latency = comparison.primary_response.latency, comparison.shadow_response.latency
+        if not (primary_latency and primary_latency > 0 and shadow_latency and shadow_latency > 0):
+            return
+        endpoint = comparison_endpoint(comparison)
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = PairedLatencyStats(self._replicates)
+        stats.add(primary_latency, shadow_latency, self._weights.next())
+
+    @property
+    def overall(self) -> PairedLatencyStats:
+        overall = PairedLatencyStats(self._replicates)
+        for stats in self.endpoints.values():
+            overall.merge(stats)
+        return overall
+
+    def merge(self, other: "PairedLatencyBreakdown") -> None:
+        for endpoint, stats in other.endpoints.items():
+            self.endpoints.setdefault(endpoint, PairedLatencyStats(self._replicates)).merge(stats)
+
+
+def _format_difference(difference: QuantileDifference) -> str:
+    return f"{difference.difference:+.1f} [{difference.low:+.1f}, {difference.high:+.1f}]"
+
+
+def format_regressions(breakdown: PairedLatencyBreakdown, qs: Sequence[float] = REGRESSION_QUANTILES,
+                       confidence: float = DEFAULT_CONFIDENCE, max_rows: int = 50) -> str:
+    """A table of the quantile differences (with their confidence intervals) and the median paired delta and ratio of
+    all comparisons and of each endpoint, with the regressions (marked with a `*`) first."""
+    overall_stats = breakdown.overall
+    rows = [("all", overall_stats, overall_stats.quantile_differences(qs, confidence))]
+    rows += [(endpoint, stats, stats.quantile_differences(qs, confidence))
+             for endpoint, stats in breakdown.endpoints.items()]
+    regressions = [name for name, _, differences in rows[1:] if any(d.is_regression for d in differences)]
+    endpoint_rows = sorted(rows[1:], key=lambda row: (row[0] not in regressions, -row[1].count))
+    rows = rows[:1] + endpoint_rows[:max_rows]
+
+    labels = [f"p{q * 100:g}" for q in qs]
+    cells = [["Endpoint", "pairs"] + [f"{label} {column}" for label in labels
+                                      for column in ["primary", "shadow", f"diff [{confidence:.0%} CI]"]] +
+             ["median delta", "median ratio"]]
+    for name, stats, differences in rows:
+        marker = "*" if any(d.is_regression for d in differences) else " "
+        quantile_cells = [cell for d in differences
+                          for cell in [f"{d.primary:.1f}", f"{d.shadow:.1f}", _format_difference(d)]]
+        cells.append([marker + name, str(stats.count)] + quantile_cells +
+                     [f"{stats.deltas.quantile(0.5):+.1f}", f"{stats.ratios.quantile(0.5):.2f}"])
+    widths = [max(len(row[i]) for row in cells) for i in range(len(cells[0]))]
+    lines = [f"{row[0]:<{widths[0]}} " + " ".join(f"{cell:>{width}}" for cell, width in zip(row[1:], widths[1:]))
+             for row in cells]
+    if len(endpoint_rows) > max_rows:
+        lines.append(f"... and {len(endpoint_rows) - max_rows} more")
+
+    summary = f"{len(regressions)} of {len(breakdown.endpoints)} endpoints have a significant latency regression"
+    summary += ":\n" + "".join(f"    {name}\n" for name in regressions) if regressions else ".\n"
+    return f"""
+Latency regressions of the shadow cluster: the differences between the shadow and primary quantiles of the paired
+latencies (in ms), with {confidence:.0%} bootstrap confidence intervals. A `*` marks the endpoints where a difference is
+significant (its whole interval is above zero) and larger than the {MIN_RELATIVE_REGRESSION:.0%} error of the quantiles.
+
+{summary}
+""" + "\n".join(lines) + "\n"
@@ -1,10 +1,11 @@
-import json
 import logging
+import time
 from abc import ABC, abstractmethod
 from enum import Enum
 from pathlib import Path
 from typing import IO, Generator, List, Type
 
+from traffic_comparator import codec, metrics
 from traffic_comparator.data import (MatchedRequestResponsePair, Request,
                                      RequestResponsePair, Response)
 
@@ -113,7 +114,7 @@ class ReplayerTriplesFileLoader(BaseLogFileLoader):
 
     @classmethod
     def _parseLine(cls, line) -> MatchedRequestResponsePair:
-        item = json.loads(line)
+        item = codec.loads(line)
 
         # If any of these objects are missing, it will throw an error and this log
         # line will be skipped. The error is logged by the caller.
@@ -133,10 +134,16 @@ class ReplayerTriplesFileLoader(BaseLogFileLoader):
     @classmethod
     def load(cls, input: IO) -> Generator[MatchedRequestResponsePair, None, None]:
         for line in input:  # This line will wait indefinitely for input if there's no EOF
+            metrics.count_line("triples")
+            start = time.perf_counter()
             try:
-                yield cls._parseLine(line)
-            except KeyError as e:
+                pair = cls._parseLine(line)
+            except (KeyError, ValueError) as e:  # ValueError includes invalid json
                 logger.debug(f"Log file line was skipped due to parsing error. {e}")
+                metrics.count_parse_failure("triples")
+                continue
+            metrics.observe_stage("parse", time.perf_counter() - start)
+            yield pair
 
 
 LOG_FILE_LOADER_MAPPING: dict[LogFileFormat, Type[BaseLogFileLoader]] = {
@@ -0,0 +1,220 @@
+import logging
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import yaml
+except ImportError:  # PyYAML is optional (`pip install .[yaml]`), mask files can also be json.
+    yaml = None
+
+from traffic_comparator import codec
+
+logger = logging.getLogger(__name__)
+
+# The errors raised when a mask file can't be parsed (codec.JSONDecodeError is a ValueError).
+_PARSING_ERRORS = (ValueError, yaml.YAMLError) if yaml is not None else (ValueError,)
+
+# Masks are the parts of the responses that are volatile or irrelevant (e.g. how long a request took, or the name of
+# the node that handled it), and are removed from both responses before they're compared or displayed. Each mask is a
+# path, such as:
+#   took                    the `took` key at the root of the body
+#   hits.hits[*]._score     the `_score` of every hit
+#   aggregations.*.meta     the `meta` of every aggregation
+#   items[0]                the first item
+#   ['key.with.dots']       a key that contains dots (or brackets)
+# DeepDiff-style paths (e.g. `root['took']`) are accepted as well. The masks are compiled into a trie, so they're
+# applied to a body in a single walk that only visits the parts of it that can be masked.
+
+DEFAULT_BODY_MASKS = ["cluster_name", "cluster_uuid", "name", "took", "tagline", "version", "_id", "_shards", "_seq_no"]
+DEFAULT_HEADER_MASKS = ["content-length", "access-control-allow-origin", "connection", "date", "location"]
+
+_ANY_KEY = "*"
+_TOKEN = re.compile(r"\.?([^.\[\]']+)|\[\*\]|\[(\d+)\]|\['([^']*)'\]|\[\"([^\"]*)\"\]")
+
+
+class InvalidMaskException(Exception):
+    def __init__(self, mask, details) -> None:
+        super().__init__(f"The mask '{mask}' is invalid. Details: {details}")
+
+
+class InvalidMaskFileException(Exception):
+    def __init__(self, path, details) -> None:
+        super().__init__(f"The mask file '{path}' can't be loaded. Details: {details}")
+
+
+def parse_mask(mask: str) -> List[Tuple[str, Any]]:
+    """The steps of a mask path, each of which is ("key", name), ("any_key", None), ("index", n) or
+    ("any_index", None)."""
+    path = mask[len("root"):] if mask.startswith("root[") else mask
+    steps: List[Tuple[str, Any]] = []
+    position = 0
+    while position < len(path):
+        match = _TOKEN.match(path, position)
+        if match is None or match.end() == position:
+            raise InvalidMaskException(mask, f"Unexpected character at position {position}: {path[position:]!r}")
+        key, index, quoted_key, double_quoted_key = match.groups()
+        if key is not None:
+            steps.append(("any_key", None) if key == _ANY_KEY else ("key", key))
+        elif index is not None:
+            steps.append(("index", int(index)))
+        elif quoted_key is not None or double_quoted_key is not None:
+            steps.append(("key", quoted_key if quoted_key is not None else double_quoted_key))
+        else:
+            steps.append(("any_index", None))
+        position = match.end()
+    if not steps:
+        raise InvalidMaskException(mask, "It's empty.")
+    return steps
+
+
+class _MaskNode:
+    __slots__ = ["masked", "keys", "any_key", "indexes", "any_index"]
+
+    def __init__(self) -> None:
+        # Whether the value at this node is removed.
+        self.masked = False
+        self.keys: Dict[str, _MaskNode] = {}
+        self.any_key: Optional[_MaskNode] = None
+        self.indexes: Dict[int, _MaskNode] = {}
+        self.any_index: Optional[_MaskNode] = None
+
+    def child(self, step: Tuple[str, Any]) -> "_MaskNode":
+        kind, value = step
+        if kind == "key":
+            return self.keys.setdefault(value, _MaskNode())
+        if kind == "index":
+            return self.indexes.setdefault(value, _MaskNode())
+        if kind == "any_key":
+            self.any_key = self.any_key or _MaskNode()
+            return self.any_key
+        self.any_index = self.any_index or _MaskNode()
+        return self.any_index
+
+
+class Mask:
+    """A set of mask paths, compiled into a trie. This is picklable, so it can be passed to the worker processes."""
+    def __init__(self, paths: Iterable[str] = ()) -> None:
+        self.paths = list(paths)
+        self._root = _MaskNode()
+        for path in self.paths:
+            node = self._root
+            for step in parse_mask(path):
+                node = node.child(step)
+            node.masked = True
+
+    def __bool__(self) -> bool:
+        return len(self.paths) > 0
+
+    def apply(self, value: Any) -> Any:
+        """The value without the masked parts. The value itself isn't modified: the containers along the masked paths
+        are copied (and everything else is shared), and if nothing is masked, the value is returned as is."""
+        return _apply(value, self._root)
+
+
+def _apply_to_child(value: Any, nodes: List[_MaskNode]) -> Tuple[bool, Any]:
+    """Whether the value is masked, and otherwise the value with the nodes applied."""
+    for node in nodes:
+        if node.masked:
+            return True, None
+    for node in nodes:
+        value = _apply(value, node)
+    return False, value
+
+
+def _apply(value: Any, node: _MaskNode) -> Any:
+    if type(value) is dict:
+        if not node.keys and node.any_key is None:
+            return value
+        if node.any_key is None:
+            # Only the keys in the mask need to be looked at.
+            candidates: Iterable[Any] = [key for key in node.keys if key in value]
+        else:
+            candidates = list(value)
+        result = None
+        for key in candidates:
+            nodes = [n for n in (node.keys.get(key), node.any_key) if n is not None]
+            masked, child = _apply_to_child(value[key], nodes)
+            if masked or child is not value[key]:
+                if result is None:
+                    result = dict(value)
+                if masked:
+                    del result[key]
+                else:
+                    result[key] = child
+        return value if result is None else result
+    if type(value) is list:
+        if not node.indexes and node.any_index is None:
+            return value
+        items: List[Any] = []
+        changed = False
+        for position, item in enumerate(value):
+            nodes = [n for n in (node.indexes.get(position), node.any_index) if n is not None]
+            masked, child = _apply_to_child(item, nodes)
+            changed = changed or masked or child is not item
+            if not masked:
+                items.append(child)
+        return items if changed else value
+    return value
+
+
+class Masks:
+    """The masks of the bodies and the headers of the responses."""
+    def __init__(self, body: Iterable[str] = DEFAULT_BODY_MASKS, headers: Iterable[str] = DEFAULT_HEADER_MASKS) -> None:
+        self.body = Mask(body)
+        # The header names of the responses are lowercased (see `data.Response`), so the header masks are as well.
+        self.headers = Mask([mask.lower() for mask in headers])
+
+
+def load_mask_file(path: Union[str, Path]) -> Masks:
+    """Load the masks from a YAML or json file, which has a list of `body` masks and/or `headers` masks. They're added
+    to the default masks, unless `replace_defaults` is true. For example:
+
+        replace_defaults: false
+        body:
+          - hits.hits[*]._score
+          - aggregations.*.meta
+        headers:
+          - x-request-id
+    """
+    try:
+        with open(path) as f:
+            if str(path).endswith((".yaml", ".yml")):
+                if yaml is None:
+                    raise InvalidMaskFileException(path, "PyYAML isn't installed (`pip install .[yaml]`), so it can't "
+                                                         "be read. Use a json file instead.")
+                config = yaml.safe_load(f)
+            else:
+                config = codec.loads(f.read())
+    except (OSError, *_PARSING_ERRORS) as e:
+        raise InvalidMaskFileException(path, e)
+    if not isinstance(config, dict) or not set(config) <= {"body", "headers", "replace_defaults"}:
+        raise InvalidMaskFileException(path, "It should have a list of `body` masks and/or `headers` masks (and "
+                                             "optionally `replace_defaults`).")
+    replace_defaults = bool(config.get("replace_defaults", False))
+    body = config.get("body") or []
+    headers = config.get("headers") or []
+    if not isinstance(body, list) or not isinstance(headers, list):
+        raise InvalidMaskFileException(path, "The `body` and `headers` masks should be lists.")
+    if not all(isinstance(mask, str) for mask in [*body, *headers]):
+        raise InvalidMaskFileException(path, "Each mask should be a string.")
+    try:
+        masks = Masks(body=body if replace_defaults else DEFAULT_BODY_MASKS + body,
+                      headers=headers if replace_defaults else DEFAULT_HEADER_MASKS + headers)
+    except InvalidMaskException as e:
+        raise InvalidMaskFileException(path, e)
+    logger.info(f"Loaded {len(body)} body masks and {len(headers)} header masks from {path}.")
+    return masks
+
+
+_active_masks = Masks()
+
+
+def set_active_masks(masks: Masks) -> None:
+    global _active_masks
+    _active_masks = masks
+
+
+def active_masks() -> Masks:
+    """The masks used by the comparisons and the reports."""
+    return _active_masks
@@ -0,0 +1,323 @@
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from traffic_comparator.data import uriTemplate
+from traffic_comparator.response_comparison import COMPARISON_TIER_COUNTS, ResponseComparison
+
+logger = logging.getLogger(__name__)
+
+# The comparator's metrics are exposed in the Prometheus text format (which OpenMetrics scrapers also accept) by a
+# MetricsServer, when one is started (with `--metrics-port`). They're process-wide, like the comparison tier counts,
+# and recording them is a no-op until they're enabled, so they cost nothing otherwise.
+#
+# The metrics are only updated by the thread that processes the stream, and they're plain ints and floats in dicts and
+# lists, so updating them needs no locks. The server's thread only reads them (copying each dict, which is atomic in
+# CPython), so a scrape may see a histogram that's one observation ahead in some buckets, which doesn't matter for
+# monitoring. Worker processes record their own metrics and hand them back with their results (see `take_snapshot`).
+METRIC_PREFIX = "traffic_comparator_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# The buckets of the processing time histograms, in seconds, and of the response latency histograms, in ms.
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1.0)
+LATENCY_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# The comparisons per second are measured over this many seconds, from samples of the comparisons counter.
+THROUGHPUT_WINDOW = 60
+
+_enabled = False
+
+
+def set_enabled(enabled: bool) -> None:
+    global _enabled
+    _enabled = enabled
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def _format_labels(labelnames: Sequence[str], labels: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def merge(self, values: Dict[Tuple[str, ...], float]) -> None:
+        for labels, value in values.items():
+            self.inc(*labels, amount=value)
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name}_total {self.description}"
+        yield f"# TYPE {self.name}_total counter"
+        values = dict(self.values)
+        if not values and not self.labelnames:
+            values = {(): 0}
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_number(value)}"
+
+
+class Histogram:
+    """A histogram with fixed buckets. The count of each bucket is only of the values in that bucket (so observing a
+    value increments a single count), and they're made cumulative when they're exposed."""
+    def __init__(self, name: str, description: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> None:
+        self.name = METRIC_PREFIX + name
+        self.description = description
+        self.buckets = list(buckets)
+        self.labelnames = tuple(labelnames)
+        # The counts of the buckets (and of the values above the last one), followed by the sum of the values.
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def quantile(self, q: float, *labels: str) -> float:
+        """An estimate of the q-quantile of the values, interpolated linearly within the bucket that it falls in (as
+        Prometheus' `histogram_quantile` does). A quantile above the last bucket is estimated as its upper bound."""
+        counts = self.values.get(labels)
+        if not counts:
+            return 0.0
+        counts = counts[:-1]
+        rank = q * sum(counts)
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+    def merge(self, values: Dict[Tuple[str, ...], List[float]]) -> None:
+        for labels, other_counts in values.items():
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            for i, count in enumerate(other_counts):
+                counts[i] += count
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, counts in sorted(dict(self.values).items()):
+            counts = list(counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{_format_number(float(bound))}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(counts[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class ComparisonCounters:
+    """The comparisons, identical comparisons and status code matches counters. They're tallied together, by whether
+    each comparison was identical and whether its status codes matched, so that a comparison is a single update."""
+    def __init__(self) -> None:
+        self.name = METRIC_PREFIX + "comparisons"
+        self.values: Dict[Tuple[bool, bool], int] = {}
+
+    def inc(self, identical: bool, status_match: bool, amount: int = 1) -> None:
+        key = (identical, status_match)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, values: Dict[Tuple[bool, bool], int]) -> None:
+        for (identical, status_match), count in values.items():
+            self.inc(identical, status_match, count)
+
+    @property
+    def total(self) -> int:
+        return sum(dict(self.values).values())
+
+    def expose(self) -> Iterator[str]:
+        values = dict(self.values)
+        for name, description, count in [
+                ("comparisons", "Comparisons generated or read.", sum(values.values())),
+                ("identical_comparisons", "Comparisons of identical responses.",
+                 sum(count for (identical, _), count in values.items() if identical)),
+                ("status_matches", "Comparisons of responses with the same status code.",
+                 sum(count for (_, status_match), count in values.items() if status_match))]:
+            yield f"# HELP {METRIC_PREFIX}{name}_total {description}"
+            yield f"# TYPE {METRIC_PREFIX}{name}_total counter"
+            yield f"{METRIC_PREFIX}{name}_total {count}"
+
+
+LINES_INGESTED = Counter("lines_ingested", "Lines read from the input: triples, or comparisons for the commands that "
+                         "read them.", ["input"])
+PARSE_FAILURES = Counter("parse_failures", "Lines (or frames) of the input that couldn't be parsed and were skipped.",
+                         ["input"])
+COMPARISONS = ComparisonCounters()
+STAGE_DURATION = Histogram("stage_duration_seconds", "The processing time of each triple or comparison, by stage.",
+                           STAGE_BUCKETS, ["stage"])
+RESPONSE_LATENCY = Histogram("response_latency_milliseconds", "The latencies of the responses of each cluster, by "
+                             "request method and uri template.", LATENCY_BUCKETS, ["cluster", "method", "uri_template"])
+METRICS = [LINES_INGESTED, PARSE_FAILURES, COMPARISONS, STAGE_DURATION, RESPONSE_LATENCY]
+
+
+def count_line(input: str) -> None:
+    if _enabled:
+        LINES_INGESTED.inc(input)
+
+
+def count_parse_failure(input: str) -> None:
+    if _enabled:
+        PARSE_FAILURES.inc(input)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if _enabled:
+        STAGE_DURATION.observe(seconds, stage)
+
+
+@lru_cache(maxsize=10_000)
+def _latency_labels(method: Optional[str], uri: Optional[str]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """The labels of the primary and shadow latencies of a request."""
+    method, uri_template = method or "", uriTemplate(uri) or ""
+    return ("primary", method, uri_template), ("shadow", method, uri_template)
+
+
+def observe_comparison(comparison: ResponseComparison) -> None:
+    if not _enabled:
+        return
+    primary, shadow = comparison.primary_response, comparison.shadow_response
+    COMPARISONS.inc(comparison.are_identical(), primary.statuscode == shadow.statuscode)
+    request = comparison.original_request
+    primary_labels, shadow_labels = _latency_labels(request.http_method, request.uri) if request else \
+        _latency_labels(None, None)
+    if primary.latency is not None:
+        RESPONSE_LATENCY.observe(primary.latency, *primary_labels)
+    if shadow.latency is not None:
+        RESPONSE_LATENCY.observe(shadow.latency, *shadow_labels)
+
+
+def take_snapshot() -> Optional[Dict[str, dict]]:
+    """The metrics recorded since the last snapshot, which are then reset. Worker processes hand these back with their
+    results, to be merged (with `merge_snapshot`) into the main process' metrics."""
+    if not _enabled:
+        return None
+    snapshot = {metric.name: metric.values for metric in METRICS if metric.values}
+    for metric in METRICS:
+        metric.values = {}
+    return snapshot
+
+
+def merge_snapshot(snapshot: Optional[Dict[str, dict]]) -> None:
+    if not snapshot:
+        return
+    for metric in METRICS:
+        if metric.name in snapshot:
+            metric.merge(snapshot[metric.name])
+
+
+def reset() -> None:
+    for metric in METRICS:
+        metric.values = {}
+
+
+class ThroughputSampler:
+    """Samples the comparisons counter every second, to expose the number of comparisons per second over the last
+    THROUGHPUT_WINDOW seconds without measuring anything in the hot loop."""
+    def __init__(self, window: int = THROUGHPUT_WINDOW, clock: Callable[[], float] = time.monotonic) -> None:
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=window + 1)
+        self._clock = clock
+
+    def sample(self) -> None:
+        self._samples.append((self._clock(), COMPARISONS.total))
+
+    def rate(self) -> float:
+        samples = list(self._samples)
+        if len(samples) < 2 or samples[-1][0] == samples[0][0]:
+            return 0.0
+        return (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+
+
+def expose(throughput: Optional[ThroughputSampler] = None) -> str:
+    """All of the metrics, in the Prometheus text format."""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    name = METRIC_PREFIX + "comparisons_per_second"
+    lines += [f"# HELP {name} Comparisons per second, over the last {THROUGHPUT_WINDOW} seconds.",
+              f"# TYPE {name} gauge",
+              f"{name} {_format_number(throughput.rate() if throughput else 0.0)}"]
+    name = METRIC_PREFIX + "comparison_tiers_total"
+    lines += [f"# HELP {name} The comparisons of status codes, headers and bodies, by the tier that compared them "
+              "(a fast equality check, or DeepDiff).",
+              f"# TYPE {name} counter"]
+    lines += [f'{name}{{tier="{tier}"}} {count}' for tier, count in sorted(dict(COMPARISON_TIER_COUNTS).items())]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics over HTTP (at any path, e.g. `/metrics`) from background threads, and samples the throughput.
+    Starting it enables the metrics."""
+    def __init__(self, host: str = DEFAULT_METRICS_HOST, port: int = 0) -> None:
+        throughput = self._throughput = ThroughputSampler()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = expose(throughput).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None:
+                logger.debug(f"Metrics request from {self.address_string()}: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._stopped = threading.Event()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def _sample_throughput(self) -> None:
+        while not self._stopped.wait(1):
+            self._throughput.sample()
+
+    def start(self) -> None:
+        set_enabled(True)
+        self._throughput.sample()
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        threading.Thread(target=self._sample_throughput, name="metrics-sampler", daemon=True).start()
+        logger.info(f"Serving metrics at http://{self.address[0]}:{self.address[1]}/metrics")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
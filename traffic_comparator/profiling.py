@@ -0,0 +1,77 @@
+import cProfile
+import logging
+import signal
+import sys
+from typing import IO, Optional
+
+from traffic_comparator import metrics
+
+logger = logging.getLogger(__name__)
+
+# The `--profile` mode records the processing time of each record in each stage of the pipeline, in the same stage
+# histograms as the metrics (see `metrics.STAGE_DURATION`), and prints a summary of them when the command exits or when
+# it receives SIGUSR1. The stages are:
+#   parse   -- parsing a line of triples (`_parseLine`)
+#   decode  -- base64-decoding, decompressing and parsing the response bodies
+#   compare -- the diffs of the status codes, headers and bodies
+#   encode  -- serializing a comparison (`to_json`, or a binary frame)
+#   output  -- writing the encoded comparison
+#   load    -- parsing a comparison, for the commands that read them
+#   sink:*  -- passing a comparison to each sink, in `run` and `serve`
+# With multiple workers, the stages that run in the workers are timed there and merged into the summary.
+SUMMARY_QUANTILES = (0.5, 0.99)
+
+
+def format_stage_summary() -> str:
+    """A table of the number of records, total time and share of the total, mean and quantiles of each stage."""
+    histogram = metrics.STAGE_DURATION
+    stages = sorted(dict(histogram.values).items(), key=lambda item: item[1][-1], reverse=True)
+    total_seconds = sum(counts[-1] for _, counts in stages)
+    labels = [f"p{q * 100:g} (us)" for q in SUMMARY_QUANTILES]
+    width = max([len("stage")] + [len(stage) for (stage,), _ in stages])
+    lines = [f"{'stage':<{width}} {'count':>9} {'total (s)':>10} {'share':>7} {'mean (us)':>10} " +
+             " ".join(f"{label:>11}" for label in labels)]
+    for (stage,), counts in stages:
+        count, seconds = sum(counts[:-1]), counts[-1]
+        share = seconds / total_seconds if total_seconds else 0.0
+        mean = seconds / count if count else 0.0
+        lines.append(f"{stage:<{width}} {count:>9} {seconds:>10.3f} {share:>7.1%} {mean * 1e6:>10.1f} " +
+                     " ".join(f"{histogram.quantile(q, stage) * 1e6:>11.1f}" for q in SUMMARY_QUANTILES))
+    if not stages:
+        lines.append("No records were processed.")
+    return "\n".join(lines) + "\n"
+
+
+class Profiler:
+    """Enables the stage timings and prints their summary to `output` when it's stopped and on SIGUSR1 (where signals
+    are available). If `profile_output` is given, the main process is also run under cProfile, and its stats are
+    written to that file (to be read with `pstats`, or a viewer like snakeviz) when it's stopped."""
+    def __init__(self, output: IO = sys.stderr, profile_output: Optional[str] = None) -> None:
+        self._output = output
+        self._profile_output = profile_output
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    def start(self) -> None:
+        metrics.set_enabled(True)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, self._on_signal)
+        if self._profile_output:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _on_signal(self, signum, frame) -> None:
+        self.print_summary()
+
+    def print_summary(self) -> None:
+        self._output.write(f"Stage timings:\n{format_stage_summary()}")
+        self._output.flush()
+
+    def stop(self) -> None:
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self._profile_output)
+            logger.info(f"Wrote the cProfile stats to {self._profile_output}")
+            self._cprofile = None
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+        self.print_summary()
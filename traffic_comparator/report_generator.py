@@ -2,12 +2,16 @@ import inspect
 import logging
 import sys
 from datetime import datetime, timedelta
-from typing import IO, Dict, Optional
+from typing import IO, Dict, List, Optional, Sequence, Tuple
 
 import traffic_comparator.reports
+from traffic_comparator.comparison_store import DEFAULT_MAX_MEMORY, ComparisonStore
 from traffic_comparator.response_comparison import (
     InvalidJsonForLoadingComparisonException,
     MissingFieldForLoadingComparisonJsonException, ResponseComparison)
+from traffic_comparator.sinks import BaseComparisonSink
+from traffic_comparator.streaming_stats import (DEFAULT_WINDOWS, ComparisonStats, WindowedStats,
+                                                format_windowed_summary)
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +22,32 @@ class UnsupportedReportTypeException(Exception):
                          f"Details: {str(original_exception)}")
 
 
-class StreamingReportGenerator:
+class StreamingReportGenerator(BaseComparisonSink):
     _available_reports = None
     
-    def __init__(self, output: IO, display_update_period: timedelta = timedelta(minutes=1)) -> None:
-        self._data = []
+    def __init__(self, output: IO, display_update_period: timedelta = timedelta(minutes=1),
+                 retain_comparisons: bool = True, max_memory: int = DEFAULT_MAX_MEMORY,
+                 export_reports: Sequence[Tuple[str, IO]] = (), windows: Sequence[int] = DEFAULT_WINDOWS) -> None:
+        # The `export_reports` are written while the comparisons arrive (and their files are flushed whenever the
+        # display is updated). The reports that don't support streaming retain the comparisons themselves, and are
+        # written once the generator is finalized.
+        self._export_reports: List[traffic_comparator.reports.BaseReport] = []
+        self._export_files: List[IO] = []
+        for report_name, export_file in export_reports:
+            report = self._report_class(report_name)(max_memory=max_memory)
+            report.start_export(export_file)
+            self._export_reports.append(report)
+            self._export_files.append(export_file)
+        # The comparisons themselves are only kept if they'll be needed to generate a final report (with
+        # `generate_final_report`), in a store that spills them to disk beyond `max_memory`. The periodic display is
+        # computed from the running stats.
+        self._data = ComparisonStore(max_memory)
+        self._retain_comparisons = retain_comparisons
+        self._warned_about_summaries = False
+        self._finalized = False
+        self._stats = ComparisonStats()
+        # The stats of the last few minutes (`windows`, in seconds) are shown next to the cumulative ones.
+        self._windowed_stats = WindowedStats(windows)
         self._output = output
         self._display_update_period = display_update_period
         self._display_last_updated: datetime = datetime.now()
@@ -31,29 +56,62 @@ class StreamingReportGenerator:
         return datetime.now() >= self._display_last_updated + self._display_update_period
 
     def _display_stats(self, override_update=False) -> None:
-        if len(self._data) > 0 and (self._is_time_to_update_display() or override_update):
+        if self._stats.total_comparisons > 0 and (self._is_time_to_update_display() or override_update):
             print("=" * 40, file=self._output)
             print(f"as of {datetime.now()}:", file=self._output)
-
-            # TODO: this is entirely un-optimized -- it recomputes the reports each time we need them.
-            # For small-ish amounts of data, that's fine, but we should improve this down the road.
-            correctness_report = traffic_comparator.reports.DiffReport(self._data)
-            print(correctness_report, file=self._output)
-            performance_report = traffic_comparator.reports.PerformanceReport(self._data)
-            print(performance_report, flush=True, file=self._output)
+            print(self._stats, file=self._output)
+            print(format_windowed_summary(self._stats, self._windowed_stats), flush=True, file=self._output)
+            for export_file in self._export_files:
+                export_file.flush()
             self._display_last_updated = datetime.now()
 
     def update(self, line: str) -> None:
         try:
-            self._data.append(ResponseComparison.from_json(line))
+            # The bodies are only needed by the exported reports, and the final reports load them from the line itself
+            # (see `_add`).
+            comparison = ResponseComparison.from_json(line, include_bodies=len(self._export_reports) > 0)
         except InvalidJsonForLoadingComparisonException as e:
             logger.error(f"Comparison could not be loaded due to invalid json. Skipping line. Details: {e}")
         except MissingFieldForLoadingComparisonJsonException as e:
             logger.error(f"Comparison could not be loaded due to a missing field. Skipping line. Details: {e}")
+        else:
+            self._add(comparison, record=line)
+        self._display_stats()
+
+    def add(self, comparison: ResponseComparison) -> None:
+        """Add a comparison that's already been loaded (e.g. by `wire_format.read_comparisons`)."""
+        self._add(comparison)
         self._display_stats()
 
+    @property
+    def include_bodies(self) -> bool:
+        """Whether the comparisons that are added need their bodies."""
+        return self._retain_comparisons or len(self._export_reports) > 0
+
+    def _add(self, comparison: ResponseComparison, record: Optional[str] = None) -> None:
+        self._stats.update(comparison)
+        self._windowed_stats.update(comparison)
+        if comparison.is_summary and self.include_bodies and not self._warned_about_summaries:
+            logger.warning("The comparisons are summaries, so the exported reports won't include their bodies.")
+            self._warned_about_summaries = True
+        for report in self._export_reports:
+            report.export_comparison(comparison)
+        if self._retain_comparisons:
+            if record is not None:
+                self._data.add_record(record)
+            else:
+                self._data.add(comparison)
+
     def finalize(self) -> None:
         self._display_stats(override_update=True)
+        if not self._finalized:
+            # This writes the summaries of the streaming reports, and the whole of the other reports.
+            for report in self._export_reports:
+                report.finish_export()
+            self._finalized = True
+
+    def close(self) -> None:
+        self.finalize()
 
     @classmethod
     def _find_available_reports(cls) -> None:
@@ -75,14 +133,20 @@ class StreamingReportGenerator:
         assert cls._available_reports is not None
         return {name: report.__doc__ for name, report in cls._available_reports.items()}
 
-    def generate_final_report(self, report_name: str, export_file: IO):
-        self._find_available_reports()
+    @classmethod
+    def _report_class(cls, report_name: str):
+        cls._find_available_reports()
         # This satisfies the type checker that we can move forward.
-        assert self._available_reports is not None
+        assert cls._available_reports is not None
         try:
-            report_class = self._available_reports[report_name]
+            return cls._available_reports[report_name]
         except KeyError as e:
             raise UnsupportedReportTypeException(report_name, e)
+
+    def generate_final_report(self, report_name: str, export_file: IO):
+        report_class = self._report_class(report_name)
+        if not self._retain_comparisons:
+            logger.warning(f"Comparisons were not retained, so the {report_name} will not include any of them.")
         
         report = report_class(self._data)
         report.compute()
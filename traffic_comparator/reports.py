@@ -1,27 +1,66 @@
 import csv
 import difflib
-import json
 from abc import ABC, abstractmethod
-from typing import IO, List
+from typing import IO, Dict, Iterable, List, Optional, Sequence
 import logging
 
-import numpy as np
-import re
-
-from traffic_comparator.response_comparison import ResponseComparison, HEADER_PATHS_TO_IGNORE, BODY_PATHS_TO_IGNORE
+from traffic_comparator import codec
+from traffic_comparator.comparison_store import DEFAULT_MAX_MEMORY, ComparisonStore
+from traffic_comparator.latency_analysis import (LatencyTable, PairedLatencyBreakdown, by_endpoint, by_status_class,
+                                                 format_breakdown, format_regressions, mean, overall, quantiles)
+from traffic_comparator.masks import active_masks
+from traffic_comparator.response_comparison import ResponseComparison
 
 logger = logging.getLogger(__name__)
 
-PARSED_BODY_PATHS_TO_IGNORE = []
+
+# These format the summaries shared by the reports and the streaming display, which computes the same statistics
+# incrementally (see streaming_stats.py).
+def format_match_summary(total_comparisons: int, number_identical: int, statuses_identical: int) -> str:
+    percent_matching = 1.0 * number_identical / total_comparisons if total_comparisons else 0
+    percent_statuses_matching = 1.0 * statuses_identical / total_comparisons if total_comparisons else 0
+    return f"""
+    {total_comparisons} response were compared.
+    {number_identical} were identical, for a match rate of {percent_matching:.2%}
+    The status codes matched in {percent_statuses_matching:.2%} of responses.
+    """
+
+
+def format_latency_summary(primary_percentiles: Sequence[float], primary_average: float,
+                           shadow_percentiles: Sequence[float], shadow_average: float) -> str:
+    """The percentiles are the 99th, 90th and 50th, in that order."""
+    return f"""
+            ==Stats for primary cluster==
+    99th percentile = {'%.1f' % primary_percentiles[0]}
+    90th percentile = {'%.1f' % primary_percentiles[1]}
+    50th percentile = {'%.1f' % primary_percentiles[2]}
+    Average Latency = {'%.1f' % primary_average}
+    
+            ==Stats for shadow cluster==
+    99th percentile = {'%.1f' % shadow_percentiles[0]}
+    90th percentile = {'%.1f' % shadow_percentiles[1]}
+    50th percentile = {'%.1f' % shadow_percentiles[2]}
+    Average Latency = {'%.1f' % shadow_average}
+    """
 
 
 class BaseReport(ABC):
     """This is the base class for all reports. Each report should provide a docstring that explains the purpose
     of the report, as well as information on a potential outputted file (format, etc.) and any additional config
     or parameters to be provided.
+    The comparisons may be a `ComparisonStore`, which loads them one at a time (from disk) whenever they're iterated
+    over, so reports should iterate over them rather than index them.
     """
-    def __init__(self, response_comparisons: List[ResponseComparison]):
+    # Reports are exported while the comparisons arrive: the StreamingReportGenerator calls `start_export`, then
+    # `export_comparison` for each comparison and `finish_export` once they've all arrived. By default, the comparisons
+    # are retained (in a ComparisonStore, which spills them to disk beyond `max_memory`) and the report is exported at
+    # the end. Reports that support streaming override these to write their files incrementally instead, without
+    # retaining the comparisons.
+    supports_streaming = False
+
+    def __init__(self, response_comparisons: Iterable[ResponseComparison] = (), max_memory: int = DEFAULT_MAX_MEMORY):
         self._response_comparisons = response_comparisons
+        self._max_memory = max_memory
         self._computed = False
 
     @abstractmethod
@@ -36,105 +75,165 @@ class BaseReport(ABC):
     def export(self, output_file: IO) -> None:
         pass
 
+    def start_export(self, output_file: IO) -> None:
+        self._output_file = output_file
+        self._retained_comparisons = ComparisonStore(self._max_memory)
+        self._response_comparisons = self._retained_comparisons
+
+    def export_comparison(self, comparison: ResponseComparison) -> None:
+        self._retained_comparisons.add(comparison)
+
+    def finish_export(self) -> None:
+        self.compute()
+        self.export(self._output_file)
+        self._output_file.flush()
+        self._retained_comparisons.close()
+
+
+# Mismatches that differ in the same way (with the same paths and values in their diffs, see
+# `ResponseComparison.diff_signature`) usually repeat many times, so the DiffReport only shows the diff of each
+# signature once, along with the number of responses that had it and a few of their requests.
+SAMPLE_REQUESTS_PER_DIFF = 5
+# The number of unchanged lines shown around each changed region of a diff.
+DIFF_CONTEXT_LINES = 3
+
+
+def describe_request(comp: ResponseComparison) -> str:
+    if comp.original_request is None:
+        return "(unknown request)"
+    return f"{comp.original_request.http_method} {comp.original_request.uri}"
+
+
+class DiffGroup:
+    """The mismatches with the same diff signature."""
+    def __init__(self) -> None:
+        self.count = 0
+        self.sample_requests: List[str] = []
+
+    def add(self, comp: ResponseComparison) -> None:
+        self.count += 1
+        if len(self.sample_requests) < SAMPLE_REQUESTS_PER_DIFF:
+            self.sample_requests.append(describe_request(comp))
+
+    def __str__(self) -> str:
+        return f"{self.count} responses, e.g. {', '.join(self.sample_requests)}"
+
 
 class DiffReport(BaseReport):
     """Provides basic information on how many and what ratio of responses are succesfully matched.
-    The exported file provides the same summary as the cli and then a list of diffs for every response
-    that does not match.
+    The exported file provides the same summary as the cli, and then the diff of every distinct way in which responses
+    didn't match (shown once, with the number of responses that didn't match in that way). When it's exported while
+    the comparisons arrive, the summary is at the end of the file.
     """
-
-    # As we're importing the desired fields we want to mask from a different file, they need some parsing before they
-    # can be removed from the visualization diff. Only because they're prefixed with the word: root
-    @staticmethod
-    def parse_masked_fields() -> None:
-        for body in BODY_PATHS_TO_IGNORE:
-            result = re.search(r"root\[\'(.*)\'\]", body)
-            if result:
-                body = result.group(1)
-            PARSED_BODY_PATHS_TO_IGNORE.append(body)
-
-    # As we're comparing the responses from two clusters, the user can specify which fields they want masked, and there
-    # are some fields that will always be unique either way, so there's no point in showing them in the diff
-    # Visualization.
-    # The following cleanup functions will remove the masked fields from the diff output.
-    @staticmethod
-    def cleanup_body(response) -> None:
-        for field in PARSED_BODY_PATHS_TO_IGNORE:
-            if field in response.body:
-                logger.debug(f"Found a masked body field: {field}, removing from the diff visualization now.")
-                response.body.pop(field, None)
-
-    @staticmethod
-    def cleanup_headers(response) -> None:
-        for field in HEADER_PATHS_TO_IGNORE:
-            if field in response.headers:
-                logger.debug(f"Found a masked header field: {field}, removing from the diff visualization now.")
-                response.headers.pop(field, None)
+    supports_streaming = True
+
+    def _reset_counts(self) -> None:
+        self._total_comparisons = 0
+        self._number_identical = 0
+        self._statuses_identical = 0
+        self._diff_groups: Dict[str, DiffGroup] = {}
+
+    def _count(self, comp: ResponseComparison) -> Optional[str]:
+        """Count the comparison, and return its diff signature if it's the first mismatch with it (so its diff needs to
+        be shown)."""
+        self._total_comparisons += 1
+        self._statuses_identical += comp.primary_response.statuscode == comp.shadow_response.statuscode
+        if comp.are_identical():
+            self._number_identical += 1
+            return None
+        signature = comp.diff_signature()
+        group = self._diff_groups.get(signature)
+        is_first = group is None
+        if group is None:
+            group = self._diff_groups[signature] = DiffGroup()
+        group.add(comp)
+        return signature if is_first else None
 
     def compute(self) -> None:
-        self.parse_masked_fields()
-        self._total_comparisons = len(self._response_comparisons)
-        self._number_identical = sum([comp.are_identical() for comp in self._response_comparisons])
-        self._statuses_identical = sum([comp.primary_response.statuscode == comp.shadow_response.statuscode
-                                        for comp in self._response_comparisons])
-        if self._total_comparisons != 0:
-            self._percent_matching = 1.0 * self._number_identical / self._total_comparisons
-            self._percent_statuses_matching = 1.0 * self._statuses_identical / self._total_comparisons
-        else:
-            self._percent_matching = 0
-            self._percent_statuses_matching = 0
-
+        self._reset_counts()
+        # The positions of the first mismatch with each signature.
+        self._first_mismatches: Dict[int, str] = {}
+        for position, comp in enumerate(self._response_comparisons):
+            signature = self._count(comp)
+            if signature is not None:
+                self._first_mismatches[position] = signature
         self._computed = True
 
     def __str__(self) -> str:
         if not self._computed:
             self.compute()
 
-        return f"""
-    {self._total_comparisons} response were compared.
-    {self._number_identical} were identical, for a match rate of {self._percent_matching:.2%}
-    The status codes matched in {self._percent_statuses_matching:.2%} of responses.
-    """
+        return format_match_summary(self._total_comparisons, self._number_identical, self._statuses_identical)
+
+    def _format_diff_groups(self) -> str:
+        if not self._diff_groups:
+            return ""
+        groups = sorted(self._diff_groups.items(), key=lambda item: item[1].count, reverse=True)
+        lines = [f"    {signature}: {group}\n" for signature, group in groups]
+        return f"{len(groups)} distinct diffs:\n" + "".join(lines)
 
     def export(self, output_file: IO) -> None:
         if not self._computed:
             self.compute()
 
-        # I'm using the DeepDiff library to generate diffs, but difflib (from the stdlib) to display them.
-        # This is fine for now, but it may be better to synchronize them down the line.
-
-        d = difflib.Differ()
-
         # Write the CLI output at the top of the file.
         output_file.write(str(self))
         output_file.write("\n")
+        output_file.write(self._format_diff_groups())
 
-        # Write each non-matching comparison
-        for comp in self._response_comparisons:
-            if comp.are_identical():
-                continue
-            output_file.write('=' * 40)
-            output_file.write("\n")
+        # Write the diff of each signature, from its first mismatch.
+        for position, comp in enumerate(self._response_comparisons):
+            if position in self._first_mismatches:
+                self._write_diff(output_file, comp, self._first_mismatches[position])
+
+    def start_export(self, output_file: IO) -> None:
+        self._reset_counts()
+        self._output_file = output_file
 
-            if type(comp.primary_response.body) is dict:
-                self.cleanup_body(comp.primary_response)
-            if type(comp.primary_response.headers) is dict:
-                self.cleanup_headers(comp.primary_response)
-            if type(comp.shadow_response.body) is dict:
-                self.cleanup_body(comp.shadow_response)
-            if type(comp.shadow_response.headers) is dict:
-                self.cleanup_headers(comp.shadow_response)
-
-            # Write each response to a json and split the lines (necessary input format for difflib)
-            primary_response_lines = [f"Status code: {comp.primary_response.statuscode}",
-                                      f"Headers: {comp.primary_response.headers}"] + \
-                json.dumps(comp.primary_response.body, sort_keys=True, indent=4).splitlines()
-            shadow_response_lines = [f"Status code: {comp.shadow_response.statuscode}",
-                                     f"Headers: {comp.shadow_response.headers}"] + \
-                json.dumps(comp.shadow_response.body, sort_keys=True, indent=4).splitlines()
-
-            result = list(d.compare(primary_response_lines, shadow_response_lines))
-            output_file.write("\n".join(result))
+    def export_comparison(self, comparison: ResponseComparison) -> None:
+        signature = self._count(comparison)
+        if signature is not None:
+            self._write_diff(self._output_file, comparison, signature)
+
+    def finish_export(self) -> None:
+        self._computed = True
+        # The summary is only known once every comparison has been written, so it's a trailer.
+        self._output_file.write('=' * 40)
+        self._output_file.write("\n")
+        self._output_file.write(str(self))
+        self._output_file.write("\n")
+        self._output_file.write(self._format_diff_groups())
+        self._output_file.flush()
+
+    @staticmethod
+    def _write_diff(output_file: IO, comp: ResponseComparison, signature: str) -> None:
+        # I'm using the DeepDiff library to generate diffs, but difflib (from the stdlib) to display them.
+        # This is fine for now, but it may be better to synchronize them down the line.
+        output_file.write('=' * 40)
+        output_file.write("\n")
+        output_file.write(f"Diff {signature}, first seen in {describe_request(comp)}:\n")
+
+        # The masked fields are always unique (or irrelevant), so there's no point in showing them. They're
+        # removed from copies of the responses, which may still be used by other reports.
+        masks = active_masks()
+        primary_headers = masks.headers.apply(comp.primary_response.headers)
+        shadow_headers = masks.headers.apply(comp.shadow_response.headers)
+        primary_body = masks.body.apply(comp.primary_response.body)
+        shadow_body = masks.body.apply(comp.shadow_response.body)
+
+        # Write each response to a json and split the lines (necessary input format for difflib)
+        primary_response_lines = [f"Status code: {comp.primary_response.statuscode}",
+                                  f"Headers: {primary_headers}"] + \
+            codec.dumps(primary_body, sort_keys=True, indent=2).splitlines()
+        shadow_response_lines = [f"Status code: {comp.shadow_response.statuscode}",
+                                 f"Headers: {shadow_headers}"] + \
+            codec.dumps(shadow_body, sort_keys=True, indent=2).splitlines()
+
+        # A unified diff only shows the changed regions (with a few lines of context), and unlike `Differ` it doesn't
+        # look for the closest matching pairs of changed lines, which is very slow for large bodies.
+        for line in difflib.unified_diff(primary_response_lines, shadow_response_lines, fromfile="primary",
+                                         tofile="shadow", n=DIFF_CONTEXT_LINES, lineterm=""):
+            output_file.write(line)
             output_file.write("\n")
 
 
@@ -143,63 +242,110 @@ class PerformanceReport(BaseReport):
     The exported file provides a CSV file which lists response body, latency and status code of both primary
     and shadow cluster for to each request.
     """
+    supports_streaming = True
+
+    CSV_HEADER = ['request_uri', 'request_method',
+                  'request_body', 'primary_response_latency_ms', 'primary_response_status_code',
+                  'primary_response_body', 'shadow_response_latency_ms', 'shadow_response_status_code',
+                  'shadow_response_body']
+
     def compute(self) -> None:
-        self._primary_latencies = []
-        self._shadow_latencies = []
+        self._table = LatencyTable()
         for resp in self._response_comparisons:
-            if resp.primary_response.latency and resp.primary_response.latency > 0:
-                self._primary_latencies.append(resp.primary_response.latency)
-            elif resp.primary_response.latency:
-                logger.info(f"a non positive latency was found: {resp.primary_response.latency}, and will be excluded"
-                            f" from the final performance stats. The non positive latency stat belongs to a response "
-                            f"that occurred on the primary cluster after a request with the following fields was made:"
-                            f" URI: {resp.original_request.uri}, Method: {resp.original_request.http_method},"
-                            f" Timestamp: {resp.original_request.timestamp}")
+            self._add_latencies(resp)
+        self._computed = True
 
-            if resp.shadow_response.latency and resp.shadow_response.latency > 0:
-                self._shadow_latencies.append(resp.shadow_response.latency)
-            elif resp.shadow_response.latency:
-                logger.info(f"a non positive latency was found: {resp.primary_response.latency}, and will be excluded"
-                            f" from the final performance stats. The non positive latency stat belongs to a response "
-                            f"that occurred on the shadow cluster after a request with the following fields was made:"
+    def _add_latencies(self, resp: ResponseComparison) -> None:
+        for cluster, response in [("primary", resp.primary_response), ("shadow", resp.shadow_response)]:
+            if response.latency and response.latency < 0:
+                logger.info(f"a non positive latency was found: {response.latency}, and will be excluded"
+                            f" from the final performance stats. The non positive latency stat belongs to a "
+                            f"response that occurred on the {cluster} cluster after a request with the following "
+                            f"fields was made:"
                             f" URI: {resp.original_request.uri}, Method: {resp.original_request.http_method},"
                             f" Timestamp: {resp.original_request.timestamp}")
-        self._computed = True
+        self._table.add_comparison(resp)
 
     def __str__(self) -> str:
         # pull in data computed in compute and print the averages
         if not self._computed:
             self.compute()
 
-        # I'm using NumPy to calculate performance metrics
-
-        return f"""
-            ==Stats for primary cluster==
-    99th percentile = {'%.1f' % np.percentile(self._primary_latencies, 99)}
-    90th percentile = {'%.1f' % np.percentile(self._primary_latencies, 90)}
-    50th percentile = {'%.1f' % np.percentile(self._primary_latencies, 50)}
-    Average Latency = {'%.1f' % np.average(self._primary_latencies)}
-    
-            ==Stats for shadow cluster==
-    99th percentile = {'%.1f' % np.percentile(self._shadow_latencies, 99)}
-    90th percentile = {'%.1f' % np.percentile(self._shadow_latencies, 90)}
-    50th percentile = {'%.1f' % np.percentile(self._shadow_latencies, 50)}
-    Average Latency = {'%.1f' % np.average(self._shadow_latencies)}
-    """
+        # The latencies are in numpy arrays, so each set of percentiles is a single vectorized call, and the
+        # breakdowns are computed for every group at once.
+        table = self._table
+        primary, shadow = table.primary_latency, table.shadow_latency
+        summary = format_latency_summary(quantiles(primary, [0.99, 0.9, 0.5]), mean(primary),
+                                         quantiles(shadow, [0.99, 0.9, 0.5]), mean(shadow))
+        if not len(table):
+            return summary
+        return summary + "\n" + format_breakdown("Overall", [overall(table)]) + "\n" + \
+            format_breakdown("Endpoint", by_endpoint(table)) + "\n" + \
+            format_breakdown("Status classes", by_status_class(table))
 
     def export(self, output_file: IO) -> None:
         writer = csv.writer(output_file)
-        writer.writerow(['request_uri', 'request_method',
-                         'request_body', 'primary_response_latency_ms', 'primary_response_status_code',
-                         'primary_response_body', 'shadow_response_latency_ms', 'shadow_response_status_code',
-                         'shadow_response_body'])
+        writer.writerow(self.CSV_HEADER)
         for resp in self._response_comparisons:
-            writer.writerow([resp.original_request.uri if resp.original_request else None,
-                            resp.original_request.http_method if resp.original_request else None,
-                            resp.original_request.body if resp.original_request else None,
-                            resp.primary_response.latency,
-                            resp.primary_response.statuscode,
-                            resp.primary_response.body,
-                            resp.shadow_response.latency,
-                            resp.shadow_response.statuscode,
-                            resp.shadow_response.body])
+            self._write_row(writer, resp)
+
+    def start_export(self, output_file: IO) -> None:
+        # The rows are written as the comparisons arrive. The latency stats aren't part of the CSV file, so they aren't
+        # computed (and no latencies are kept) while it's exported.
+        self._output_file = output_file
+        self._writer = csv.writer(output_file)
+        self._writer.writerow(self.CSV_HEADER)
+
+    def export_comparison(self, comparison: ResponseComparison) -> None:
+        self._write_row(self._writer, comparison)
+
+    def finish_export(self) -> None:
+        self._output_file.flush()
+
+    @staticmethod
+    def _write_row(writer, resp: ResponseComparison) -> None:
+        writer.writerow([resp.original_request.uri if resp.original_request else None,
+                        resp.original_request.http_method if resp.original_request else None,
+                        resp.original_request.body if resp.original_request else None,
+                        resp.primary_response.latency,
+                        resp.primary_response.statuscode,
+                        resp.primary_response.body,
+                        resp.shadow_response.latency,
+                        resp.shadow_response.statuscode,
+                        resp.shadow_response.body])
+
+
+class LatencyRegressionReport(BaseReport):
+    """Shows whether the shadow cluster is slower than the primary one, overall and for each endpoint: the differences
+    between the p50 and p99 latencies of the clusters (from the paired latencies of each request), with bootstrap
+    confidence intervals, and the endpoints where the shadow cluster is significantly slower.
+    The exported file provides the same table. Only sketches of the latencies are kept, so it can be exported while
+    the comparisons arrive, on streams of any length.
+    """
+    supports_streaming = True
+
+    def compute(self) -> None:
+        self._breakdown = PairedLatencyBreakdown()
+        for comparison in self._response_comparisons:
+            self._breakdown.add_comparison(comparison)
+        self._computed = True
+
+    def __str__(self) -> str:
+        if not self._computed:
+            self.compute()
+        return format_regressions(self._breakdown)
+
+    def export(self, output_file: IO) -> None:
+        output_file.write(str(self))
+
+    def start_export(self, output_file: IO) -> None:
+        self._breakdown = PairedLatencyBreakdown()
+        self._output_file = output_file
+
+    def export_comparison(self, comparison: ResponseComparison) -> None:
+        self._breakdown.add_comparison(comparison)
+
+    def finish_export(self) -> None:
+        self._computed = True
+        self._output_file.write(str(self))
+        self._output_file.flush()
@@ -1,10 +1,15 @@
-import json
+import hashlib
 import logging
-from typing import Optional
+from collections import Counter
+from typing import Any, Dict, List, Optional, Union
 
 from deepdiff import DeepDiff
+from deepdiff.serialization import json_convertor_default
 
+from traffic_comparator import codec
+from traffic_comparator.comparators import find_body_comparator
 from traffic_comparator.data import Request, Response
+from traffic_comparator.masks import active_masks
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +25,125 @@ class MissingFieldForLoadingComparisonJsonException(Exception):
         super().__init__("A comparison JSON line could not be loaded because of a missing {field} field. ")
 
 
-# These are volitaile or irrelevant paths that we want to ignore in our comparisons.
-# In a future task (MIGRATIONS-863), this will be made customizable by the user, but for
-# now, they're being hardcoded and will be updated as we test against new response types.
-BODY_PATHS_TO_IGNORE = ["root['cluster_name']", "root['cluster_uuid']", "root['name']", "root['took']",
-                        "root['tagline']", "root['version']", "root['_id']", "root['_shards']", "root['_seq_no']"]
-HEADER_PATHS_TO_IGNORE = ["content-length", "access-control-allow-origin", "connection", "date",
-                          "location"]
+# The volatile or irrelevant parts of the responses (e.g. `took`) are masked (see masks.py) before they're compared.
+# The masks can be customized with a mask file.
+
+# Most mirrored responses are identical once the masked fields are removed, so each part of a comparison first tries a
+# cheap equality check and only falls back to DeepDiff when that fails (or can't be used). These count how often each
+# tier was used in this process, so it's possible to see how often the expensive path runs.
+COMPARISON_TIER_COUNTS: Counter = Counter()
+
+
+def _canonicalize(value: Any) -> Optional[str]:
+    """Serialize a (masked) body or headers to a canonical string, such that two values have the same canonical string
+    exactly when DeepDiff would find no differences between them. Returns None if the value can't be serialized."""
+    try:
+        return codec.dumps(value, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+
+def _canonical_body(response: Response, masked_body: Any) -> Optional[str]:
+    if response._canonical_body is None:
+        response._canonical_body = _canonicalize(masked_body)
+    return response._canonical_body
+
+
+def _status_code_diff(primary_status, shadow_status) -> Union[DeepDiff, dict]:
+    if type(primary_status) is int and type(shadow_status) is int:
+        COMPARISON_TIER_COUNTS["status_code_fast"] += 1
+        if primary_status == shadow_status:
+            return {}
+        # This is the same result DeepDiff gives for two different ints.
+        return {"values_changed": {"root": {"new_value": shadow_status, "old_value": primary_status}}}
+    COMPARISON_TIER_COUNTS["status_code_deepdiff"] += 1
+    return DeepDiff(primary_status, shadow_status)
+
+
+def _headers_diff(primary_headers, shadow_headers) -> Union[DeepDiff, dict]:
+    mask = active_masks().headers
+    primary_headers, shadow_headers = mask.apply(primary_headers), mask.apply(shadow_headers)
+    primary_canonical = _canonicalize(primary_headers)
+    if primary_canonical is not None and primary_canonical == _canonicalize(shadow_headers):
+        COMPARISON_TIER_COUNTS["headers_fast"] += 1
+        return {}
+    COMPARISON_TIER_COUNTS["headers_deepdiff"] += 1
+    return DeepDiff(primary_headers, shadow_headers)
+
+
+def _merge_diffs(diff: dict, other: dict) -> dict:
+    """Merge two diffs (as dicts) by their change types, keeping the changes of both for each type. The changes are
+    dicts of {path: details}, except for a few of DeepDiff's change types (e.g. `set_item_added`), which are sets of
+    paths, and which are merged as lists of paths."""
+    merged = dict(diff)
+    for change_type, changes in other.items():
+        if change_type not in merged:
+            merged[change_type] = changes
+        elif isinstance(merged[change_type], dict) and isinstance(changes, dict):
+            merged[change_type] = {**merged[change_type], **changes}
+        else:
+            merged[change_type] = [*merged[change_type], *changes]
+    return merged
+
+
+def _body_diff(primary_response: Response, shadow_response: Response,
+               original_request: Optional[Request] = None) -> Union[DeepDiff, dict]:
+    mask = active_masks().body
+    primary_body, shadow_body = mask.apply(primary_response.body), mask.apply(shadow_response.body)
+    # Most bodies are identical, so they're checked for equality before anything else (including the comparators).
+    primary_canonical = _canonical_body(primary_response, primary_body)
+    if primary_canonical is not None and primary_canonical == _canonical_body(shadow_response, shadow_body):
+        COMPARISON_TIER_COUNTS["body_fast"] += 1
+        return {}
+
+    comparator = find_body_comparator(original_request, primary_body, shadow_body)
+    if comparator is not None:
+        # The comparator compares the keys it handles, and the rest of the bodies are compared as usual.
+        COMPARISON_TIER_COUNTS[f"body_{comparator.name}"] += 1
+        diff = comparator.compare(primary_body, shadow_body)
+        primary_rest = {k: v for k, v in primary_body.items() if k not in comparator.handled_keys}
+        shadow_rest = {k: v for k, v in shadow_body.items() if k not in comparator.handled_keys}
+        primary_canonical = _canonicalize(primary_rest)
+        if primary_canonical is None or primary_canonical != _canonicalize(shadow_rest):
+            # With verbose_level=2, added and removed keys are reported with their values, like the comparators' are.
+            diff = _merge_diffs(_diff_to_dict(DeepDiff(primary_rest, shadow_rest, verbose_level=2)), diff)
+        return diff
+
+    COMPARISON_TIER_COUNTS["body_deepdiff"] += 1
+    return DeepDiff(primary_body, shadow_body)
+
+
+# DeepDiff results contain a few values (types, ordered sets) that aren't json-serializable. This converts them the
+# same way DeepDiff's own `to_json` does.
+serialize_diff_value = json_convertor_default()
+
+
+def _diff_paths(diff: Union[DeepDiff, dict]) -> Dict[str, List[str]]:
+    """The paths in a diff, by the type of change (e.g. `{"values_changed": ["root['a']"]}`), without the values."""
+    return {change_type: sorted(str(path) for path in changes)
+            for change_type, changes in _diff_to_dict(diff).items()}
+
+
+def _without_examples(diff: dict) -> dict:
+    """The diff, without the `examples` of the changes that have them (see `comparators`)."""
+    return {change_type: {path: {k: v for k, v in details.items() if k != "examples"}
+                          if isinstance(details, dict) else details for path, details in changes.items()}
+            if isinstance(changes, dict) else changes
+            for change_type, changes in diff.items()}
+
+
+# The fields of the request and responses that are kept in a summary comparison (see `ResponseComparison.to_dict`).
+SUMMARY_REQUEST_FIELDS = ["timestamp", "http_method", "uri"]
+SUMMARY_RESPONSE_FIELDS = ["timestamp", "statuscode", "latency"]
+
+
+def _diff_to_dict(diff: Union[DeepDiff, dict]) -> dict:
+    if isinstance(diff, DeepDiff):
+        # DeepDiff offers a `to_json` that returns a json string, but we want to embed the actual dictionary object,
+        # not the string (otherwise it gets double escaped). Its `to_dict` is embedded instead, and any values that
+        # aren't json-serializable are converted when the whole comparison is serialized.
+        return diff.to_dict()
+    return diff
 
 
 class ResponseComparison:
@@ -35,15 +152,14 @@ class ResponseComparison:
         self.primary_response = primary_response
         self.shadow_response = shadow_response
         self.original_request = original_request
+        self.is_summary = False
         # The reason behind adding a request to be part of the response comparisons
         # is to clarify what request led to these responses.
 
         # Depending on the performance of DeepDiff on large bodies, this could be pulled out to an async function.
-        self._status_code_diff = DeepDiff(primary_response.statuscode, shadow_response.statuscode)
-        self._headers_diff = DeepDiff(primary_response.headers, shadow_response.headers,
-                                      exclude_paths=HEADER_PATHS_TO_IGNORE)
-        self._body_diff = DeepDiff(primary_response.body, shadow_response.body,
-                                   exclude_paths=BODY_PATHS_TO_IGNORE)
+        self._status_code_diff = _status_code_diff(primary_response.statuscode, shadow_response.statuscode)
+        self._headers_diff = _headers_diff(primary_response.headers, shadow_response.headers)
+        self._body_diff = _body_diff(primary_response, shadow_response, original_request)
         logger.debug(self._body_diff)
 
     @property
@@ -62,47 +178,74 @@ class ResponseComparison:
         logger.debug(f"Identical?: {self.status_code_diff == {} and self.headers_diff == {} and self.body_diff == {}}")
         return self.status_code_diff == {} and self.headers_diff == {} and self.body_diff == {}
 
-    def to_json(self) -> str:
-        base = {}
-        base["primary_response"] = self.primary_response.__dict__
-        if "raw_body" in base["primary_response"]:
-            assert base["primary_response"]["raw_body"] is None
-            del base["primary_response"]["raw_body"]
-        base["shadow_response"] = self.shadow_response.__dict__
-        if "raw_body" in base["shadow_response"]:
-            assert base["shadow_response"]["raw_body"] is None
-            del base["shadow_response"]["raw_body"]
-        base["original_request"] = self.original_request.__dict__ if self.original_request else {}
-        if "raw_body" in base["original_request"]:
-            assert base["original_request"]["raw_body"] is None
-            del base["original_request"]["raw_body"]
-        # DeepDiff offers a `to_json` that returns a json string, but we want to embed the actual dictionary object,
-        # not the string (otherwise it gets double escaped). DeepDiff objects do a have a `to_dict`, but it contains
-        # elements that aren't json-escapable.
-        base['_status_code_diff'] = json.loads(self.status_code_diff.to_json())
-        base['_headers_diff'] = json.loads(self.headers_diff.to_json())
-        base['_body_diff'] = json.loads(self.body_diff.to_json())
-        return json.dumps(base)
+    def diff_signature(self) -> str:
+        """A short hash of the paths and values in the diffs, which is the same for the comparisons that differ in the
+        same way (e.g. so that reports can group them). The examples in the body comparators' diffs (e.g. the items of
+        a bulk response with a failure) are particular to each response, so they're left out."""
+        diffs = [_diff_to_dict(self.status_code_diff), _diff_to_dict(self.headers_diff),
+                 _without_examples(_diff_to_dict(self.body_diff))]
+        serialized = codec.dumps(diffs, sort_keys=True, default=serialize_diff_value)
+        return hashlib.blake2b(serialized.encode('utf-8'), digest_size=8).hexdigest()
+
+    def to_dict(self, summary_only: bool = False) -> dict:
+        """The comparison as a dict that can be serialized (with `serialize_diff_value` as the default for the values
+        in the diffs). A summary only has the status codes, latencies and timestamps of the responses, the method and
+        uri of the request, and the paths of the diffs (grouped by the type of change, without the values), which is
+        all that consumers that only aggregate need. Whether the responses are identical is the same either way."""
+        base: Dict[str, Any] = {}
+        if summary_only:
+            base["summary"] = True
+            base["primary_response"] = {f: getattr(self.primary_response, f) for f in SUMMARY_RESPONSE_FIELDS}
+            base["shadow_response"] = {f: getattr(self.shadow_response, f) for f in SUMMARY_RESPONSE_FIELDS}
+            base["original_request"] = {f: getattr(self.original_request, f) for f in SUMMARY_REQUEST_FIELDS} \
+                if self.original_request else {}
+            base['_status_code_diff'] = _diff_paths(self.status_code_diff)
+            base['_headers_diff'] = _diff_paths(self.headers_diff)
+            base['_body_diff'] = _diff_paths(self.body_diff)
+            return base
+        base["primary_response"] = self.primary_response.to_dict()
+        base["shadow_response"] = self.shadow_response.to_dict()
+        base["original_request"] = self.original_request.to_dict() if self.original_request else {}
+        base['_status_code_diff'] = _diff_to_dict(self.status_code_diff)
+        base['_headers_diff'] = _diff_to_dict(self.headers_diff)
+        base['_body_diff'] = _diff_to_dict(self.body_diff)
+        return base
+
+    def to_json(self, summary_only: bool = False) -> str:
+        return codec.dumps(self.to_dict(summary_only), default=serialize_diff_value)
 
     @classmethod
-    def from_json(cls, line):
+    def from_json(cls, line, include_bodies: bool = True):
+        """Load a comparison from the output of `to_json`. If `include_bodies` is False, the request and response
+        bodies aren't materialized (they're left as None), which is enough for consumers that only need the status
+        codes, latencies and diffs."""
         try:
-            source_dict = json.loads(line)
-        except json.JSONDecodeError as e:
+            source_dict = codec.loads(line)
+        except codec.JSONDecodeError as e:
             raise InvalidJsonForLoadingComparisonException(e)
+        return cls.from_dict(source_dict, include_bodies)
+
+    @classmethod
+    def from_dict(cls, source_dict: dict, include_bodies: bool = True):
+        """Load a comparison from the output of `to_dict` (see `from_json`). A summary comparison never has bodies, and
+        its diffs only have the paths that differ."""
+        def fields_to_load(item_dict: dict) -> dict:
+            if include_bodies:
+                return item_dict
+            return {k: v for k, v in item_dict.items() if k != "body"}
         
         if "original_request" in source_dict and source_dict["original_request"] != {}:
-            original_request = Request(**source_dict["original_request"])
+            original_request = Request(**fields_to_load(source_dict["original_request"]))
         else:
             original_request = None
 
         try:
-            primary_response = Response(**source_dict["primary_response"])
+            primary_response = Response(**fields_to_load(source_dict["primary_response"]))
         except KeyError:
             raise MissingFieldForLoadingComparisonJsonException("primary_response")
 
         try:
-            shadow_response = Response(**source_dict["shadow_response"])
+            shadow_response = Response(**fields_to_load(source_dict["shadow_response"]))
         except KeyError:
             raise MissingFieldForLoadingComparisonJsonException("shadow_response")
 
@@ -113,5 +256,6 @@ class ResponseComparison:
         comparison._body_diff = source_dict['_body_diff']
         comparison._headers_diff = source_dict['_headers_diff']
         comparison._status_code_diff = source_dict['_status_code_diff']
+        comparison.is_summary = source_dict.get("summary", False)
 
         return comparison
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import signal
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Union
+
+from traffic_comparator.analyzer import StreamingAnalyzer
+from traffic_comparator.data_loader import StreamingDataLoader
+from traffic_comparator.sinks import BaseComparisonSink
+
+logger = logging.getLogger(__name__)
+
+# The port that the Replayer sends triples to.
+DEFAULT_PORT = 9220
+# The maximum number of received triples waiting to be compared. When the queue is full, connections stop being read
+# until there's room, so the TCP (or unix socket) flow control pushes back on the clients that are sending too fast.
+DEFAULT_QUEUE_SIZE = 1000
+# The maximum length of a single triple (line). Longer lines are logged and skipped.
+DEFAULT_LINE_LIMIT = 64 * 1024 * 1024
+
+
+class IngestionServer:
+    """Accepts any number of concurrent connections (on TCP or a unix socket) that each send triples, one per line,
+    and compares them all in a single StreamingAnalyzer, which passes the comparisons to the sinks. The server keeps
+    running as clients come and go, until it's stopped (by `stop`, or SIGINT/SIGTERM), and then the triples that were
+    already received are compared and the sinks are closed.
+    """
+    def __init__(self, sinks: List[BaseComparisonSink], host: Optional[str] = "127.0.0.1", port: int = DEFAULT_PORT,
+                 unix_socket: Optional[Union[str, Path]] = None, workers: int = 1, ordered: bool = True,
+                 max_in_flight: Optional[int] = None, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 line_limit: int = DEFAULT_LINE_LIMIT) -> None:
+        self._sinks = sinks
+        self._host = host
+        self._port = port
+        self._unix_socket = unix_socket
+        self._queue_size = queue_size
+        self._line_limit = line_limit
+        data_loader = StreamingDataLoader(self._lines())  # type: ignore
+        self._analyzer = StreamingAnalyzer(data_loader, workers=workers, ordered=ordered, max_in_flight=max_in_flight)
+        self._connection_tasks: Set[asyncio.Task] = set()
+        # These are set once the server is running (in `serve`).
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self.address = None
+        self.connections_accepted = 0
+        self.lines_received = 0
+
+    def _lines(self) -> Iterator[bytes]:
+        """The received lines, for the analyzer. This runs in the analyzer's thread and waits for each line from the
+        event loop, until the end of the stream (None) is reached."""
+        assert self._loop is not None and self._queue is not None
+        while True:
+            line = asyncio.run_coroutine_threadsafe(self._queue.get(), self._loop).result()
+            if line is None:
+                return
+            yield line
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        assert self._queue is not None
+        self._connection_tasks.add(asyncio.current_task())  # type: ignore
+        peer = writer.get_extra_info('peername') or self._unix_socket
+        self.connections_accepted += 1
+        logger.info(f"Accepted a connection from {peer}.")
+        lines = 0
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as e:
+                    # The start of the line is dropped. If the rest of it hadn't been received yet, it's read as the
+                    # next line, which can't be parsed and is skipped by the data loader.
+                    logger.error(f"A line from {peer} is longer than the limit ({self._line_limit} bytes) and was "
+                                 f"skipped. Details: {e}")
+                    continue
+                if not line:
+                    break
+                if line.strip():
+                    # This waits while the queue is full, which stops reading from this connection.
+                    await self._queue.put(line)
+                    lines += 1
+                    self.lines_received += 1
+        except ConnectionError as e:
+            logger.warning(f"The connection from {peer} was lost. Details: {e}")
+        finally:
+            writer.close()
+            self._connection_tasks.discard(asyncio.current_task())  # type: ignore
+            logger.info(f"The connection from {peer} was closed after {lines} lines.")
+
+    def stop(self) -> None:
+        """Stop the server. This can be called from any thread."""
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self, ready: Optional[asyncio.Event] = None, handle_signals: bool = True) -> None:
+        """Run the server until it's stopped. `ready` is set once it's accepting connections."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._stopping = asyncio.Event()
+        if handle_signals:
+            for signal_number in [signal.SIGINT, signal.SIGTERM]:
+                self._loop.add_signal_handler(signal_number, self._stopping.set)
+
+        if self._unix_socket is not None:
+            server = await asyncio.start_unix_server(self._handle_connection, path=self._unix_socket,
+                                                     limit=self._line_limit)
+            self.address = self._unix_socket
+        else:
+            server = await asyncio.start_server(self._handle_connection, host=self._host, port=self._port,
+                                                limit=self._line_limit)
+            self.address = server.sockets[0].getsockname()
+        logger.warning(f"Listening for triples on {self.address}.")
+
+        analysis = asyncio.create_task(asyncio.to_thread(self._analyzer.run, self._sinks))
+        if ready is not None:
+            ready.set()
+        # The analysis only finishes early if it fails.
+        await asyncio.wait([analysis, asyncio.create_task(self._stopping.wait())],
+                           return_when=asyncio.FIRST_COMPLETED)
+
+        logger.warning("Stopping the server.")
+        server.close()
+        # Any lines that are still being received on open connections are dropped.
+        for task in list(self._connection_tasks):
+            task.cancel()
+        await asyncio.gather(*self._connection_tasks, return_exceptions=True)
+        await server.wait_closed()
+        if not analysis.done():
+            # The end of the stream: the analyzer compares the lines that are still queued and closes the sinks.
+            await self._queue.put(None)
+        await analysis
+        logger.warning(f"Stopped after {self.connections_accepted} connections and {self.lines_received} lines.")
+
+
+async def replay(triples_file: Union[str, Path], host: str = "127.0.0.1", port: int = DEFAULT_PORT,
+                 unix_socket: Optional[Union[str, Path]] = None, connections: int = 1) -> int:
+    """Send the triples in a file to a server, spread (round-robin) over a number of concurrent connections. This
+    waits for the server to read everything that's been sent (i.e. it respects the server's backpressure). Returns the
+    number of lines sent."""
+    async def open_connection():
+        if unix_socket is not None:
+            return await asyncio.open_unix_connection(unix_socket)
+        return await asyncio.open_connection(host, port)
+
+    writers = [(await open_connection())[1] for _ in range(connections)]
+    lines_sent = 0
+    with open(triples_file, 'rb') as triples:
+        for line in triples:
+            writer = writers[lines_sent % connections]
+            writer.write(line if line.endswith(b"\n") else line + b"\n")
+            await writer.drain()
+            lines_sent += 1
+    for writer in writers:
+        writer.close()
+        await writer.wait_closed()
+    logger.info(f"Sent {lines_sent} lines over {connections} connections.")
+    return lines_sent
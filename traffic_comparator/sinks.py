@@ -0,0 +1,50 @@
+from abc import ABC, abstractmethod
+from typing import IO, Optional, Union
+
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.wire_format import RecordEncoder
+
+
+class BaseComparisonSink(ABC):
+    """A consumer of comparisons. The `run` command passes each comparison to every sink in memory, instead of
+    serializing it to a pipe and parsing it again in another process. The `stream-report` and `dump-to-sqlite` commands
+    feed the same sinks from the comparisons that they read.
+    """
+    @abstractmethod
+    def add(self, comparison: ResponseComparison) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        """Called once all of the comparisons have been added."""
+        pass
+
+
+class ComparisonOutputSink(BaseComparisonSink):
+    """Writes the comparisons to the output, encoded by the record encoder (json lines by default). For a binary wire
+    format, the output must be a binary stream."""
+    def __init__(self, output: IO, record_encoder: Optional[RecordEncoder] = None) -> None:
+        self._output = output
+        self.record_encoder = record_encoder or RecordEncoder()
+        self._started = False
+
+    def add(self, comparison: ResponseComparison) -> None:
+        self.write_record(self.record_encoder.encode(comparison))
+
+    def write_record(self, record: Union[str, bytes]) -> None:
+        """Write a comparison that's already been encoded (e.g. in a worker process) by the record encoder."""
+        if self.record_encoder.is_binary:
+            if not self._started:
+                self._output.write(self.record_encoder.header())
+                self._started = True
+            self._output.write(record)
+            self._output.flush()
+        else:
+            print(record, flush=True, file=self._output)
+
+    def close(self) -> None:
+        if self.record_encoder.is_binary and not self._started:
+            # Even without any comparisons, the output is a valid (empty) binary stream.
+            self._output.write(self.record_encoder.header())
+            self._started = True
+        self._output.flush()
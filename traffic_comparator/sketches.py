@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# The default relative accuracy of a LatencyHistogram: every quantile it returns is within 1% of the true value.
+DEFAULT_RELATIVE_ACCURACY = 0.01
+# The default number of bootstrap replicates of a BootstrapHistogram.
+DEFAULT_REPLICATES = 100
+
+
+class LatencyHistogram:
+    """A mergeable, fixed-accuracy histogram used to summarize latencies (or any other numeric values) without
+    retaining the individual samples.
+
+    Values are counted in logarithmically sized buckets (the same idea as HDR histograms and DDSketch): bucket `i`
+    covers `(gamma^(i-1), gamma^i]`, where `gamma` is derived from the relative accuracy. This means that adding a
+    value and merging two histograms are cheap, memory depends only on the range of the values (a few hundred
+    buckets covers microseconds to hours) and any quantile can be answered with a relative error of at most
+    `relative_accuracy`, regardless of how many values were added.
+
+    Negative values are tracked in a mirrored set of buckets and zero in its own count, so the histogram can also
+    summarize signed values such as latency differences.
+    """
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be between 0 and 1, not {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._positive: Dict[int, int] = {}
+        self._negative: Dict[int, int] = {}
+        self._zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket_index(self, value: float) -> int:
+        """The index of the bucket that a positive value falls into."""
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def bucket_bounds(self, index: int) -> Tuple[float, float]:
+        """The (exclusive lower, inclusive upper) bounds of the positive bucket with the given index."""
+        return self._gamma ** (index - 1), self._gamma ** index
+
+    def _bucket_value(self, index: int) -> float:
+        # The value within the bucket that minimizes the relative error to anything else in the bucket.
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value: float, count: int = 1) -> None:
+        if value > 0:
+            index = self.bucket_index(value)
+            self._positive[index] = self._positive.get(index, 0) + count
+        elif value < 0:
+            index = self.bucket_index(-value)
+            self._negative[index] = self._negative.get(index, 0) + count
+        else:
+            self._zero_count += count
+        self.count += count
+        self.sum += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def update(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: LatencyHistogram) -> None:
+        if other._gamma != self._gamma:
+            raise ValueError("Only histograms with the same relative accuracy can be merged.")
+        for index, count in other._positive.items():
+            self._positive[index] = self._positive.get(index, 0) + count
+        for index, count in other._negative.items():
+            self._negative[index] = self._negative.get(index, 0) + count
+        self._zero_count += other._zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def copy(self) -> LatencyHistogram:
+        histogram = LatencyHistogram(self.relative_accuracy)
+        histogram.merge(self)
+        return histogram
+
+    def _ascending_buckets(self) -> Iterator[Tuple[float, int]]:
+        for index in sorted(self._negative, reverse=True):
+            yield -self._bucket_value(index), self._negative[index]
+        if self._zero_count:
+            yield 0.0, self._zero_count
+        for index in sorted(self._positive):
+            yield self._bucket_value(index), self._positive[index]
+
+    def buckets(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over the (index, count) of each non-empty positive bucket, in ascending order."""
+        for index in sorted(self._positive):
+            yield index, self._positive[index]
+
+    def value_at_rank(self, rank: float) -> float:
+        """The approximate value of the item at the given (0-based) rank among all values added."""
+        if self.count == 0:
+            return math.nan
+        # The min and max are tracked exactly, so the extremes don't need to be approximated.
+        if rank <= 0:
+            return self.min
+        if rank >= self.count - 1:
+            return self.max
+        cumulative = 0
+        for value, count in self._ascending_buckets():
+            cumulative += count
+            if cumulative > rank:
+                # Bucket values are approximations, but the min and max are exact.
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantile(self, q: float) -> float:
+        return self.value_at_rank(q * (self.count - 1))
+
+    def quantiles(self, qs: List[float]) -> List[float]:
+        """Compute several quantiles in a single pass over the buckets."""
+        if self.count == 0:
+            return [math.nan] * len(qs)
+        order = sorted(range(len(qs)), key=lambda i: qs[i])
+        results = [math.nan] * len(qs)
+        buckets = self._ascending_buckets()
+        cumulative = 0
+        value = self.min
+        for i in order:
+            rank = qs[i] * (self.count - 1)
+            if rank <= 0 or rank >= self.count - 1:
+                results[i] = self.min if rank <= 0 else self.max
+                continue
+            while cumulative <= rank:
+                try:
+                    value, count = next(buckets)
+                except StopIteration:
+                    value = self.max
+                    break
+                cumulative += count
+            results[i] = min(max(value, self.min), self.max)
+        return results
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else math.nan
+
+
+class PoissonWeights:
+    """Draws the weights of a Poisson bootstrap: for each value, how many times each replicate resamples it. Drawing
+    them one row at a time from numpy would be slow, so they're drawn in blocks. The seed is fixed by default, so that
+    reports are reproducible."""
+    def __init__(self, replicates: int = DEFAULT_REPLICATES, seed: Optional[int] = 0, block_size: int = 1024) -> None:
+        self.replicates = replicates
+        self._rng = np.random.default_rng(seed)
+        self._block_size = block_size
+        self._block = np.empty((0, replicates), dtype=np.int64)
+        self._next = 0
+
+    def next(self) -> np.ndarray:
+        if self._next == len(self._block):
+            self._block = self._rng.poisson(1.0, (self._block_size, self.replicates))
+            self._next = 0
+        self._next += 1
+        return self._block[self._next - 1]
+
+
+class BootstrapHistogram:
+    """A LatencyHistogram of (positive) values, along with `replicates` histograms of Poisson bootstrap resamples of
+    them, to compute confidence intervals of the quantiles without retaining the values.
+
+    Resampling n values with replacement is approximated by adding each value to each replicate a Poisson(1) number
+    of times, which doesn't depend on n, so it works on streams, and merging two BootstrapHistograms gives valid
+    replicates of the combined values. The replicates share the buckets of the histogram: each bucket has an array of
+    counts, with one count per replicate, so adding a value is a single vectorized addition.
+
+    The weights (see `PoissonWeights`) are passed to `add` rather than drawn by it, so that paired values (e.g. the
+    primary and shadow latencies of a request) are resampled together.
+    """
+    def __init__(self, replicates: int = DEFAULT_REPLICATES,
+                 relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        self.replicates = replicates
+        self.histogram = LatencyHistogram(relative_accuracy)
+        self._replicate_counts: Dict[int, np.ndarray] = {}
+
+    @property
+    def count(self) -> int:
+        return self.histogram.count
+
+    def add(self, value: float, weights: np.ndarray) -> None:
+        if value <= 0:
+            raise ValueError(f"Only positive values can be added to a BootstrapHistogram, not {value}")
+        self.histogram.add(value)
+        index = self.histogram.bucket_index(value)
+        counts = self._replicate_counts.get(index)
+        if counts is None:
+            self._replicate_counts[index] = weights.copy()
+        else:
+            counts += weights
+
+    def merge(self, other: BootstrapHistogram) -> None:
+        if other.replicates != self.replicates:
+            raise ValueError("Only bootstrap histograms with the same number of replicates can be merged.")
+        self.histogram.merge(other.histogram)
+        for index, counts in other._replicate_counts.items():
+            if index in self._replicate_counts:
+                self._replicate_counts[index] = self._replicate_counts[index] + counts
+            else:
+                self._replicate_counts[index] = counts.copy()
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        return self.histogram.quantiles(list(qs))
+
+    def replicate_quantiles(self, qs: Sequence[float]) -> np.ndarray:
+        """The quantiles of each replicate, as an array with a row per quantile and a column per replicate (NaN for a
+        replicate that resampled no values)."""
+        if not self._replicate_counts:
+            return np.full((len(qs), self.replicates), np.nan)
+        indices = sorted(self._replicate_counts)
+        values = np.array([self.histogram._bucket_value(index) for index in indices])
+        values = np.clip(values, self.histogram.min, self.histogram.max)
+        cumulative = np.cumsum([self._replicate_counts[index] for index in indices], axis=0)
+        totals = cumulative[-1]
+        result = np.empty((len(qs), self.replicates))
+        for i, q in enumerate(qs):
+            # As in `LatencyHistogram.value_at_rank`, the value is that of the first bucket past the rank.
+            ranks = q * (totals - 1)
+            result[i] = values[np.argmax(cumulative > ranks, axis=0)]
+        result[:, totals == 0] = np.nan
+        return result
@@ -1,9 +1,27 @@
-import json
+from __future__ import annotations
+
+import hashlib
 import logging
 import pathlib
+import re
 import sqlite3
-from typing import Optional, Union
-
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # zstd compression of the bodies is optional (`pip install .[zstd]`).
+    zstandard = None
+
+from traffic_comparator import codec
+from traffic_comparator.data import uriTemplate
+from traffic_comparator.sinks import BaseComparisonSink
+from traffic_comparator.sketches import LatencyHistogram
 from traffic_comparator.response_comparison import (
     InvalidJsonForLoadingComparisonException,
     MissingFieldForLoadingComparisonJsonException, ResponseComparison)
@@ -11,7 +29,7 @@ from traffic_comparator.response_comparison import (
 logger = logging.getLogger(__name__)
 
 
-COLUMNS = ['request_uri', 'request_method', 'request_timestamp', 'request_headers', 'request_body',
+COLUMNS = ['request_uri', 'request_uri_template', 'request_method', 'request_timestamp', 'request_headers', 'request_body',  # noqa: E501
            'source_response_timestamp', 'source_response_status', 'source_response_headers', 'source_response_body', 'source_response_latency',  # noqa: E501
            'target_response_timestamp', 'target_response_status', 'target_response_headers', 'target_response_body', 'target_response_latency',  # noqa: E501
            'responses_are_identical', 'headers_diff', 'bodies_diff']
@@ -19,6 +37,7 @@ COLUMNS = ['request_uri', 'request_method', 'request_timestamp', 'request_header
 # This is a dict of the above columns, listing those that should be loaded with a specific pandas datatype.
 COLUMN_DATATYPES = {
     "request_uri": "string",
+    "request_uri_template": "string",
     "request_method": "string",
     "request_timestamp": "datetime64[ns]",
     "request_headers": "string",
@@ -39,6 +58,37 @@ COLUMN_DATATYPES = {
     "bodies_diff": "string"
 }
 
+# This is the sqlite type of each of the above columns. Storing numbers as INTEGERs (instead of text) means that
+# aggregations and filters on them can be run in sqlite.
+COLUMN_SQL_TYPES = {
+    "request_uri": "TEXT",
+    "request_uri_template": "TEXT",
+    "request_method": "TEXT",
+    "request_timestamp": "INTEGER",
+    "request_headers": "TEXT",
+    "request_body": "TEXT",
+    "source_response_timestamp": "INTEGER",
+    "source_response_status": "INTEGER",
+    "source_response_headers": "TEXT",
+    "source_response_body": "TEXT",
+    "source_response_latency": "INTEGER",
+    "target_response_timestamp": "INTEGER",
+    "target_response_status": "INTEGER",
+    "target_response_headers": "TEXT",
+    "target_response_body": "TEXT",
+    "target_response_latency": "INTEGER",
+    "responses_are_identical": "INTEGER",
+    "headers_diff": "TEXT",
+    "bodies_diff": "TEXT"
+}
+
+# The columns that are indexed in each comparisons table. These are the ones that the notebook groups and filters by.
+INDEXED_COLUMNS = [
+    ("request_uri_template", "request_method"),
+    ("source_response_status", "target_response_status"),
+    ("responses_are_identical",)
+]
+
 # This is also a subset of both COLUMNS and COLUMN_DATATYPES for those that should be parsed as JSONs.
 COLUMN_JSONS = [
     "request_headers",
@@ -55,8 +105,8 @@ COLUMN_JSONS = [
 def json_load_function(x: str) -> Union[str, dict]:
     """This is a utility functions used in the notebook to parse the json data."""
     try:
-        return json.loads(x)
-    except json.JSONDecodeError:
+        return codec.loads(x)
+    except codec.JSONDecodeError:
         return x
 
 
@@ -72,7 +122,7 @@ def get_took_value(body: dict) -> Optional[int]:
 
 def format_headers(headers: Union[dict, str, None]) -> str:
     if type(headers) is dict:
-        return json.dumps(headers)
+        return codec.dumps(headers)
     elif type(headers) is str:
         return headers
     return ''
@@ -80,22 +130,60 @@ def format_headers(headers: Union[dict, str, None]) -> str:
 
 def format_body(body: Union[dict, str, list, None]) -> str:
     if type(body) in [dict, list]:
-        return json.dumps(body)
+        return codec.dumps(body)
     elif type(body) is str:
         return body
     assert body is None
     return ''
 
 
+# The bodies are stored once each in a content-addressed bodies table, since search traffic repeats heavily, and the
+# rows of a comparisons table refer to them by hash. The rows are in a `comparison_rows_NNN` table, and
+# `comparisons_NNN` is a view of them with the original COLUMNS (including the bodies). There's a bodies table per
+# compression (see BodyStore): with the default (no compression), the view can be read by any sqlite client, but
+# reading compressed bodies through the view requires the function registered by `register_body_functions`. Tables
+# written before the bodies tables were added are plain `comparisons_NNN` tables, with the bodies inline.
+BODY_COLUMNS = ["request_body", "source_response_body", "target_response_body"]
+ROW_COLUMNS = [f"{c}_hash" if c in BODY_COLUMNS else c for c in COLUMNS]
+
+
+def _create_indexes(cursor: sqlite3.Cursor, table_name: str):
+    for columns in INDEXED_COLUMNS:
+        index_name = f"{table_name}_{'_'.join(columns)}_idx"
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}({','.join(columns)})")
+
+
 class dbComparisonTable:
-    def __init__(self, table_name) -> None:
+    def __init__(self, table_name, body_compression: str = "none") -> None:
         self.name = table_name
+        self.body_compression = body_compression
+        self.rows_name = f"comparison_rows_{table_name.split('_')[1]}"
+        # The insert statement is built once and reused (sqlite caches the prepared statement) for every row.
+        self.insert_statement = f"INSERT INTO {self.rows_name}({','.join(ROW_COLUMNS)}) " \
+                                f"VALUES ({','.join('?' * len(ROW_COLUMNS))})"
 
     def createTable(self, cursor: sqlite3.Cursor):
-        column_names = ','.join(COLUMNS)
-        command = f"CREATE TABLE {self.name}({column_names})"
+        column_definitions = ','.join(f"{r} {COLUMN_SQL_TYPES[c]}" for r, c in zip(ROW_COLUMNS, COLUMNS))
+        command = f"CREATE TABLE {self.rows_name}({column_definitions})"
         logger.debug(f"Command to create table: {command}")
         cursor.execute(command)
+        _create_indexes(cursor, self.rows_name)
+        self.createView(cursor)
+
+    def createView(self, cursor: sqlite3.Cursor):
+        selected_columns = []
+        joins = []
+        for c in COLUMNS:
+            if c in BODY_COLUMNS:
+                body = f"{c}_blob.body" if self.body_compression == "none" \
+                    else f"body_text('{self.body_compression}', {c}_blob.body)"
+                selected_columns.append(f"{body} AS {c}")
+                joins.append(f"LEFT JOIN {bodies_table_name(self.body_compression)} AS {c}_blob "
+                             f"ON {c}_blob.hash = rows.{c}_hash")
+            else:
+                selected_columns.append(f"rows.{c} AS {c}")
+        cursor.execute(f"CREATE VIEW {self.name} AS SELECT {', '.join(selected_columns)} "
+                       f"FROM {self.rows_name} AS rows {' '.join(joins)}")
 
 
 class dbComparisonRow:
@@ -104,6 +192,7 @@ class dbComparisonRow:
         
         if comp.original_request:
             self.request_uri = comp.original_request.uri
+            self.request_uri_template = comp.original_request.uri_template
             self.request_method = comp.original_request.http_method
             self.request_timestamp = comp.original_request.timestamp
             self.request_headers = format_headers(comp.original_request.headers)
@@ -125,27 +214,276 @@ class dbComparisonRow:
         self.headers_diff = str(comp.headers_diff)
         self.bodies_diff = str(comp.body_diff)
 
-    def writeRow(self, cursor: sqlite3.Cursor):
-        values = {}
+    def values(self, bodies: Optional[BodyStore] = None) -> Tuple[Union[str, int, None], ...]:
+        """The values of the row, in the order of COLUMNS. If a body store is given, the bodies are added to it and
+        replaced by their hashes, which is the order of ROW_COLUMNS (and the table's insert statement)."""
+        values: List[Union[str, int, None]] = []
         for c in COLUMNS:
-            if c in self.__dict__ and self.__dict__[c] is not None:
-                value = self.__dict__[c]
-                if type(value) is bool:
-                    values[c] = '1' if value else '0'
-                elif value is not None:
-                    values[c] = str(self.__dict__[c])
+            value = self.__dict__.get(c)
+            if bodies is not None and c in BODY_COLUMNS:
+                values.append(bodies.add(value or ''))
+            elif value is None or type(value) is str:
+                values.append(value)
+            elif type(value) is bool or COLUMN_SQL_TYPES[c] == "INTEGER":
+                values.append(int(value))
             else:
-                values[c] = None
+                values.append(str(value))
+        return tuple(values)
+
+    def writeRow(self, cursor: sqlite3.Cursor, bodies: BodyStore):
+        cursor.execute(self.table.insert_statement, self.values(bodies))
+        bodies.write(cursor)
+
+
+BODY_COMPRESSIONS = ["none", "zlib"]
+if zstandard is not None:
+    BODY_COMPRESSIONS.append("zstd")
+DEFAULT_BODY_COMPRESSION = "none"
+# The number of hashes of bodies that have already been written that the dumper remembers, so that it can skip
+# compressing (and re-inserting) repeated bodies.
+DEFAULT_BODY_HASH_CACHE_SIZE = 100_000
+
+
+def bodies_table_name(compression: str) -> str:
+    return "bodies" if compression == "none" else f"bodies_{compression}"
+
 
-        values_keys = ",".join(f":{k}" for k in values.keys())
-        command = f"INSERT INTO {self.table.name} VALUES ({values_keys})"
-        cursor.execute(command, values)
+def body_hash(body: str) -> str:
+    return hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def compress_body(compression: str, body: str) -> Union[str, bytes]:
+    if compression == "zlib":
+        return zlib.compress(body.encode('utf-8'))
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(body.encode('utf-8'))
+    return body
+
+
+def body_text(compression: str, body: Union[str, bytes, None]) -> Optional[str]:
+    """The text of a body from one of the bodies tables. This is registered as a sqlite function (see
+    `register_body_functions`), which is used by the comparisons views of compressed bodies."""
+    if body is None or type(body) is str:
+        return body
+    if compression == "zlib":
+        return zlib.decompress(body).decode('utf-8')
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("This body is compressed with zstd, which requires the `zstandard` package.")
+        return zstandard.ZstdDecompressor().decompress(body).decode('utf-8')
+    return body.decode('utf-8')
+
+
+def register_body_functions(con: sqlite3.Connection) -> None:
+    """Register the functions that are needed to read the bodies through the comparisons views."""
+    con.create_function("body_text", 2, body_text, deterministic=True)
+
+
+class BodyStore:
+    """Adds bodies to the content-addressed bodies table of its compression. Bodies are only compressed and written the
+    first time they're seen (as far as this store remembers), and the table ignores the ones that it already has."""
+    def __init__(self, compression: str = DEFAULT_BODY_COMPRESSION,
+                 hash_cache_size: int = DEFAULT_BODY_HASH_CACHE_SIZE) -> None:
+        if compression not in BODY_COMPRESSIONS:
+            raise ValueError(f"Unknown body compression '{compression}', expected one of {BODY_COMPRESSIONS}")
+        self.compression = compression
+        self.table_name = bodies_table_name(compression)
+        self._hash_cache_size = hash_cache_size
+        self._seen_hashes: OrderedDict[str, None] = OrderedDict()
+        self._pending_bodies: List[Tuple[str, Union[str, bytes]]] = []
+
+    def createTable(self, cursor: sqlite3.Cursor):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.table_name}(hash TEXT PRIMARY KEY, body BLOB NOT NULL)")
+
+    def add(self, body: str) -> str:
+        """Add a body (if it's new) and return its hash."""
+        hash = body_hash(body)
+        if hash in self._seen_hashes:
+            self._seen_hashes.move_to_end(hash)
+        else:
+            self._pending_bodies.append((hash, compress_body(self.compression, body)))
+            self._seen_hashes[hash] = None
+            if len(self._seen_hashes) > self._hash_cache_size:
+                self._seen_hashes.popitem(last=False)
+        return hash
+
+    def write(self, cursor: sqlite3.Cursor) -> None:
+        cursor.executemany(f"INSERT OR IGNORE INTO {self.table_name}(hash, body) VALUES (?, ?)", self._pending_bodies)
+        self._pending_bodies = []
+
+
+# The default number of (parsed) bodies cached by a BodyResolver.
+DEFAULT_BODY_CACHE_SIZE = 10_000
+
+
+class BodyResolver:
+    """This is used in the notebook to load a comparisons table with the bodies parsed as JSON. Each distinct body is
+    only read and parsed once (while it's in the cache) and the rows share the parsed object, which is much faster and
+    smaller than parsing the body of every row.
+
+    `query` selects the columns of the table, with the bodies as hashes, and `load_body` turns one of those into the
+    parsed body. For older tables, where the bodies are inline, `query` selects them as they are and `load_body` just
+    parses them."""
+    def __init__(self, con: sqlite3.Connection, table_name: str, cache_size: int = DEFAULT_BODY_CACHE_SIZE) -> None:
+        self._con = con
+        register_body_functions(con)
+        table = dbComparisonTable(table_name)
+        existing_tables = [name for name, in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self._has_body_hashes = table.rows_name in existing_tables
+        # A body can be in any of the bodies tables (the hash is of the uncompressed text).
+        self._bodies_tables = [(compression, bodies_table_name(compression)) for compression in BODY_COMPRESSIONS
+                               if bodies_table_name(compression) in existing_tables]
+        if self._has_body_hashes:
+            selected_columns = [f"{r} AS {c}" if c in BODY_COLUMNS else c for r, c in zip(ROW_COLUMNS, COLUMNS)]
+            self.query = f"SELECT {','.join(selected_columns)} FROM {table.rows_name}"
+        else:
+            self.query = f"SELECT * FROM {table_name}"
+        self.load_body = lru_cache(maxsize=cache_size)(self._load_body)
+
+    def _load_body(self, value: Optional[str]) -> Union[str, dict, None]:
+        if value is None:
+            return None
+        if self._has_body_hashes:
+            value = self.text(value)
+            if value is None:
+                return None
+        return json_load_function(value)
+
+    def text(self, hash: str) -> Optional[str]:
+        """The text of the body with this hash."""
+        for compression, bodies_table in self._bodies_tables:
+            result = self._con.execute(f"SELECT body FROM {bodies_table} WHERE hash = ?", (hash,)).fetchone()
+            if result:
+                return body_text(compression, result[0])
+        return None
+
+
+# The rollup tables summarize a comparisons table, so that the common questions (match rates and latency
+# distributions per endpoint and over time) can be answered without reading every row. They're maintained as rows are
+# written. Rows are grouped by these key columns -- the minute is the start of the minute of the request timestamp.
+# Missing uri templates and methods are stored as '', and missing statuses and timestamps as 0 (so rows without a
+# timestamp are all in minute 0, whether they're rolled up as they're written or backfilled), so that they're grouped
+# together (sqlite considers NULLs distinct in unique keys).
+ROLLUP_KEY_COLUMNS = ['request_uri_template', 'request_method', 'source_response_status', 'target_response_status',
+                      'minute']
+ROLLUP_VALUE_COLUMNS = ['comparisons', 'identical', 'source_latency_count', 'source_latency_sum',
+                        'target_latency_count', 'target_latency_sum']
+# The latency histograms use the buckets of a LatencyHistogram with this (coarse) relative accuracy, which keeps the
+# number of buckets small (about 45 between 1ms and 10s).
+ROLLUP_HISTOGRAM_ACCURACY = 0.1
+HISTOGRAM_KEY_COLUMNS = ROLLUP_KEY_COLUMNS + ['cluster', 'bucket']
+_histogram_buckets = LatencyHistogram(ROLLUP_HISTOGRAM_ACCURACY)
+
+
+def latency_bucket(latency: Optional[int]) -> Optional[int]:
+    """The index of the rollup histogram bucket of a latency. Non-positive latencies aren't counted (as in the
+    PerformanceReport)."""
+    if latency is None or latency <= 0:
+        return None
+    return _histogram_buckets.bucket_index(latency)
+
+
+def latency_bucket_upper_bound(bucket: int) -> float:
+    return _histogram_buckets.bucket_bounds(bucket)[1]
+
+
+def _upsert_statement(table_name: str, key_columns: List[str], value_columns: List[str]) -> str:
+    columns = key_columns + value_columns
+    updates = ','.join(f"{c} = {c} + excluded.{c}" for c in value_columns)
+    return f"INSERT INTO {table_name}({','.join(columns)}) VALUES ({','.join('?' * len(columns))}) " \
+           f"ON CONFLICT({','.join(key_columns)}) DO UPDATE SET {updates}"
+
+
+class dbRollupTables:
+    def __init__(self, comparisons_table_name: str) -> None:
+        table_id = comparisons_table_name.split('_')[1]
+        self.comparisons_table_name = comparisons_table_name
+        self.rollup_name = f"rollup_{table_id}"
+        self.histogram_name = f"latency_histogram_{table_id}"
+        self._rollup_upsert = _upsert_statement(self.rollup_name, ROLLUP_KEY_COLUMNS, ROLLUP_VALUE_COLUMNS)
+        self._histogram_upsert = _upsert_statement(self.histogram_name, HISTOGRAM_KEY_COLUMNS,
+                                                   ['bucket_upper_ms', 'count'])
+        # These accumulate the rows that haven't been written yet. The histogram values are the bucket counts.
+        self._pending_rollups: Dict[tuple, List[int]] = {}
+        self._pending_histograms: Dict[tuple, int] = {}
+
+    def createTables(self, cursor: sqlite3.Cursor):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.rollup_name}("
+                       "request_uri_template TEXT NOT NULL, request_method TEXT NOT NULL, "
+                       "source_response_status INTEGER NOT NULL, target_response_status INTEGER NOT NULL, "
+                       "minute INTEGER NOT NULL, "
+                       f"{','.join(f'{c} INTEGER NOT NULL' for c in ROLLUP_VALUE_COLUMNS)}, "
+                       f"PRIMARY KEY({','.join(ROLLUP_KEY_COLUMNS)}))")
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.histogram_name}("
+                       "request_uri_template TEXT NOT NULL, request_method TEXT NOT NULL, "
+                       "source_response_status INTEGER NOT NULL, target_response_status INTEGER NOT NULL, "
+                       "minute INTEGER NOT NULL, cluster TEXT NOT NULL, bucket INTEGER NOT NULL, "
+                       "bucket_upper_ms REAL NOT NULL, count INTEGER NOT NULL, "
+                       f"PRIMARY KEY({','.join(HISTOGRAM_KEY_COLUMNS)}))")
+
+    def add(self, row: dbComparisonRow) -> None:
+        request_timestamp = row.__dict__.get('request_timestamp')
+        timestamp = int(request_timestamp) if request_timestamp is not None else 0
+        key = (row.__dict__.get('request_uri_template') or '', row.__dict__.get('request_method') or '',
+               row.__dict__.get('source_response_status') or 0, row.__dict__.get('target_response_status') or 0,
+               timestamp - timestamp % 60)
+        values = self._pending_rollups.setdefault(key, [0] * len(ROLLUP_VALUE_COLUMNS))
+        values[0] += 1
+        values[1] += 1 if row.responses_are_identical else 0
+        for offset, cluster in [(2, 'source'), (4, 'target')]:
+            latency = row.__dict__.get(f'{cluster}_response_latency')
+            bucket = latency_bucket(latency)
+            if bucket is None:
+                continue
+            values[offset] += 1
+            values[offset + 1] += latency
+            histogram_key = key + (cluster, bucket)
+            self._pending_histograms[histogram_key] = self._pending_histograms.get(histogram_key, 0) + 1
+
+    def write(self, cursor: sqlite3.Cursor) -> None:
+        """Add the pending rows to the rollup tables. This should be called in the same transaction that writes the
+        rows to the comparisons table."""
+        cursor.executemany(self._rollup_upsert, [key + tuple(values) for key, values in self._pending_rollups.items()])
+        cursor.executemany(self._histogram_upsert, [key + (latency_bucket_upper_bound(key[-1]), count)
+                                                    for key, count in self._pending_histograms.items()])
+        self._pending_rollups = {}
+        self._pending_histograms = {}
+
+    def backfill(self, cursor: sqlite3.Cursor) -> None:
+        """Build the rollups of an existing comparisons table. This requires the `latency_bucket` and
+        `latency_bucket_upper_bound` functions to be registered on the connection."""
+        key_values = "IFNULL(request_uri_template, ''), IFNULL(request_method, ''), " \
+                     "IFNULL(source_response_status, 0), IFNULL(target_response_status, 0), " \
+                     "IFNULL(request_timestamp - request_timestamp % 60, 0)"
+        cursor.execute(f"INSERT INTO {self.rollup_name} SELECT {key_values}, COUNT(*), "
+                       "IFNULL(SUM(responses_are_identical), 0), "
+                       "IFNULL(SUM(source_response_latency > 0), 0), "
+                       "IFNULL(SUM(CASE WHEN source_response_latency > 0 THEN source_response_latency END), 0), "
+                       "IFNULL(SUM(target_response_latency > 0), 0), "
+                       "IFNULL(SUM(CASE WHEN target_response_latency > 0 THEN target_response_latency END), 0) "
+                       f"FROM {self.comparisons_table_name} GROUP BY 1, 2, 3, 4, 5")
+        for cluster in ['source', 'target']:
+            cursor.execute(f"INSERT INTO {self.histogram_name} SELECT {key_values}, '{cluster}', "
+                           f"latency_bucket({cluster}_response_latency) AS bucket, "
+                           f"latency_bucket_upper_bound(latency_bucket({cluster}_response_latency)), COUNT(*) "
+                           f"FROM {self.comparisons_table_name} WHERE {cluster}_response_latency > 0 "
+                           "GROUP BY 1, 2, 3, 4, 5, bucket")
+
+
+COMPARISONS_TABLE_PATTERN = re.compile(r"comparisons_(\d+)")
+
+
+def get_comparisons_table_names(cursor: sqlite3.Cursor) -> List[str]:
+    """The names of all of the comparisons tables, in the order they were created."""
+    results = cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')").fetchall()
+    matches = [COMPARISONS_TABLE_PATTERN.fullmatch(name) for name, in results]
+    return [match.group(0) for match in sorted(filter(None, matches), key=lambda m: int(m.group(1)))]
 
 
 def get_latest_table_name(cursor: sqlite3.Cursor) -> Optional[str]:
-    results = cursor.execute("SELECT name FROM sqlite_master").fetchall()
-    if len(results) > 0:
-        return sorted(results)[-1][0]
+    table_names = get_comparisons_table_names(cursor)
+    if len(table_names) > 0:
+        return table_names[-1]
     return None
 
 
@@ -158,20 +496,192 @@ def get_next_table_name(cursor: sqlite3.Cursor) -> str:
         latest_id = 0
     return f"comparisons_{latest_id+1:03}"
 
+
+# Schema versions:
+# 1. Untyped columns, no indexes, all values stored as text (there was no schema_version table).
+# 2. Typed columns (see COLUMN_SQL_TYPES), the request_uri_template column and indexes (see INDEXED_COLUMNS).
+# 3. Each comparisons table has rollup tables (see dbRollupTables).
+SCHEMA_VERSION = 3
+
+
+def get_schema_version(cursor: sqlite3.Cursor) -> Optional[int]:
+    """The schema version of the db, or None if it's a new db (i.e. it doesn't have any tables yet)."""
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'").fetchone():
+        return cursor.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    if get_comparisons_table_names(cursor):
+        return 1
+    return None
+
+
+def _set_schema_version(cursor: sqlite3.Cursor, version: int) -> None:
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version(version INTEGER NOT NULL)")
+    cursor.execute("DELETE FROM schema_version")
+    cursor.execute("INSERT INTO schema_version VALUES (?)", (version,))
+
+
+def _migrate_from_version_1(con: sqlite3.Connection) -> None:
+    con.create_function("uri_template", 1, uriTemplate, deterministic=True)
+    cursor = con.cursor()
+    for table_name in get_comparisons_table_names(cursor):
+        logger.warning(f"Migrating table {table_name} to schema version 2.")
+        migrated_table = dbComparisonTable(f"{table_name}_migrating")
+        cursor.execute(f"CREATE TABLE {migrated_table.name}"
+                       f"({','.join(f'{c} {COLUMN_SQL_TYPES[c]}' for c in COLUMNS)})")
+        # The values were all stored as text, so the integer columns need to be cast.
+        selected_values = [f"CAST({c} AS INTEGER)" if COLUMN_SQL_TYPES[c] == "INTEGER" else c
+                           for c in COLUMNS if c != "request_uri_template"]
+        selected_values.insert(COLUMNS.index("request_uri_template"), "uri_template(request_uri)")
+        cursor.execute(f"INSERT INTO {migrated_table.name}({','.join(COLUMNS)}) "
+                       f"SELECT {','.join(selected_values)} FROM {table_name}")
+        cursor.execute(f"DROP TABLE {table_name}")
+        cursor.execute(f"ALTER TABLE {migrated_table.name} RENAME TO {table_name}")
+        _create_indexes(cursor, table_name)
+
+
+def _migrate_from_version_2(con: sqlite3.Connection) -> None:
+    con.create_function("latency_bucket", 1, latency_bucket, deterministic=True)
+    con.create_function("latency_bucket_upper_bound", 1, latency_bucket_upper_bound, deterministic=True)
+    cursor = con.cursor()
+    for table_name in get_comparisons_table_names(cursor):
+        logger.warning(f"Building the rollup tables for {table_name}.")
+        rollup_tables = dbRollupTables(table_name)
+        rollup_tables.createTables(cursor)
+        rollup_tables.backfill(cursor)
+
+
+def migrate_schema(con: sqlite3.Connection) -> None:
+    """Bring the db up to the current SCHEMA_VERSION, migrating the existing comparisons tables if necessary."""
+    version = get_schema_version(con.cursor())
+    if version == SCHEMA_VERSION:
+        return
+    with con:  # All of the migrations are done in a single transaction.
+        if version is not None and version <= 1:
+            _migrate_from_version_1(con)
+        if version is not None and version <= 2:
+            _migrate_from_version_2(con)
+        _set_schema_version(con.cursor(), SCHEMA_VERSION)
+
+
+def match_rate_by_endpoint_rollup_query(table_name: str) -> str:
+    """The same results as `match_rate_by_endpoint_query` (except for the ordering of ties), from the rollup table of a
+    comparisons table."""
+    rollup_name = dbRollupTables(table_name).rollup_name
+    return f"""SELECT request_uri_template, request_method, SUM(comparisons) AS comparisons,
+    1.0 * SUM(identical) / SUM(comparisons) AS match_rate,
+    1.0 * SUM(CASE WHEN source_response_status = target_response_status THEN comparisons ELSE 0 END)
+        / SUM(comparisons) AS status_match_rate
+FROM {rollup_name} GROUP BY request_uri_template, request_method ORDER BY comparisons DESC"""
+
+
+def latency_histogram_rollup_query(table_name: str) -> str:
+    """A query for the source and target latency histograms (the count of latencies in each bucket, with the bucket's
+    upper bound in ms) per endpoint, from the rollup tables of a comparisons table."""
+    histogram_name = dbRollupTables(table_name).histogram_name
+    return f"""SELECT request_uri_template, request_method, cluster, bucket_upper_ms, SUM(count) AS count
+FROM {histogram_name} GROUP BY request_uri_template, request_method, cluster, bucket
+ORDER BY request_uri_template, request_method, cluster, bucket"""
+
+
+def match_rate_by_endpoint_query(table_name: str) -> str:
+    """A query for the number of comparisons and the rate of identical responses per endpoint (URI template and
+    method). This runs entirely in sqlite (using the indexes), so there's no need to load the whole table."""
+    return f"""SELECT request_uri_template, request_method, COUNT(*) AS comparisons,
+    AVG(responses_are_identical) AS match_rate,
+    AVG(source_response_status = target_response_status) AS status_match_rate
+FROM {table_name} GROUP BY request_uri_template, request_method ORDER BY comparisons DESC"""
+
+
+def latency_by_endpoint_query(table_name: str) -> str:
+    """A query for the latency stats of the source and target cluster per endpoint (URI template and method)."""
+    return f"""SELECT request_uri_template, request_method, COUNT(*) AS comparisons,
+    AVG(source_response_latency) AS source_average_latency, MAX(source_response_latency) AS source_max_latency,
+    AVG(target_response_latency) AS target_average_latency, MAX(target_response_latency) AS target_max_latency
+FROM {table_name} GROUP BY request_uri_template, request_method ORDER BY comparisons DESC"""
+
+
+# Rows are written in batches, each in a single transaction, because committing every row makes fsync the bottleneck.
+# A batch is written when it's full, or when a row arrives and the previous batch was written more than the flush
+# interval ago (and, of course, when the dumper is closed). While no rows arrive (e.g. while the input is idle), a
+# background thread writes the pending rows once they're older than the flush interval, so that readers see them (and
+# they aren't lost if the process is killed) within about twice the interval.
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = timedelta(seconds=1)
+# WAL mode lets readers (e.g. the Jupyter notebook) query the db while rows are still being written, and with WAL,
+# `synchronous=NORMAL` is still safe from corruption (only the last transactions can be lost on a power failure).
+DEFAULT_JOURNAL_MODE = "WAL"
+DEFAULT_SYNCHRONOUS = "NORMAL"
+JOURNAL_MODES = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+SYNCHRONOUS_SETTINGS = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
             
-class SqliteDumper:
-    def __init__(self, db_file: pathlib.Path) -> None:
-        self.con = sqlite3.connect(db_file)  # Creates the db if it doesn't already exist
+class SqliteDumper(BaseComparisonSink):
+    def __init__(self, db_file: pathlib.Path, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: timedelta = DEFAULT_FLUSH_INTERVAL, journal_mode: str = DEFAULT_JOURNAL_MODE,
+                 synchronous: str = DEFAULT_SYNCHRONOUS, body_compression: str = DEFAULT_BODY_COMPRESSION) -> None:
+        self.bodies = BodyStore(body_compression)
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode '{journal_mode}', expected one of {JOURNAL_MODES}")
+        if synchronous.upper() not in SYNCHRONOUS_SETTINGS:
+            raise ValueError(f"Unknown synchronous setting '{synchronous}', expected one of {SYNCHRONOUS_SETTINGS}")
+        # This creates the db if it doesn't already exist. The dumper may be used from another thread than the one that
+        # created it (e.g. by the `serve` command), but never from more than one at a time.
+        self.con = sqlite3.connect(db_file, check_same_thread=False)
+        self.con.execute(f"PRAGMA journal_mode={journal_mode}")
+        self.con.execute(f"PRAGMA synchronous={synchronous}")
+        migrate_schema(self.con)
         self.cur = self.con.cursor()
         table_name = get_next_table_name(self.cur)
-        self.table = dbComparisonTable(table_name)
+        self.table = dbComparisonTable(table_name, body_compression)
         logger.warning(f"Writing to db table {table_name}.")
+        self.bodies.createTable(self.cur)
         self.table.createTable(self.cur)
+        self.rollup_tables = dbRollupTables(table_name)
+        self.rollup_tables.createTables(self.cur)
         self.con.commit()
 
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval.total_seconds()
+        self._pending_rows: List[Tuple[Union[str, int, None], ...]] = []
+        self._last_flushed = time.monotonic()
+        self.rows_written = 0
+        # The pending rows (and the connection) are shared with the flusher thread.
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        if self._flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_when_idle, name="sqlite-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_when_idle(self) -> None:
+        while not self._closed.wait(self._flush_interval):
+            with self._lock:
+                if self._pending_rows and time.monotonic() - self._last_flushed >= self._flush_interval:
+                    self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending_rows:
+            with self.con:  # Commits the transaction when the block exits (or rolls back if there's an error).
+                self.bodies.write(self.cur)
+                self.con.executemany(self.table.insert_statement, self._pending_rows)
+                self.rollup_tables.write(self.cur)
+            self.rows_written += len(self._pending_rows)
+            logger.debug(f"Wrote {len(self._pending_rows)} rows to {self.table.name}.")
+            self._pending_rows = []
+        self._last_flushed = time.monotonic()
+
     def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        # Move everything from the WAL (if there is one) into the db file, so that it's self-contained.
+        self.con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
         self.con.close()
-        logger.warning(f"Finished writing to db table {self.table.name}.")
+        logger.warning(f"Finished writing {self.rows_written} rows to db table {self.table.name}.")
 
     def update(self, line: str) -> None:
         comp = None
@@ -184,8 +694,14 @@ class SqliteDumper:
 
         if comp is None:
             return
-        
+        self.add(comp)
+
+    def add(self, comp: ResponseComparison) -> None:
+        """Add a comparison that's already been loaded (e.g. by `wire_format.read_comparisons`)."""
         row = dbComparisonRow(self.table, comp)
-        row.writeRow(self.cur)
-        self.con.commit()
-        
+        with self._lock:
+            self._pending_rows.append(row.values(self.bodies))
+            self.rollup_tables.add(row)
+            if len(self._pending_rows) >= self._batch_size or \
+                    time.monotonic() - self._last_flushed >= self._flush_interval:
+                self._flush()
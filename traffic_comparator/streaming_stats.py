@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import List, Optional, Sequence
+
+from traffic_comparator.reports import format_latency_summary, format_match_summary
+from traffic_comparator.response_comparison import ResponseComparison
+from traffic_comparator.sketches import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+
+class ComparisonStats:
+    """Running totals of the statistics shown by the DiffReport and PerformanceReport summaries.
+
+    Each comparison is folded into a few counters and a pair of latency histograms as it arrives, so the cost of
+    updating (and of printing a summary) doesn't depend on how many comparisons have been seen, and the comparisons
+    themselves don't need to be kept around. Two ComparisonStats can be merged, e.g. to combine per-interval stats.
+    """
+    def __init__(self) -> None:
+        self.total_comparisons = 0
+        self.number_identical = 0
+        self.statuses_identical = 0
+        self.primary_latencies = LatencyHistogram()
+        self.shadow_latencies = LatencyHistogram()
+
+    def update(self, comparison: ResponseComparison) -> None:
+        self.total_comparisons += 1
+        if comparison.are_identical():
+            self.number_identical += 1
+        if comparison.primary_response.statuscode == comparison.shadow_response.statuscode:
+            self.statuses_identical += 1
+        # As in the PerformanceReport, non-positive latencies are excluded from the stats.
+        if comparison.primary_response.latency and comparison.primary_response.latency > 0:
+            self.primary_latencies.add(comparison.primary_response.latency)
+        if comparison.shadow_response.latency and comparison.shadow_response.latency > 0:
+            self.shadow_latencies.add(comparison.shadow_response.latency)
+
+    def merge(self, other: ComparisonStats) -> None:
+        self.total_comparisons += other.total_comparisons
+        self.number_identical += other.number_identical
+        self.statuses_identical += other.statuses_identical
+        self.primary_latencies.merge(other.primary_latencies)
+        self.shadow_latencies.merge(other.shadow_latencies)
+
+    def __str__(self) -> str:
+        return format_match_summary(self.total_comparisons, self.number_identical, self.statuses_identical) + "\n" + \
+            format_latency_summary(self.primary_latencies.quantiles([0.99, 0.90, 0.50]), self.primary_latencies.mean,
+                                   self.shadow_latencies.quantiles([0.99, 0.90, 0.50]), self.shadow_latencies.mean)
+
+
+# The windows shown next to the cumulative stats in the streaming display, in seconds. Their stats are merged from a
+# ring of per-interval stats, so the interval is the granularity of the windows.
+DEFAULT_WINDOWS = (60, 300, 900)
+DEFAULT_WINDOW_INTERVAL = 10
+
+
+def comparison_time(comparison: ResponseComparison) -> float:
+    """The time of a comparison for the windowed stats: the timestamp of its request (from the triple), if it has one,
+    or the current time otherwise."""
+    request = comparison.original_request
+    if request is not None and request.timestamp is not None:
+        return request.timestamp
+    return time.time()
+
+
+class WindowedStats:
+    """ComparisonStats of the last few minutes (e.g. 1m, 5m and 15m), to show recent changes that are invisible in the
+    cumulative stats of a long stream.
+
+    Each comparison is added to the stats of its interval, in a ring buffer with one slot per interval of the longest
+    window. A slot is reset when a comparison from a newer interval reaches it, so updating doesn't depend on how
+    many comparisons have been seen, and the stats of a window are only merged from its slots when they're shown.
+    Windows end at the latest time seen (which is the current time, unless the comparisons have timestamps, e.g. when
+    replaying older traffic), and comparisons that are older than the longest window are only counted cumulatively.
+    """
+    def __init__(self, windows: Sequence[int] = DEFAULT_WINDOWS, interval: int = DEFAULT_WINDOW_INTERVAL) -> None:
+        self.windows = sorted(windows)
+        self.interval = interval
+        self._slots = [ComparisonStats() for _ in range(-(-self.windows[-1] // interval))]
+        self._slot_intervals: List[Optional[int]] = [None] * len(self._slots)
+        self._latest_interval: Optional[int] = None
+
+    def update(self, comparison: ResponseComparison, timestamp: Optional[float] = None) -> None:
+        interval = int((timestamp if timestamp is not None else comparison_time(comparison)) // self.interval)
+        if self._latest_interval is None or interval > self._latest_interval:
+            self._latest_interval = interval
+        elif interval <= self._latest_interval - len(self._slots):
+            return
+        slot = interval % len(self._slots)
+        if self._slot_intervals[slot] != interval:
+            self._slots[slot] = ComparisonStats()
+            self._slot_intervals[slot] = interval
+        self._slots[slot].update(comparison)
+
+    def window(self, seconds: int) -> ComparisonStats:
+        """The stats of the comparisons of the intervals in the last `seconds`."""
+        stats = ComparisonStats()
+        if self._latest_interval is None:
+            return stats
+        first_interval = self._latest_interval - -(-seconds // self.interval) + 1
+        for slot_interval, slot_stats in zip(self._slot_intervals, self._slots):
+            if slot_interval is not None and first_interval <= slot_interval <= self._latest_interval:
+                stats.merge(slot_stats)
+        return stats
+
+
+def format_windowed_summary(cumulative: ComparisonStats, windowed: WindowedStats) -> str:
+    """A table of the stats of each window, next to the cumulative ones."""
+    columns = [(f"last {format_duration(seconds)}", windowed.window(seconds)) for seconds in windowed.windows]
+    columns.append(("total", cumulative))
+
+    def rate(count: int, stats: ComparisonStats) -> str:
+        return f"{count / stats.total_comparisons:.2%}" if stats.total_comparisons else "-"
+
+    def latency(histogram, q: float) -> str:
+        return f"{histogram.quantile(q):.1f}" if histogram.count else "-"
+    rows = [("", [name for name, _ in columns]),
+            ("comparisons", [str(stats.total_comparisons) for _, stats in columns]),
+            ("match rate", [rate(stats.number_identical, stats) for _, stats in columns]),
+            ("status match rate", [rate(stats.statuses_identical, stats) for _, stats in columns])]
+    for cluster in ["primary", "shadow"]:
+        for q in [0.5, 0.9, 0.99]:
+            rows.append((f"{cluster} p{q * 100:g} latency",
+                         [latency(getattr(stats, f"{cluster}_latencies"), q) for _, stats in columns]))
+    width = max(len(label) for label, _ in rows)
+    return "\n".join(f"    {label:<{width}}" + "".join(f"{cell:>12}" for cell in cells) for label, cells in rows) + "\n"
+
+
+def format_duration(seconds: int) -> str:
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
@@ -0,0 +1,120 @@
+import gzip
+import io
+import logging
+import mmap
+import os
+from pathlib import Path
+from typing import IO, Iterator, List, NamedTuple, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional (`pip install .[zstd]`), it's only needed to read zstd-compressed files.
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Triples files on disk (e.g. the logs of a Replayer) are read in chunks of about this many bytes, which always end at
+# a line break. With multiple workers, each chunk is parsed and compared by one of them. An uncompressed file is
+# memory-mapped and the workers read their own byte range of it, so only the boundaries of the ranges are passed
+# to them. A compressed file can't be split without decompressing it, so it's decompressed (and split) in the main
+# process and the chunks themselves are passed to the workers.
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class UnsupportedTriplesFileException(Exception):
+    def __init__(self, path, details) -> None:
+        super().__init__(f"The triples file '{path}' can't be read. Details: {details}")
+
+
+class FileRange(NamedTuple):
+    """A range of bytes ([start, end)) of an uncompressed file, which starts and ends on line boundaries."""
+    path: str
+    start: int
+    end: int
+
+
+def detect_compression(path: Union[str, Path]) -> Optional[str]:
+    """The compression of a file ("gzip" or "zstd"), detected from its first bytes, or None if it's uncompressed."""
+    with open(path, 'rb') as f:
+        start = f.read(len(ZSTD_MAGIC))
+    if start.startswith(GZIP_MAGIC):
+        return "gzip"
+    if start.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def open_triples_file(path: Union[str, Path]) -> IO[bytes]:
+    """Open a (possibly gzip or zstd-compressed) triples file, as a binary stream of the decompressed lines."""
+    compression = detect_compression(path)
+    if compression == "gzip":
+        return gzip.open(path, 'rb')
+    if compression == "zstd":
+        if zstandard is None:
+            raise UnsupportedTriplesFileException(path, "It's compressed with zstd, which isn't installed "
+                                                        "(`pip install .[zstd]`).")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.BufferedReader(reader)  # type: ignore
+    return open(path, 'rb')
+
+
+def split_ranges(path: Union[str, Path], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[FileRange]:
+    """Split an uncompressed file into ranges of about `chunk_size` bytes that end at a line break (or at the end of
+    the file)."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return  # An empty file can't be memory-mapped.
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            newline = mm.find(b"\n", min(start + chunk_size, size) - 1)
+            end = size if newline == -1 else newline + 1
+            yield FileRange(str(path), start, end)
+            start = end
+
+
+def range_lines(file_range: FileRange) -> Iterator[bytes]:
+    """The lines in a range of a file, read through a memory map of it."""
+    with open(file_range.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL, file_range.start - file_range.start % mmap.PAGESIZE)
+        mm.seek(file_range.start)
+        # The range ends at a line break, so none of these lines extend past it.
+        while mm.tell() < file_range.end:
+            yield mm.readline()
+
+
+def split_stream(stream: IO[bytes], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Split a stream into chunks of about `chunk_size` bytes that end at a line break (or at the end of the stream)."""
+    lines: List[bytes] = []
+    size = 0
+    for line in stream:
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b"".join(lines)
+            lines, size = [], 0
+    if lines:
+        yield b"".join(lines)
+
+
+def file_chunks(path: Union[str, Path], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[FileRange, bytes]]:
+    """Split a triples file into chunks of lines (see `chunk_lines`): the byte ranges of an uncompressed file, or the
+    decompressed chunks of a compressed one."""
+    compression = detect_compression(path)
+    if compression is None:
+        yield from split_ranges(path, chunk_size)
+        return
+    logger.info(f"The triples file is compressed with {compression}, so it's decompressed in a single process.")
+    with open_triples_file(path) as stream:
+        yield from split_stream(stream, chunk_size)
+
+
+def chunk_lines(chunk: Union[FileRange, bytes]) -> Iterator[bytes]:
+    """The lines of a chunk from `file_chunks`."""
+    if isinstance(chunk, FileRange):
+        return range_lines(chunk)
+    return iter(chunk.splitlines(keepends=True))
@@ -0,0 +1,161 @@
+import itertools
+import logging
+import struct
+import time
+from typing import IO, Any, Iterable, Iterator, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional (`pip install .[msgpack]`), the binary format falls back to json payloads.
+    msgpack = None
+
+from traffic_comparator import codec, metrics
+from traffic_comparator.response_comparison import (
+    InvalidJsonForLoadingComparisonException,
+    MissingFieldForLoadingComparisonJsonException, ResponseComparison,
+    serialize_diff_value)
+
+logger = logging.getLogger(__name__)
+
+# Comparisons are passed between `stream` and its consumers (`stream-report`, `dump-to-sqlite`) in one of these formats:
+# - json: one json object per line (the output of `ResponseComparison.to_json`). This is the default.
+# - binary: a header (MAGIC, the format version and the payload encoding), followed by one frame per comparison: the
+#   length of the payload (a 4 byte big-endian unsigned int) and the payload, which is the comparison dict encoded with
+#   msgpack if it's installed, or json otherwise. Consumers don't need to search for line breaks, and with msgpack,
+#   encoding and decoding are cheaper than with json.
+# Either format can carry summary comparisons (see `ResponseComparison.to_dict`), which leave out the bodies, headers
+# and diff values. The reading side detects the format from the first bytes of the stream.
+WIRE_FORMATS = ["json", "binary"]
+DEFAULT_WIRE_FORMAT = "json"
+
+# This can't be the start of a json line.
+MAGIC = b"\x00TCR"
+FORMAT_VERSION = 1
+MSGPACK_PAYLOAD = b"m"
+JSON_PAYLOAD = b"j"
+_FRAME_LENGTH = struct.Struct(">I")
+
+
+class UnknownWireFormatException(Exception):
+    def __init__(self, wire_format) -> None:
+        super().__init__(f"The wire format '{wire_format}' is unknown. Available formats are: {WIRE_FORMATS}")
+
+
+class UnsupportedBinaryStreamException(Exception):
+    def __init__(self, details) -> None:
+        super().__init__(f"The binary comparison stream can't be read. Details: {details}")
+
+
+class RecordEncoder:
+    """Encodes comparisons into records of a wire format. This is picklable, so the comparisons can be encoded in the
+    worker processes."""
+    def __init__(self, wire_format: str = DEFAULT_WIRE_FORMAT, summary_only: bool = False) -> None:
+        if wire_format not in WIRE_FORMATS:
+            raise UnknownWireFormatException(wire_format)
+        self.wire_format = wire_format
+        self.summary_only = summary_only
+        self.payload_encoding = MSGPACK_PAYLOAD if msgpack is not None else JSON_PAYLOAD
+
+    @property
+    def is_binary(self) -> bool:
+        return self.wire_format == "binary"
+
+    def header(self) -> bytes:
+        """The bytes that start a stream of records (none for json)."""
+        if self.is_binary:
+            return MAGIC + bytes([FORMAT_VERSION]) + self.payload_encoding
+        return b""
+
+    def encode(self, comparison: ResponseComparison) -> Union[str, bytes]:
+        """A json line (without the line break) or a binary frame."""
+        if not self.is_binary:
+            return comparison.to_json(self.summary_only)
+        comparison_dict = comparison.to_dict(self.summary_only)
+        if self.payload_encoding == MSGPACK_PAYLOAD:
+            payload = msgpack.packb(comparison_dict, default=serialize_diff_value)
+        else:
+            payload = codec.dumps(comparison_dict, default=serialize_diff_value).encode('utf-8')
+        return _FRAME_LENGTH.pack(len(payload)) + payload
+
+
+def _read_exactly(stream: IO[bytes], size: int) -> bytes:
+    data = stream.read(size)
+    if 0 < len(data) < size:
+        raise UnsupportedBinaryStreamException(f"The stream ended in the middle of a frame ({len(data)} of {size} "
+                                               "bytes).")
+    return data
+
+
+def _binary_payloads(stream: IO[bytes]) -> Iterator[Any]:
+    header = _read_exactly(stream, 2)
+    if len(header) < 2:
+        return
+    version, payload_encoding = header[0], header[1:]
+    if version != FORMAT_VERSION:
+        raise UnsupportedBinaryStreamException(f"Version {version} isn't supported (expected {FORMAT_VERSION}).")
+    if payload_encoding == MSGPACK_PAYLOAD:
+        if msgpack is None:
+            raise UnsupportedBinaryStreamException("The payloads are encoded with msgpack, which isn't installed.")
+        decode = msgpack.unpackb
+    elif payload_encoding == JSON_PAYLOAD:
+        decode = codec.loads
+    else:
+        raise UnsupportedBinaryStreamException(f"Unknown payload encoding {payload_encoding!r}.")
+
+    while True:
+        length = _read_exactly(stream, _FRAME_LENGTH.size)
+        if not length:
+            return
+        payload = _read_exactly(stream, _FRAME_LENGTH.unpack(length)[0])
+        try:
+            yield decode(payload)
+        except Exception as e:
+            # The frames are delimited by their lengths, so the next one can still be read.
+            logger.error(f"Comparison could not be loaded due to an invalid payload. Skipping frame. Details: {e}")
+
+
+def read_comparisons(stream: IO[bytes], include_bodies: bool = True) -> Iterator[ResponseComparison]:
+    """Read the comparisons from a (binary) stream in any of the WIRE_FORMATS, detected from its first bytes. Lines or
+    frames that can't be loaded are logged and skipped. `include_bodies` is as in `ResponseComparison.from_json`."""
+    start = stream.read(len(MAGIC))
+    if start == MAGIC:
+        logger.info("Reading comparisons in the binary format.")
+        for comparison_dict in _binary_payloads(stream):
+            metrics.count_line("comparisons")
+            start = time.perf_counter()
+            try:
+                comparison = ResponseComparison.from_dict(comparison_dict, include_bodies)
+            except MissingFieldForLoadingComparisonJsonException as e:
+                logger.error(f"Comparison could not be loaded due to a missing field. Skipping frame. Details: {e}")
+                metrics.count_parse_failure("comparisons")
+                continue
+            yield _observed(comparison, start)
+        return
+
+    # The bytes that were read to detect the format are the start of the first line (or lines, if they're short).
+    head = start if start.endswith(b"\n") else start + stream.readline()
+    yield from _comparisons_from_lines(itertools.chain(head.splitlines(keepends=True), stream), include_bodies)
+
+
+def _comparisons_from_lines(lines: Iterable[bytes], include_bodies: bool) -> Iterator[ResponseComparison]:
+    for line in lines:
+        if not line.strip():
+            continue
+        metrics.count_line("comparisons")
+        start = time.perf_counter()
+        try:
+            comparison = ResponseComparison.from_json(line, include_bodies)
+        except InvalidJsonForLoadingComparisonException as e:
+            logger.error(f"Comparison could not be loaded due to invalid json. Skipping line. Details: {e}")
+            metrics.count_parse_failure("comparisons")
+        except MissingFieldForLoadingComparisonJsonException as e:
+            logger.error(f"Comparison could not be loaded due to a missing field. Skipping line. Details: {e}")
+            metrics.count_parse_failure("comparisons")
+        else:
+            yield _observed(comparison, start)
+
+
+def _observed(comparison: ResponseComparison, load_start: float) -> ResponseComparison:
+    metrics.observe_stage("load", time.perf_counter() - load_start)
+    metrics.observe_comparison(comparison)
+    return comparison